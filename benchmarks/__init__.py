@@ -0,0 +1,4 @@
+# #
+# # SEA / SMART ENGINEERING ASSISTANT
+# # Copyright (c) 2024 SilentByte <https://silentbyte.com/>
+# #
@@ -0,0 +1,104 @@
+# #
+# # SEA / SMART ENGINEERING ASSISTANT
+# # Copyright (c) 2024 SilentByte <https://silentbyte.com/>
+# #
+
+# Usage: python -m benchmarks.import_time [--output import_time.json]
+#
+# Measures the import time of modules loaded by every gunicorn and Spark Python worker using `python -X importtime`.
+# Each module is imported in a fresh interpreter. Exits with a non-zero status if a module exceeds its budget.
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+SERVER_DIR = ROOT_DIR / 'sea_server'
+
+# (module, budget in milliseconds)
+MODULES = [
+    ('sea', 100),
+    ('core.businesslogic', 500),
+    ('core.views', 500),
+]
+
+# Settings are required to import Django modules, but no connections are established by importing them.
+PLACEHOLDER_ENVIRONMENT = {
+    'DJANGO_SETTINGS_MODULE': 'server.settings',
+    'DB_HOST': 'localhost',
+    'DB_PORT': '5432',
+    'DB_NAME': 'sea',
+    'DB_USER': 'sea',
+    'DB_PASSWORD': 'sea',
+    'SECRET_KEY': 'import-time',
+    'DOCUMENT_DIR': '.',
+}
+
+
+def measure_import_time(module: str) -> float:
+    if module.startswith('core.'):
+        # Django needs to be set up before models can be imported; its own cost is not attributed to the module.
+        code = f'import django; django.setup(); import {module}'
+    else:
+        code = f'import {module}'
+
+    environment = {
+        **PLACEHOLDER_ENVIRONMENT,
+        **os.environ,
+        'PYTHONPATH': os.pathsep.join([str(ROOT_DIR), str(SERVER_DIR)]),
+    }
+
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        cwd=SERVER_DIR,
+        env=environment,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    cumulative_us = 0
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+
+        _, line_cumulative_us, name = [v.strip() for v in line.split(':', 1)[1].split('|')]
+        if name == module and line_cumulative_us.isdigit():
+            cumulative_us = max(cumulative_us, int(line_cumulative_us))
+
+    return cumulative_us / 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--output', help='JSON file the measured import times are written to')
+    args = parser.parse_args()
+
+    results = {}
+    exceeded = False
+
+    for module, budget_ms in MODULES:
+        import_time_ms = measure_import_time(module)
+        results[module] = {
+            'import_time_ms': import_time_ms,
+            'budget_ms': budget_ms,
+        }
+
+        status = 'OK' if import_time_ms <= budget_ms else 'OVER BUDGET'
+        exceeded = exceeded or import_time_ms > budget_ms
+
+        print(f'{module:>20}: {import_time_ms:10.1f} ms (budget {budget_ms} ms) {status}')
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(results, fp, indent=4)
+
+    sys.exit(1 if exceeded else 0)
+
+
+if __name__ == '__main__':
+    main()
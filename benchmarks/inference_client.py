@@ -0,0 +1,58 @@
+# #
+# # SEA / SMART ENGINEERING ASSISTANT
+# # Copyright (c) 2024 SilentByte <https://silentbyte.com/>
+# #
+
+# Usage: python -m benchmarks.inference_client
+#
+# Measures the per-request cost of setting up an inference client (models, retriever, and chains) when a fresh client
+# is created for every request compared to the pooled client. No requests are sent to any endpoint; the round trip
+# to look up the Databricks Vector Search index that a fresh client also pays for is not included.
+
+import tempfile
+import timeit
+
+from sea.inference import SeaInferenceClient, shared_inference_client
+
+REQUEST_COUNT = 200
+REPEAT = 5
+
+
+def prepare(client: SeaInferenceClient) -> None:
+    # Everything a technical question touches before the first request is sent.
+    client.search_chain
+    client.initial_chain
+    client.technical_chain
+    client.casual_chain
+
+
+def main() -> None:
+    with tempfile.TemporaryDirectory() as vector_index_dir:
+        client_kwargs = {
+            'vector_search_endpoint': 'benchmark',
+            'vector_search_index': 'benchmark.benchmark.document_vectors_index',
+            'result_count': 4,
+            'retriever_backend': 'mmap',
+            'vector_index_dir': vector_index_dir,
+        }
+
+        # The first client pays for importing LangChain and the model clients, which happens only once per process.
+        prepare(SeaInferenceClient(**client_kwargs))
+
+        print(f'{REQUEST_COUNT} requests')
+
+        for name, create_client in [
+            ('fresh client', lambda: SeaInferenceClient(**client_kwargs)),
+            ('pooled client', lambda: shared_inference_client(**client_kwargs)),
+        ]:
+            seconds = min(timeit.repeat(
+                lambda: [prepare(create_client()) for _ in range(REQUEST_COUNT)],
+                number=1,
+                repeat=REPEAT,
+            ))
+
+            print(f'{name:>16}: {seconds / REQUEST_COUNT * 1000:10.3f} ms/request')
+
+
+if __name__ == '__main__':
+    main()
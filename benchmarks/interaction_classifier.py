@@ -0,0 +1,39 @@
+# #
+# # SEA / SMART ENGINEERING ASSISTANT
+# # Copyright (c) 2024 SilentByte <https://silentbyte.com/>
+# #
+
+# Usage: python -m benchmarks.interaction_classifier
+#
+# Measures the latency of the local casual/technical classifier trained on the built-in examples. The chat model
+# it replaces takes a full generation round trip, typically in the order of a second.
+
+import timeit
+
+from sea.classification import KeywordInteractionClassifier
+
+REPEAT = 5
+NUMBER = 10_000
+
+QUESTIONS = [
+    'Thanks, bye!',
+    'Hello Eugine',
+    'What is the torque for the propeller bolts?',
+    'How do I inspect the exhaust system for cracks?',
+    'Where do I find part number 6512-340?',
+]
+
+
+def main() -> None:
+    classifier = KeywordInteractionClassifier.train(KeywordInteractionClassifier.default_examples())
+
+    for question in QUESTIONS:
+        classification = classifier.classify(question)
+        seconds = min(timeit.repeat(lambda: classifier.classify(question), number=NUMBER, repeat=REPEAT))
+
+        print(f'{question:>50}: {"TECHNICAL" if classification.technical else "CASUAL":>9} '
+              f'({classification.confidence:.3f}) {seconds / NUMBER * 1_000_000:8.2f} us')
+
+
+if __name__ == '__main__':
+    main()
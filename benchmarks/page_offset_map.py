@@ -0,0 +1,70 @@
+# #
+# # SEA / SMART ENGINEERING ASSISTANT
+# # Copyright (c) 2024 SilentByte <https://silentbyte.com/>
+# #
+
+# Usage: python -m benchmarks.page_offset_map
+
+import random
+import timeit
+
+from sea.dataprocessing import PageOffsetMap
+
+PAGE_COUNT = 1500
+CHUNKS_PER_PAGE = 3
+REPEAT = 5
+
+
+def find_page_no_by_char_count(page_no_char_index: list[int], char_count: int) -> int:
+    # Previous linear implementation, kept here as the baseline.
+    for page_no, index in enumerate(page_no_char_index):
+        if index > char_count:
+            return page_no
+
+    return 0
+
+
+def main() -> None:
+    random.seed(42)
+
+    page_lengths = [random.randint(1200, 4800) for _ in range(PAGE_COUNT)]
+    document_length = sum(page_lengths)
+
+    chunk_ranges = []
+    for _ in range(PAGE_COUNT * CHUNKS_PER_PAGE):
+        start_char_idx = random.randrange(document_length)
+        chunk_ranges.append((start_char_idx, min(document_length, start_char_idx + 2500)))
+
+    def run_linear():
+        page_no_char_index = []
+        end_offset = 0
+
+        for length in page_lengths:
+            end_offset += length
+            page_no_char_index.append(end_offset)
+
+        for start_char_idx, end_char_idx in chunk_ranges:
+            find_page_no_by_char_count(page_no_char_index, start_char_idx)
+            find_page_no_by_char_count(page_no_char_index, end_char_idx)
+
+    def run_page_offset_map():
+        page_offset_map = PageOffsetMap()
+
+        for page_no, length in enumerate(page_lengths):
+            page_offset_map.append(page_no, length)
+
+        for start_char_idx, end_char_idx in chunk_ranges:
+            page_offset_map.find_page_range(start_char_idx, end_char_idx)
+
+    print(f'{PAGE_COUNT} pages, {len(chunk_ranges)} chunks per document')
+
+    for name, fn in [
+        ('linear scan', run_linear),
+        ('PageOffsetMap', run_page_offset_map),
+    ]:
+        seconds = min(timeit.repeat(fn, number=1, repeat=REPEAT))
+        print(f'{name:>16}: {seconds * 1000:10.3f} ms/document')
+
+
+if __name__ == '__main__':
+    main()
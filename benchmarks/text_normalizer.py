@@ -0,0 +1,70 @@
+# #
+# # SEA / SMART ENGINEERING ASSISTANT
+# # Copyright (c) 2024 SilentByte <https://silentbyte.com/>
+# #
+
+# Usage: python -m benchmarks.text_normalizer
+
+import re
+import random
+import timeit
+
+from sea.dataprocessing import TextNormalizer, DEFAULT_DROP_PATTERNS, DEFAULT_STRIP_PATTERNS
+
+LINE_COUNT = 100_000
+REPEAT = 3
+
+SAMPLE_LINES = [
+    'Remove the oil filter and inspect the element for metal particles.',
+    'Torque the cylinder head nuts to 25 Nm in the sequence shown in Figure 4.',
+    'This document is controlled while it remains on the server. Check the oil pressure sender.',
+    'Section',
+    'Issue Date:',
+    'Page: 12 of 340',
+    '3.2 Lubrication System ........................ 45',
+    '42',
+    'Issued by: Engineering Department',
+    'Table of Contents',
+    'Once this no longer applies the copy is uncontrolled. Replace the gasket if damaged.',
+    'x',
+    '',
+]
+
+
+def normalize_text(text: str) -> str | None:
+    # Previous implementation, kept here as the baseline.
+    text = text.strip()
+
+    if not text:
+        return None
+
+    for p in DEFAULT_DROP_PATTERNS:
+        if re.search(p, text, re.IGNORECASE):
+            return None
+
+    for p in DEFAULT_STRIP_PATTERNS:
+        text = re.sub(p, '', text)
+
+    return text.strip() or None
+
+
+def main() -> None:
+    random.seed(42)
+
+    lines = [random.choice(SAMPLE_LINES) for _ in range(LINE_COUNT)]
+    normalizer = TextNormalizer(DEFAULT_DROP_PATTERNS, DEFAULT_STRIP_PATTERNS)
+
+    assert [normalize_text(line) for line in lines] == [normalizer.normalize(line) for line in lines]
+
+    print(f'{LINE_COUNT} lines')
+
+    for name, fn in [
+        ('per-pattern re', normalize_text),
+        ('TextNormalizer', normalizer.normalize),
+    ]:
+        seconds = min(timeit.repeat(lambda: [fn(line) for line in lines], number=1, repeat=REPEAT))
+        print(f'{name:>16}: {LINE_COUNT / seconds:14,.0f} lines/s')
+
+
+if __name__ == '__main__':
+    main()
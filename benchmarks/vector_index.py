@@ -0,0 +1,57 @@
+# #
+# # SEA / SMART ENGINEERING ASSISTANT
+# # Copyright (c) 2024 SilentByte <https://silentbyte.com/>
+# #
+
+# Usage: python -m benchmarks.vector_index
+
+import tempfile
+import timeit
+
+from dataclasses import dataclass
+
+import numpy as np
+
+from sea.vectorindex import write_vector_index_snapshot, MemoryMappedVectorIndex
+
+VECTOR_COUNT = 100_000
+DIMENSIONS = 1024
+QUERY_COUNT = 20
+K = 4
+REPEAT = 5
+
+
+@dataclass
+class Vector:
+    id: str
+    embeddings: np.ndarray
+    file_name: str = 'document.pdf'
+    file_hash: str = ''
+    start_page_no: int = 0
+    end_page_no: int = 0
+    content: str = ''
+
+
+def main() -> None:
+    rng = np.random.default_rng(42)
+    embeddings = rng.standard_normal((VECTOR_COUNT, DIMENSIONS), dtype=np.float32)
+    queries = rng.standard_normal((QUERY_COUNT, DIMENSIONS), dtype=np.float32)
+
+    print(f'{VECTOR_COUNT} vectors, {DIMENSIONS} dimensions, top {K}')
+
+    for dtype in ['float32', 'float16']:
+        with tempfile.TemporaryDirectory() as root_dir:
+            write_vector_index_snapshot(root_dir, (Vector(str(i), e) for i, e in enumerate(embeddings)), dtype=dtype)
+            index = MemoryMappedVectorIndex(root_dir)
+
+            def run_queries():
+                for query in queries:
+                    index.search(query, K)
+
+            run_queries()
+            seconds = min(timeit.repeat(run_queries, number=1, repeat=REPEAT))
+            print(f'{dtype:>16}: {seconds / QUERY_COUNT * 1000:10.3f} ms/query')
+
+
+if __name__ == '__main__':
+    main()
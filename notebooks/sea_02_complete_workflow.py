@@ -129,6 +129,28 @@ sea_runtime.create_document_vectors_index()
 
 # COMMAND ----------
 
+# DBTITLE 1,(Optional) Run the Fused Document Pipeline Continuously
+# Alternatively, documents can be ingested, chunked, and embedded in a single streaming query that keeps
+# watching the volume and syncs the vector search index after each micro-batch (replaces the steps above).
+## sea_runtime.run_document_pipeline(processing_time='5 minutes')
+
+# COMMAND ----------
+
+# DBTITLE 1,Show Recent Pipeline Runs
+# MAGIC %sql
+# MAGIC SELECT started_on, pipeline, stage, wall_time, documents, pages, chunks, embedding_requests, rows_per_second
+# MAGIC FROM pipeline_runs
+# MAGIC ORDER BY started_on DESC
+# MAGIC LIMIT 20
+
+# COMMAND ----------
+
+# DBTITLE 1,Remove Vectors of Deleted and Superseded Documents
+# Documents that have been removed from the volume or replaced by a newer revision are removed from the index.
+sea_runtime.remove_stale_document_vectors()
+
+# COMMAND ----------
+
 # DBTITLE 1,Helper Function to Render Markdown
 # MAGIC %pip install markdown
 # MAGIC # Define a handy function to render LLM responses in markdown format.
@@ -0,0 +1,222 @@
+# #
+# # SEA / SMART ENGINEERING ASSISTANT
+# # Copyright (c) 2024 SilentByte <https://silentbyte.com/>
+# #
+
+
+import os
+import re
+import hashlib
+import tempfile
+import threading
+
+from collections import OrderedDict
+from datetime import datetime, timezone
+from dataclasses import dataclass
+from typing import Any, Callable
+
+import numpy as np
+
+from sea import utils
+
+QUESTION_NOISE_PATTERN = re.compile(r'[^\w\s./-]+')
+
+
+def normalize_question(text: str) -> str:
+    # Case, whitespace, and punctuation such as "?" or "!" do not change what is being asked.
+    return ' '.join(QUESTION_NOISE_PATTERN.sub(' ', text.lower()).split())
+
+
+def history_fingerprint(history: list[tuple[str, str]], turns: int = 2) -> str:
+    # Only the most recent turns are taken into account, so that a question can still be answered from the cache
+    # after a long conversation, but not if it refers to something that has just been said.
+    recent_history = '\n'.join(f'{originator}:{normalize_question(text)}' for originator, text in history[-turns:])
+    return hashlib.sha256(recent_history.encode('utf-8')).hexdigest()[:16]
+
+
+def read_index_version(file_name: str) -> str | None:
+    try:
+        with open(file_name, 'r', encoding='utf-8') as fp:
+            return fp.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+def write_index_version(file_name: str) -> str:
+    # Every answer cache compares the version to the one it was filled with and clears itself once it has changed.
+    # The file is replaced atomically, so that it is never read while being written.
+    version = datetime.now(timezone.utc).strftime('%Y%m%d%H%M%S%f')
+
+    os.makedirs(os.path.dirname(file_name), exist_ok=True)
+
+    with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=os.path.dirname(file_name), delete=False) as fp:
+        fp.write(version)
+
+    os.replace(fp.name, file_name)
+
+    return version
+
+
+def normalize_embedding(embedding: list[float] | np.ndarray) -> np.ndarray:
+    embedding = np.asarray(embedding, dtype=np.float32)
+    return embedding / max(float(np.linalg.norm(embedding)), 1e-12)
+
+
+@dataclass
+class AnswerCacheStats:
+    hits: int = 0
+    semantic_hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    invalidations: int = 0
+
+    def to_dict(self) -> dict:
+        return {
+            'hits': self.hits,
+            'semantic_hits': self.semantic_hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+        }
+
+
+@dataclass
+class AnswerCacheEntry:
+    question: str
+    fingerprint: str
+    embedding: np.ndarray | None
+    answer: Any
+    created_on: float
+
+
+class SemanticAnswerCache:
+    # In-memory cache of answers with LRU eviction and a TTL. Questions are looked up by their normalized text and
+    # history fingerprint first; only then, the embedding of the question is compared to all cached questions with the
+    # same fingerprint. The cache is cleared whenever the version of the vector index changes.
+    def __init__(
+            self,
+            max_entries: int = 1024,
+            ttl: float = 24 * 60 * 60,
+            similarity_threshold: float = 0.97,
+            index_version: Callable[[], str | None] | None = None,
+            version_check_interval: float = 5.0,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self.index_version = index_version
+        self.version_check_interval = version_check_interval
+        self.stats = AnswerCacheStats()
+
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[tuple[str, str], AnswerCacheEntry] = OrderedDict()
+        self._version: str | None = None
+        self._last_version_check = 0.0
+
+    def _check_version(self, now: float) -> None:
+        if self.index_version is None or now - self._last_version_check < self.version_check_interval:
+            return
+
+        self._last_version_check = now
+
+        if (version := self.index_version()) != self._version:
+            if self._entries:
+                self.stats.invalidations += 1
+
+            self._entries.clear()
+            self._version = version
+
+    def _is_expired(self, entry: AnswerCacheEntry, now: float) -> bool:
+        return now - entry.created_on > self.ttl
+
+    def get_exact(self, question: str, fingerprint: str) -> Any | None:
+        now = utils.epoch()
+        key = (normalize_question(question), fingerprint)
+
+        with self._lock:
+            self._check_version(now)
+
+            if (entry := self._entries.get(key)) is None:
+                return None
+
+            if self._is_expired(entry, now):
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            self.stats.hits += 1
+
+            return entry.answer
+
+    def get_similar(self, fingerprint: str, embedding: list[float] | np.ndarray) -> Any | None:
+        now = utils.epoch()
+        query = normalize_embedding(embedding)
+
+        with self._lock:
+            self._check_version(now)
+
+            best_key = None
+            best_similarity = self.similarity_threshold
+
+            for key, entry in self._entries.items():
+                if entry.fingerprint != fingerprint or entry.embedding is None or self._is_expired(entry, now):
+                    continue
+
+                if (similarity := float(np.dot(entry.embedding, query))) >= best_similarity:
+                    best_key = key
+                    best_similarity = similarity
+
+            if best_key is None:
+                self.stats.misses += 1
+                return None
+
+            self._entries.move_to_end(best_key)
+            self.stats.hits += 1
+            self.stats.semantic_hits += 1
+
+            return self._entries[best_key].answer
+
+    def version(self) -> str | None:
+        with self._lock:
+            self._check_version(utils.epoch())
+            return self._version
+
+    def put(
+            self,
+            question: str,
+            fingerprint: str,
+            embedding: list[float] | np.ndarray | None,
+            answer: Any,
+            version: str | None,
+    ) -> None:
+        # The version is the one the answer has been generated with (see version()); an answer that has been
+        # generated while the index changed may be based on the previous index and is not cached.
+        now = utils.epoch()
+        key = (normalize_question(question), fingerprint)
+
+        with self._lock:
+            self._check_version(now)
+
+            if version != self._version:
+                return
+
+            self._entries[key] = AnswerCacheEntry(
+                question=key[0],
+                fingerprint=fingerprint,
+                embedding=normalize_embedding(embedding) if embedding is not None else None,
+                answer=answer,
+                created_on=now,
+            )
+
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,93 @@
+# #
+# # SEA / SMART ENGINEERING ASSISTANT
+# # Copyright (c) 2024 SilentByte <https://silentbyte.com/>
+# #
+
+
+import os
+import json
+import hashlib
+import tempfile
+
+from typing import Iterator
+
+from sea.dataprocessing import (
+    LocalizedText,
+    TextNormalizer,
+    DEFAULT_TEXT_NORMALIZER,
+    extract_document_sentence_chunks,
+)
+
+
+def chunk_cache_key(file_hash: str, chunk_size: int, chunk_overlap: int, normalizer_version: str) -> str:
+    # Must be kept in sync with SeaRuntime.chunk_cache_key_column().
+    return hashlib.sha256(f'{file_hash}|{chunk_size}|{chunk_overlap}|{normalizer_version}'.encode('utf-8')).hexdigest()
+
+
+def chunk_id(chunk_key: str, chunk_no: int) -> str:
+    # Must be kept in sync with SeaRuntime.chunk_id_column().
+    return hashlib.sha256(f'{chunk_key}|{chunk_no}'.encode('utf-8')).hexdigest()
+
+
+class LocalChunkCache:
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f'{key}.json')
+
+    def get(self, key: str) -> list[LocalizedText] | None:
+        try:
+            with open(self._path(key), 'r', encoding='utf-8') as fp:
+                return [
+                    LocalizedText(c['text'], c['start_page_no'], c['end_page_no'])
+                    for c in json.load(fp)
+                ]
+        except FileNotFoundError:
+            return None
+
+    def put(self, key: str, chunks: list[LocalizedText]) -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write to a temporary file first so that concurrent readers never observe partially written entries.
+        with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=os.path.dirname(path), delete=False) as fp:
+            json.dump([
+                {
+                    'text': c.text,
+                    'start_page_no': c.start_page_no,
+                    'end_page_no': c.end_page_no,
+                }
+                for c in chunks
+            ], fp)
+
+        os.replace(fp.name, path)
+
+
+def extract_cached_document_sentence_chunks(
+        cache: LocalChunkCache,
+        document_data: bytes | str,
+        file_hash: str,
+        chunk_size: int,
+        chunk_overlap: int,
+        normalizer: TextNormalizer = DEFAULT_TEXT_NORMALIZER,
+        **kwargs,
+) -> Iterator[LocalizedText]:
+    key = chunk_cache_key(file_hash, chunk_size, chunk_overlap, normalizer.version)
+
+    if (chunks := cache.get(key)) is not None:
+        yield from chunks
+        return
+
+    chunks = []
+    for chunk in extract_document_sentence_chunks(
+            document_data=document_data,
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            normalizer=normalizer,
+            **kwargs,
+    ):
+        chunks.append(chunk)
+        yield chunk
+
+    cache.put(key, chunks)
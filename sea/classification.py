@@ -0,0 +1,252 @@
+# #
+# # SEA / SMART ENGINEERING ASSISTANT
+# # Copyright (c) 2024 SilentByte <https://silentbyte.com/>
+# #
+
+
+import re
+import json
+import math
+
+from collections import Counter
+from dataclasses import dataclass
+from typing import Iterable
+
+DEFAULT_CASUAL_EXAMPLES = [
+    'Hi',
+    'Hello there',
+    'Good morning',
+    'Hey Eugine, how are you?',
+    'Thanks!',
+    'Thank you, that helps a lot',
+    'Great, thanks for your help',
+    'Cheers mate',
+    'Bye',
+    'See you tomorrow',
+    'Goodbye and have a nice day',
+    'What is your name?',
+    'Who are you?',
+    'How is your day going?',
+    'Nice weather today',
+    'Ok cool',
+    'That is funny',
+    'Tell me a joke',
+]
+
+DEFAULT_TECHNICAL_EXAMPLES = [
+    'What is the torque for the cylinder head nuts?',
+    'How do I replace the oil filter on the engine?',
+    'Show me the maintenance manual for the landing gear',
+    'What is the inspection interval for the propeller?',
+    'Which part number is the fuel pump?',
+    'How do I check the oil pressure sender?',
+    'What are the limits for blade erosion?',
+    'Where can I find the wiring diagram for the starter?',
+    'What is the procedure to bleed the brake system?',
+    'Which service bulletin applies to the magneto?',
+    'What is the tire pressure of the main wheel?',
+    'How often must the spark plugs be inspected?',
+    'What does the documentation say about corrosion on the wing spar?',
+    'Give me the contact details for technical support',
+    'What is the maximum cylinder head temperature?',
+    'How do I rig the flap actuator?',
+    'Is there an airworthiness directive for the carburetor?',
+    'What sealant is used for the fuel tank access panel?',
+]
+
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+(?:[-./][a-z0-9]+)*')
+
+
+@dataclass
+class InteractionClassification:
+    technical: bool
+    confidence: float
+    path: str
+    latency: float = 0.0
+    local_confidence: float | None = None
+
+    def to_dict(self) -> dict:
+        return {
+            'technical': self.technical,
+            'confidence': self.confidence,
+            'path': self.path,
+            'latency': self.latency,
+            'local_confidence': self.local_confidence,
+        }
+
+
+class InteractionClassifier:
+    def classify(self, question: str) -> InteractionClassification:
+        raise NotImplementedError()
+
+
+def extract_features(text: str) -> set[str]:
+    tokens = TOKEN_PATTERN.findall(text.lower())
+    features = set(tokens)
+
+    # Bigrams tell apart phrases such as "thank you" and "how do", numbers hint at part numbers, values, and pages.
+    features.update(f'{a} {b}' for a, b in zip(tokens, tokens[1:]))
+
+    if any(c.isdigit() for c in text):
+        features.add('#number')
+
+    if len(tokens) <= 3:
+        features.add('#short')
+
+    return features
+
+
+class KeywordInteractionClassifier(InteractionClassifier):
+    # Naive Bayes over binary word and bigram features. The weights are precomputed as log-likelihood ratios, so a
+    # classification is a single pass over the features of the question.
+    def __init__(
+            self,
+            casual_counts: dict[str, int],
+            technical_counts: dict[str, int],
+            casual_example_count: int,
+            technical_example_count: int,
+    ):
+        self.casual_counts = casual_counts
+        self.technical_counts = technical_counts
+        self.casual_example_count = casual_example_count
+        self.technical_example_count = technical_example_count
+
+        vocabulary_size = len(casual_counts.keys() | technical_counts.keys())
+        casual_total = sum(casual_counts.values()) + vocabulary_size
+        technical_total = sum(technical_counts.values()) + vocabulary_size
+
+        self.prior = math.log((technical_example_count + 1) / (casual_example_count + 1))
+        self.weights = {
+            f: (math.log((technical_counts.get(f, 0) + 1) / technical_total)
+                - math.log((casual_counts.get(f, 0) + 1) / casual_total))
+            for f in casual_counts.keys() | technical_counts.keys()
+        }
+
+    @staticmethod
+    def train(examples: Iterable[tuple[str, bool]]) -> 'KeywordInteractionClassifier':
+        casual_counts = Counter()
+        technical_counts = Counter()
+        casual_example_count = 0
+        technical_example_count = 0
+
+        for text, technical in examples:
+            if technical:
+                technical_counts.update(extract_features(text))
+                technical_example_count += 1
+            else:
+                casual_counts.update(extract_features(text))
+                casual_example_count += 1
+
+        return KeywordInteractionClassifier(
+            casual_counts=dict(casual_counts),
+            technical_counts=dict(technical_counts),
+            casual_example_count=casual_example_count,
+            technical_example_count=technical_example_count,
+        )
+
+    @staticmethod
+    def default_examples() -> list[tuple[str, bool]]:
+        return ([(e, False) for e in DEFAULT_CASUAL_EXAMPLES]
+                + [(e, True) for e in DEFAULT_TECHNICAL_EXAMPLES])
+
+    @staticmethod
+    def load(file_name: str) -> 'KeywordInteractionClassifier':
+        with open(file_name, 'r', encoding='utf-8') as fp:
+            data = json.load(fp)
+            data.pop('evaluation', None)
+
+            return KeywordInteractionClassifier(**data)
+
+    @staticmethod
+    def load_evaluation(file_name: str) -> 'ClassifierEvaluation | None':
+        with open(file_name, 'r', encoding='utf-8') as fp:
+            evaluation = json.load(fp).get('evaluation')
+
+        if evaluation is None:
+            return None
+
+        return ClassifierEvaluation(
+            examples=evaluation['examples'],
+            confident=evaluation['confident'],
+            confident_correct=evaluation['confident_correct'],
+        )
+
+    def save(self, file_name: str, evaluation: 'ClassifierEvaluation | None' = None) -> None:
+        # The holdout evaluation is stored alongside the model, so that the server can refuse a poor classifier.
+        data = self.to_dict()
+
+        if evaluation is not None:
+            data['evaluation'] = evaluation.to_dict()
+
+        with open(file_name, 'w', encoding='utf-8') as fp:
+            json.dump(data, fp)
+
+    def to_dict(self) -> dict:
+        return {
+            'casual_counts': self.casual_counts,
+            'technical_counts': self.technical_counts,
+            'casual_example_count': self.casual_example_count,
+            'technical_example_count': self.technical_example_count,
+        }
+
+    def classify(self, question: str) -> InteractionClassification:
+        features = [f for f in extract_features(question) if f in self.weights]
+
+        # Without a single known word, the decision would only be based on the prior and the length of the question.
+        if all(f.startswith('#') for f in features):
+            return InteractionClassification(technical=False, confidence=0.5, path='local')
+
+        log_odds = self.prior + sum(self.weights[f] for f in features)
+        probability = 1.0 / (1.0 + math.exp(-max(-50.0, min(50.0, log_odds))))
+
+        return InteractionClassification(
+            technical=probability >= 0.5,
+            confidence=max(probability, 1.0 - probability),
+            path='local',
+        )
+
+
+@dataclass
+class ClassifierEvaluation:
+    examples: int = 0
+    confident: int = 0
+    confident_correct: int = 0
+
+    @property
+    def coverage(self) -> float:
+        return self.confident / self.examples if self.examples > 0 else 0.0
+
+    @property
+    def accuracy(self) -> float:
+        return self.confident_correct / self.confident if self.confident > 0 else 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            'examples': self.examples,
+            'confident': self.confident,
+            'confident_correct': self.confident_correct,
+            'coverage': self.coverage,
+            'accuracy': self.accuracy,
+        }
+
+    def __str__(self) -> str:
+        return (f'{self.examples} examples, {self.coverage:.1%} answered locally '
+                f'with {self.accuracy:.1%} accuracy, the rest falls back to the model')
+
+
+def evaluate_interaction_classifier(
+        classifier: InteractionClassifier,
+        examples: Iterable[tuple[str, bool]],
+        min_confidence: float,
+) -> ClassifierEvaluation:
+    evaluation = ClassifierEvaluation()
+
+    for text, technical in examples:
+        classification = classifier.classify(text)
+        evaluation.examples += 1
+
+        if classification.confidence >= min_confidence:
+            evaluation.confident += 1
+            evaluation.confident_correct += int(classification.technical == technical)
+
+    return evaluation
@@ -4,7 +4,7 @@
 # #
 
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
 
 @dataclass
@@ -14,6 +14,76 @@ class SeaConfig:
     volume: str = 'sea_data'
     vector_search_endpoint: str = 'sea_vector_search'
     spark_max_records_per_batch: int = 16
+    chunk_size: int = 640
+    chunk_overlap: int = 60
+
+    # Either 'databricks' (Databricks Vector Search), 'pgvector' (document vectors mirrored into Postgres), or 'mmap'
+    # (memory-mapped vector index snapshots in vector_index_dir).
+    retriever_backend: str = 'databricks'
+
+    # If disabled, documents are ingested by reference and only their metadata is stored in the documents table;
+    # the files are read from the volume when they are chunked and must therefore not be removed before.
+    store_document_content: bool = True
+
+    # Documents with more pages are split into page ranges that are chunked independently.
+    max_pages_per_work_unit: int = 256
+
+    # Number of partitions documents are balanced across; defaults to the default parallelism of the cluster.
+    document_partition_count: int | None = None
+
+    # JSON files of the form {"drop": [...], "strip": [...]} containing additional boilerplate patterns.
+    normalization_rule_packs: list[str] = field(default_factory=list)
+
+    # Local directory the chunking tokenizer is loaded from (and downloaded to if it is not cached yet).
+    tokenizer_cache_dir: str | None = None
+
+    # Number of processes the pages of a single document are extracted with outside of Spark; documents are already
+    # chunked in parallel, so this only pays off for corpora with few but very large documents.
+    page_extraction_workers: int = 1
+
+    # Local directory for the on-disk chunk cache used outside of Spark.
+    chunk_cache_dir: str | None = None
+
+    # Local SQLite database used to cache embeddings outside of Spark.
+    embedding_cache_file: str | None = None
+
+    # Local SQLite database the chunks and vectors of the local (Spark-free) runtime are written to.
+    local_vectors_file: str | None = None
+
+    # Local directory that vector index snapshots are published to and served from.
+    vector_index_dir: str | None = None
+
+    # URL of an embedding endpoint used by the local runtime instead of the Databricks endpoint.
+    embedding_endpoint_url: str | None = None
+
+    # Local keyword model that classifies questions as casual or technical without asking the chat model. It is only
+    # used once it has been trained (manage.py trainclassifier) and its holdout evaluation is good enough, and only
+    # for the first question of a conversation. Disabled if not set.
+    interaction_classifier_file: str | None = None
+
+    # Questions the local classifier is less confident about are classified by the chat model.
+    min_classifier_confidence: float = 0.95
+
+    # A trained classifier is not used unless its confident holdout answers reach this accuracy over enough examples.
+    min_classifier_accuracy: float = 0.98
+    min_classifier_holdout_examples: int = 100
+
+    # Starts the vector search while the chat model classifies a question instead of after it.
+    speculative_retrieval: bool = False
+
+    # Serves repeated questions with the same recent history from memory; near-duplicates match if the cosine
+    # similarity of their embeddings is at least answer_cache_similarity. Answers expire after answer_cache_ttl
+    # seconds and are dropped whenever the content of answer_cache_version_file changes. The runtime writes a new
+    # version to this file (e.g. on a volume shared with the server) whenever a vector search index sync has completed.
+    answer_cache: bool = False
+    answer_cache_entries: int = 1024
+    answer_cache_ttl: float = 24 * 60 * 60
+    answer_cache_similarity: float = 0.97
+    answer_cache_version_file: str | None = None
+
+    # Seconds to wait for a triggered vector search index sync to complete; the answer caches are invalidated once
+    # the sync has completed or the timeout has been reached.
+    index_sync_timeout: int | None = 60 * 60
 
     @property
     def document_vectors_index(self) -> str:
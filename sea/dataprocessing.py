@@ -5,17 +5,23 @@
 
 
 import re
+import json
+import hashlib
+import functools
 
+from array import array
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
-from typing import Iterator
+from difflib import SequenceMatcher
+from typing import Iterable, Iterator
 
 import fitz as pymupdf
 from llama_index.core.schema import Document
 from llama_index.core.utils import set_global_tokenizer
 from llama_index.core.node_parser import SentenceSplitter
-from transformers import AutoTokenizer
 
-set_global_tokenizer(AutoTokenizer.from_pretrained("hf-internal-testing/llama-tokenizer"))
+TOKENIZER_NAME = 'hf-internal-testing/llama-tokenizer'
 
 
 @dataclass
@@ -25,81 +31,465 @@ class LocalizedText:
     end_page_no: int
 
 
-def normalize_text(text: str) -> str | None:
-    text = text.strip()
+DEFAULT_DROP_PATTERNS = [
+    # General garbage.
+    r'^(\d+\s*)*$',
+    r'^.$',
+
+    # Commonly occurring document boilerplate.
+    r'^Section$',
+    r'^Issue Date:$',
+    r'^Dated\s*:.*$',
+    r'^Change\(s\):$',
+    r'^Issue:?$',
+    r'^Issued by:?.*$',
+    r'^(Page:\s*)?\d+\s+of\s+\d+.*$',
+    r'^.*Table of Contents.*$',
+    r'^.*(\.\s*){4,}.*$',
+]
+
+DEFAULT_STRIP_PATTERNS = [
+    r'This\s*document\s*is\s*controlled\s*while\s*it\s*remains[^.]*?\.',
+    r'Once\s*this\s*no\s*longer\s*applies[^.]*\.',
+]
+
+
+# Backreferences, named groups, and global inline flags change their meaning (or fail to compile) once a pattern is
+# part of a combined alternation, so rule packs must not use them.
+UNCOMBINABLE_PATTERN = re.compile(r'(?<!\\)(?:\\\\)*\\[1-9]|\(\?P[<=]|\(\?[aiLmsux]+\)')
+
+
+def validate_pattern(pattern: str) -> None:
+    try:
+        re.compile(pattern)
+    except re.error as e:
+        raise ValueError(f'Invalid pattern {pattern!r}: {e}')
+
+    if UNCOMBINABLE_PATTERN.search(pattern):
+        raise ValueError(f'Pattern {pattern!r} must not use backreferences, named groups, or global inline flags')
 
-    if not text:
+
+def compile_patterns(patterns: list[str], flags: int = 0) -> re.Pattern | None:
+    if not patterns:
         return None
 
-    for p in [
-        # General garbage.
-        r'^(\d+\s*)*$',
-        r'^.$',
-
-        # Commonly occurring document boilerplate.
-        r'^Section$',
-        r'^Issue Date:$',
-        r'^Dated\s*:.*$',
-        r'^Change\(s\):$',
-        r'^Issue:?$',
-        r'^Issued by:?.*$',
-        r'^(Page:\s*)?\d+\s+of\s+\d+.*$',
-        r'^.*Table of Contents.*$',
-        r'^.*(\.\s*){4,}.*$',
-    ]:
-        if re.search(p, text, re.IGNORECASE):
+    return re.compile('|'.join(f'(?:{p})' for p in patterns), flags)
+
+
+class TextNormalizer:
+    def __init__(self, drop_patterns: list[str], strip_patterns: list[str]):
+        self.drop_patterns = list(drop_patterns)
+        self.strip_patterns = list(strip_patterns)
+
+        # Identifies the rule set; chunks produced by normalizers with the same version are interchangeable.
+        self.version = hashlib.sha256(
+            json.dumps([self.drop_patterns, self.strip_patterns]).encode('utf-8'),
+        ).hexdigest()[:16]
+
+        # Drop patterns are combined into a single alternation so that each line is scanned once. Strip patterns are
+        # applied one after another, because the text removed by one pattern can affect what the next one matches.
+        self._drop_regex = compile_patterns(self.drop_patterns, re.IGNORECASE)
+        self._strip_regexes = [re.compile(p) for p in self.strip_patterns]
+
+    @staticmethod
+    def from_rule_packs(file_names: list[str], include_defaults: bool = True) -> 'TextNormalizer':
+        drop_patterns = list(DEFAULT_DROP_PATTERNS) if include_defaults else []
+        strip_patterns = list(DEFAULT_STRIP_PATTERNS) if include_defaults else []
+
+        for file_name in file_names:
+            with open(file_name, 'r', encoding='utf-8') as fp:
+                rule_pack = json.load(fp)
+
+            for pattern in rule_pack.get('drop', []) + rule_pack.get('strip', []):
+                try:
+                    validate_pattern(pattern)
+                except ValueError as e:
+                    raise ValueError(f'Rule pack {file_name}: {e}')
+
+            drop_patterns.extend(rule_pack.get('drop', []))
+            strip_patterns.extend(rule_pack.get('strip', []))
+
+        return TextNormalizer(drop_patterns, strip_patterns)
+
+    def normalize(self, text: str) -> str | None:
+        text = text.strip()
+
+        if not text:
             return None
 
-    for p in [
-        r'This\s*document\s*is\s*controlled\s*while\s*it\s*remains[^.]*?\.',
-        r'Once\s*this\s*no\s*longer\s*applies[^.]*\.',
-    ]:
-        text = re.sub(p, '', text)
+        if self._drop_regex is not None and self._drop_regex.search(text):
+            return None
+
+        for strip_regex in self._strip_regexes:
+            text = strip_regex.sub('', text)
+
+        return text.strip() or None
+
+
+DEFAULT_TEXT_NORMALIZER = TextNormalizer(DEFAULT_DROP_PATTERNS, DEFAULT_STRIP_PATTERNS)
+
+
+def normalize_text(text: str) -> str | None:
+    return DEFAULT_TEXT_NORMALIZER.normalize(text)
+
+
+def extract_page_text(page: pymupdf.Page, normalizer: TextNormalizer) -> str:
+    page_text = ''
+
+    for paragraph in page.get_text().split('\n'):
+        if normalized_text := normalizer.normalize(paragraph):
+            page_text += normalized_text + ' '
 
-    return text.strip() or None
+    return page_text
 
 
-def extract_document_pages(document_data: bytes) -> Iterator[LocalizedText]:
-    with pymupdf.open(stream=document_data) as document:
-        for page_no, page in enumerate(document):
-            page_text = ''
+def open_document(document_data: bytes | str) -> pymupdf.Document:
+    # Documents are either passed as bytes or as the path of a local file, which PyMuPDF reads on demand.
+    if isinstance(document_data, str):
+        return pymupdf.open(document_data, filetype='pdf')
 
-            for paragraph in page.get_text().split('\n'):
-                if normalized_text := normalize_text(paragraph):
-                    page_text += normalized_text + ' '
+    return pymupdf.open(stream=document_data)
 
-            if page_text:
+
+def compute_file_hash(file_name: str, block_size: int = 1024 * 1024) -> str:
+    file_hash = hashlib.sha256()
+
+    with open(file_name, 'rb', buffering=0) as fp:
+        while block := fp.read(block_size):
+            file_hash.update(block)
+
+    return file_hash.hexdigest()
+
+
+def extract_document_pages(
+        document_data: bytes | str,
+        normalizer: TextNormalizer = DEFAULT_TEXT_NORMALIZER,
+        start_page_no: int = 0,
+        end_page_no: int | None = None,
+) -> Iterator[LocalizedText]:
+    with open_document(document_data) as document:
+        if end_page_no is None or end_page_no > document.page_count:
+            end_page_no = document.page_count
+
+        for page_no in range(start_page_no, end_page_no):
+            if page_text := extract_page_text(document[page_no], normalizer):
                 yield LocalizedText(page_text, page_no, page_no)
 
 
-def find_page_no_by_char_count(page_no_char_index: list[int], char_count: int) -> int:
-    for page_no, index in enumerate(page_no_char_index):
-        if index > char_count:
-            return page_no
+def count_document_pages(document_data: bytes | str) -> int:
+    with open_document(document_data) as document:
+        return document.page_count
 
-    return 0
 
+_worker_document_data: bytes | str | None = None
+_worker_normalizer: TextNormalizer | None = None
 
-def extract_document_sentence_chunks(
-        document_data: bytes,
+
+def _initialize_page_range_worker(document_data: bytes | str, normalizer: TextNormalizer) -> None:
+    global _worker_document_data, _worker_normalizer
+
+    _worker_document_data = document_data
+    _worker_normalizer = normalizer
+
+
+def _extract_page_range(page_range: tuple[int, int]) -> list[LocalizedText]:
+    pages = []
+
+    with open_document(_worker_document_data) as document:
+        for page_no in range(*page_range):
+            if page_text := extract_page_text(document[page_no], _worker_normalizer):
+                pages.append(LocalizedText(page_text, page_no, page_no))
+
+    return pages
+
+
+def extract_document_pages_parallel(
+        document_data: bytes | str,
+        max_workers: int | None = None,
+        pages_per_task: int = 32,
+        normalizer: TextNormalizer = DEFAULT_TEXT_NORMALIZER,
+) -> Iterator[LocalizedText]:
+    with open_document(document_data) as document:
+        page_count = document.page_count
+
+    page_ranges = [
+        (start_page_no, min(start_page_no + pages_per_task, page_count))
+        for start_page_no in range(0, page_count, pages_per_task)
+    ]
+
+    # Each worker receives the document once when it is started; tasks only carry their page range.
+    with ProcessPoolExecutor(
+            max_workers=max_workers,
+            initializer=_initialize_page_range_worker,
+            initargs=(document_data, normalizer),
+    ) as executor:
+        for pages in executor.map(_extract_page_range, page_ranges):
+            yield from pages
+
+
+@functools.cache
+def initialize_tokenizer(cache_dir: str | None = None) -> None:
+    # Importing transformers and loading the tokenizer is expensive, so it is deferred until chunking is needed.
+    from transformers import AutoTokenizer
+
+    try:
+        tokenizer = AutoTokenizer.from_pretrained(TOKENIZER_NAME, cache_dir=cache_dir, local_files_only=True)
+    except OSError:
+        tokenizer = AutoTokenizer.from_pretrained(TOKENIZER_NAME, cache_dir=cache_dir)
+
+    set_global_tokenizer(tokenizer)
+
+
+class PageOffsetMap:
+    def __init__(self):
+        self._end_offsets = array('q')
+        self._page_nos = array('l')
+
+    def __len__(self) -> int:
+        return len(self._page_nos)
+
+    @property
+    def end_offset(self) -> int:
+        return self._end_offsets[-1] if self._end_offsets else 0
+
+    def append(self, page_no: int, length: int) -> None:
+        self._end_offsets.append(self.end_offset + length)
+        self._page_nos.append(page_no)
+
+    def find_page_no(self, char_idx: int) -> int:
+        if not self._page_nos:
+            return 0
+
+        # Offsets past the last page boundary belong to the final page.
+        index = bisect_right(self._end_offsets, char_idx)
+        return self._page_nos[min(index, len(self._page_nos) - 1)]
+
+    def find_page_range(self, start_char_idx: int, end_char_idx: int) -> tuple[int, int]:
+        # End offsets are exclusive.
+        return (
+            self.find_page_no(start_char_idx),
+            self.find_page_no(max(start_char_idx, end_char_idx - 1)),
+        )
+
+
+def split_page_sentence_chunks(
+        pages: Iterable[LocalizedText],
         chunk_size: int,
         chunk_overlap: int,
+        window_page_count: int = 16,
+        tokenizer_cache_dir: str | None = None,
 ) -> Iterator[LocalizedText]:
-    page_no_index = []
-    document_text = ''
-
-    for page in extract_document_pages(document_data):
-        document_text += page.text + '\n'
-        page_no_index.append(len(document_text))
+    # Pages are consumed lazily and split within a sliding window instead of materializing the entire document.
+    # Whenever the window is full, all but the last chunk are emitted; the text of the last chunk (which already
+    # starts with the overlap of its predecessor) is carried over into the next window so that chunk boundaries
+    # and overlaps match those of splitting the whole document at once.
+    initialize_tokenizer(tokenizer_cache_dir)
 
     sentence_splitter = SentenceSplitter(
         chunk_size=chunk_size,
         chunk_overlap=chunk_overlap,
     )
 
-    for node in sentence_splitter.get_nodes_from_documents([Document(text=document_text)]):
-        yield LocalizedText(
-            node.text or '',
-            find_page_no_by_char_count(page_no_index, node.start_char_idx or 0),
-            find_page_no_by_char_count(page_no_index, node.end_char_idx or 0),
-        )
+    page_offset_map = PageOffsetMap()
+
+    window_offset = 0
+    window_text_parts = []
+    window_page_count_current = 0
+
+    def split_window(final: bool) -> Iterator[LocalizedText]:
+        nonlocal window_offset, window_text_parts, window_page_count_current
+
+        window_text = ''.join(window_text_parts)
+        nodes = sentence_splitter.get_nodes_from_documents([Document(text=window_text)])
+
+        carry_char_idx = len(window_text)
+        if not final:
+            if len(nodes) < 2:
+                # Not enough text yet to know where the next chunk boundary will be.
+                window_page_count_current = 0
+                return
+
+            carry_char_idx = nodes[-1].start_char_idx
+            if carry_char_idx is None or carry_char_idx <= 0:
+                carry_char_idx = len(window_text)
+            else:
+                nodes = nodes[:-1]
+
+        for node in nodes:
+            yield LocalizedText(
+                node.text or '',
+                *page_offset_map.find_page_range(
+                    window_offset + (node.start_char_idx or 0),
+                    window_offset + (node.end_char_idx or 0),
+                ),
+            )
+
+        window_offset += carry_char_idx
+        window_text_parts = [window_text[carry_char_idx:]]
+        window_page_count_current = 0
+
+    for page in pages:
+        page_text = page.text + '\n'
+        window_text_parts.append(page_text)
+        window_page_count_current += 1
+
+        page_offset_map.append(page.start_page_no, len(page_text))
+
+        if window_page_count_current >= window_page_count:
+            yield from split_window(final=False)
+
+    if page_offset_map.end_offset > window_offset:
+        yield from split_window(final=True)
+
+
+def extract_document_sentence_chunks(
+        document_data: bytes | str,
+        chunk_size: int,
+        chunk_overlap: int,
+        window_page_count: int = 16,
+        normalizer: TextNormalizer = DEFAULT_TEXT_NORMALIZER,
+        page_extraction_workers: int = 1,
+        tokenizer_cache_dir: str | None = None,
+) -> Iterator[LocalizedText]:
+    if page_extraction_workers > 1:
+        pages = extract_document_pages_parallel(document_data, page_extraction_workers, normalizer=normalizer)
+    else:
+        pages = extract_document_pages(document_data, normalizer)
+
+    yield from split_page_sentence_chunks(
+        pages=pages,
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        window_page_count=window_page_count,
+        tokenizer_cache_dir=tokenizer_cache_dir,
+    )
+
+
+@dataclass
+class PageHash:
+    page_no: int
+    page_hash: str
+
+
+@dataclass
+class DocumentRevision:
+    page_hashes: list[PageHash]
+
+    # Chunks of pages that have changed (or their neighbourhood) and need to be embedded.
+    chunks: list[LocalizedText]
+
+    # Chunks taken over from the previous revision (with updated page numbers) whose embeddings can be reused.
+    carried_chunks: list[LocalizedText]
+
+    # Indices into the previous revision's chunks the carried chunks originate from.
+    carried_chunk_indices: list[int]
+
+
+def compute_page_hash(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def extract_revised_document_sentence_chunks(
+        document_data: bytes | str,
+        previous_page_hashes: list[PageHash],
+        previous_chunks: list[LocalizedText],
+        chunk_size: int,
+        chunk_overlap: int,
+        window_page_count: int = 16,
+        normalizer: TextNormalizer = DEFAULT_TEXT_NORMALIZER,
+        tokenizer_cache_dir: str | None = None,
+        start_page_no: int = 0,
+        end_page_no: int | None = None,
+) -> DocumentRevision:
+    # Only the page range [start_page_no, end_page_no) of the new revision is processed, so that large revised
+    # documents can be split into work units like any other document. Pages are streamed and only their hashes are
+    # kept, except for the text of pages that do not occur in the previous revision at all, which are re-chunked.
+    previous_page_hash_set = {ph.page_hash for ph in previous_page_hashes}
+    page_hashes = []
+    changed_page_texts = {}
+
+    for page in extract_document_pages(document_data, normalizer, start_page_no, end_page_no):
+        page_hash = compute_page_hash(page.text)
+        page_hashes.append(PageHash(page.start_page_no, page_hash))
+
+        if page_hash not in previous_page_hash_set:
+            changed_page_texts[page.start_page_no] = page.text
+
+    # Unchanged pages are matched in order, which keeps track of pages that have been inserted or removed.
+    # Each previous page number is mapped onto the matching block it belongs to and its new page number.
+    matcher = SequenceMatcher(
+        None,
+        [ph.page_hash for ph in previous_page_hashes],
+        [ph.page_hash for ph in page_hashes],
+        autojunk=False,
+    )
+
+    page_no_mapping = {}
+    for block_index, (previous_index, index, size) in enumerate(matcher.get_matching_blocks()):
+        for i in range(size):
+            page_no_mapping[previous_page_hashes[previous_index + i].page_no] = (block_index, page_hashes[index + i].page_no)
+
+    # A previous chunk is carried over if all of its pages are unchanged and still adjacent within the page range.
+    # Otherwise, all of its pages need to be re-chunked so that no text of unchanged pages gets lost; this includes
+    # chunks that span the boundary of the page range, which are re-chunked by both adjacent work units.
+    previous_page_nos = [ph.page_no for ph in previous_page_hashes]
+    dirty_page_nos = {ph.page_no for ph in page_hashes} - {page_no for _, page_no in page_no_mapping.values()}
+    carried_chunks = []
+    carried_chunk_indices = []
+
+    for chunk_index, chunk in enumerate(previous_chunks):
+        start = page_no_mapping.get(chunk.start_page_no)
+        end = page_no_mapping.get(chunk.end_page_no)
+
+        if start is not None and end is not None and start[0] == end[0]:
+            carried_chunks.append(LocalizedText(chunk.text, start[1], end[1]))
+            carried_chunk_indices.append(chunk_index)
+            continue
+
+        for previous_page_no in previous_page_nos[
+            bisect_left(previous_page_nos, chunk.start_page_no):bisect_right(previous_page_nos, chunk.end_page_no)
+        ]:
+            if (mapping := page_no_mapping.get(previous_page_no)) is not None:
+                dirty_page_nos.add(mapping[1])
+
+    # Consecutive dirty pages are chunked together as independent page windows.
+    page_runs = []
+    previous_dirty = False
+
+    for page_hash in page_hashes:
+        dirty = page_hash.page_no in dirty_page_nos
+
+        if dirty and previous_dirty:
+            page_runs[-1].append(page_hash.page_no)
+        elif dirty:
+            page_runs.append([page_hash.page_no])
+
+        previous_dirty = dirty
+
+    chunks = []
+
+    if page_runs:
+        with open_document(document_data) as document:
+            def run_pages(page_run: list[int]) -> Iterator[LocalizedText]:
+                # Unchanged pages next to changed ones were not kept in memory and are extracted once more.
+                for page_no in page_run:
+                    if (page_text := changed_page_texts.pop(page_no, None)) is None:
+                        page_text = extract_page_text(document[page_no], normalizer)
+
+                    yield LocalizedText(page_text, page_no, page_no)
+
+            for page_run in page_runs:
+                chunks.extend(split_page_sentence_chunks(
+                    pages=run_pages(page_run),
+                    chunk_size=chunk_size,
+                    chunk_overlap=chunk_overlap,
+                    window_page_count=window_page_count,
+                    tokenizer_cache_dir=tokenizer_cache_dir,
+                ))
+
+    return DocumentRevision(
+        page_hashes=page_hashes,
+        chunks=chunks,
+        carried_chunks=carried_chunks,
+        carried_chunk_indices=carried_chunk_indices,
+    )
@@ -0,0 +1,382 @@
+# #
+# # SEA / SMART ENGINEERING ASSISTANT
+# # Copyright (c) 2024 SilentByte <https://silentbyte.com/>
+# #
+
+
+import json
+import random
+import sqlite3
+import hashlib
+import functools
+import threading
+import urllib.request
+
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from dataclasses import dataclass
+from typing import Iterable, Iterator
+
+import numpy as np
+
+from sea import utils
+
+DEFAULT_EMBEDDING_ENDPOINT = 'databricks-bge-large-en'
+
+
+class EmbeddingBackend:
+    model_name: str
+
+    def embed(self, texts: list[str]) -> list[list[float]]:
+        raise NotImplementedError()
+
+
+class DatabricksEmbeddingBackend(EmbeddingBackend):
+    def __init__(self, endpoint: str = DEFAULT_EMBEDDING_ENDPOINT):
+        import mlflow.deployments
+
+        self.model_name = endpoint
+        self.client = mlflow.deployments.get_deploy_client('databricks')
+
+    def embed(self, texts: list[str]) -> list[list[float]]:
+        return [
+            e['embedding']
+            for e in self.client.predict(
+                endpoint=self.model_name,
+                inputs={
+                    'input': texts,
+                },
+            ).data
+        ]
+
+
+class HttpEmbeddingBackend(EmbeddingBackend):
+    # Any endpoint that accepts {"input": [...]} and responds with {"data": [{"embedding": [...]}, ...]} can be used,
+    # e.g. a local server that hosts the same model as the Databricks endpoint.
+    def __init__(self, url: str, model_name: str = DEFAULT_EMBEDDING_ENDPOINT, timeout: float = 60.0):
+        self.url = url
+        self.model_name = model_name
+        self.timeout = timeout
+
+    def embed(self, texts: list[str]) -> list[list[float]]:
+        request = urllib.request.Request(
+            self.url,
+            data=json.dumps({'input': texts, 'model': self.model_name}).encode('utf-8'),
+            headers={'Content-Type': 'application/json'},
+            method='POST',
+        )
+
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return [e['embedding'] for e in json.load(response)['data']]
+
+
+@functools.cache
+def shared_databricks_embedding_backend(endpoint: str = DEFAULT_EMBEDDING_ENDPOINT) -> DatabricksEmbeddingBackend:
+    # One client per (Python worker) process, reused across UDF invocations.
+    return DatabricksEmbeddingBackend(endpoint)
+
+
+def is_throttling_error(e: Exception) -> bool:
+    # The deployment client does not expose the status code in a structured manner...
+    message = str(e)
+    return '429' in message or 'REQUEST_LIMIT_EXCEEDED' in message or 'Too Many Requests' in message
+
+
+TRANSIENT_ERROR_MESSAGES = ['Max retries exceeded', 'timed out', 'Connection aborted', 'Connection reset']
+
+
+def error_status_code(e: Exception) -> int | None:
+    # requests.HTTPError (deployment client) carries the response, urllib.error.HTTPError (HTTP backend) the code.
+    if (status_code := getattr(getattr(e, 'response', None), 'status_code', None)) is not None:
+        return int(status_code)
+
+    if isinstance(code := getattr(e, 'code', None), int):
+        return code
+
+    return None
+
+
+def is_retryable_error(e: Exception) -> bool:
+    # Only throttling, server errors, and network failures are retried; client errors such as authentication
+    # failures or malformed requests fail the same way on every attempt.
+    if is_throttling_error(e):
+        return True
+
+    if (status_code := error_status_code(e)) is not None:
+        return status_code >= 500
+
+    # Covers connection errors and timeouts of requests and urllib, which are all OSErrors.
+    if isinstance(e, OSError):
+        return True
+
+    # The deployment client wraps network failures it gave up retrying itself.
+    message = str(e)
+    return any(m in message for m in TRANSIENT_ERROR_MESSAGES)
+
+
+class AdaptiveBatchSizer:
+    def __init__(
+            self,
+            initial_batch_size: int = 32,
+            min_batch_size: int = 1,
+            max_batch_size: int = 150,
+            max_batch_chars: int = 256_000,
+            target_latency: float = 4.0,
+    ):
+        self.batch_size = initial_batch_size
+        self.min_batch_size = min_batch_size
+        self.max_batch_size = max_batch_size
+        self.max_batch_chars = max_batch_chars
+        self.target_latency = target_latency
+        self._lock = threading.Lock()
+
+    def next_batch(self, texts: list[str], start: int) -> int:
+        # Returns the (exclusive) end index of the next batch that starts at the given index.
+        with self._lock:
+            batch_size = self.batch_size
+
+        end = start
+        batch_chars = 0
+
+        while end < len(texts) and end - start < batch_size:
+            batch_chars += len(texts[end])
+            if end > start and batch_chars > self.max_batch_chars:
+                break
+
+            end += 1
+
+        return end
+
+    def observe(self, batch_size: int, latency: float, throttled: bool = False) -> None:
+        with self._lock:
+            if throttled:
+                self.batch_size = max(self.min_batch_size, self.batch_size // 2)
+            elif latency > self.target_latency:
+                self.batch_size = max(self.min_batch_size, int(self.batch_size * 0.75))
+            elif latency < self.target_latency / 2 and batch_size >= self.batch_size:
+                self.batch_size = min(self.max_batch_size, self.batch_size * 2)
+
+
+class EmbeddingRequestStats:
+    def __init__(self):
+        self.requests = 0
+        self.retries = 0
+        self._lock = threading.Lock()
+
+    def observe(self, retried: bool = False) -> None:
+        with self._lock:
+            self.requests += 1
+            if retried:
+                self.retries += 1
+
+
+def embed_with_retries(
+        backend: EmbeddingBackend,
+        texts: list[str],
+        batch_sizer: AdaptiveBatchSizer | None = None,
+        request_stats: EmbeddingRequestStats | None = None,
+        max_retries: int = 6,
+        initial_backoff: float = 1.0,
+        max_backoff: float = 60.0,
+) -> np.ndarray:
+    backoff = initial_backoff
+
+    for attempt in range(max_retries + 1):
+        start_time = utils.epoch()
+
+        if request_stats is not None:
+            request_stats.observe(retried=attempt > 0)
+
+        try:
+            embeddings = np.asarray(backend.embed(texts), dtype=np.float32)
+        except Exception as e:
+            throttled = is_throttling_error(e)
+
+            if batch_sizer is not None:
+                batch_sizer.observe(len(texts), utils.epoch() - start_time, throttled=throttled)
+
+            if attempt == max_retries or not is_retryable_error(e):
+                raise e
+
+            # Exponential backoff with jitter so that concurrent requests do not retry in lockstep.
+            utils.sleep(backoff * random.uniform(0.5, 1.0))
+            backoff = min(max_backoff, backoff * 2)
+            continue
+
+        if batch_sizer is not None:
+            batch_sizer.observe(len(texts), utils.epoch() - start_time)
+
+        return embeddings
+
+
+def compute_embeddings(
+        backend: EmbeddingBackend,
+        texts: list[str],
+        max_concurrency: int = 4,
+        batch_sizer: AdaptiveBatchSizer | None = None,
+        request_stats: EmbeddingRequestStats | None = None,
+) -> np.ndarray:
+    if len(texts) == 0:
+        return np.zeros((0, 0), dtype=np.float32)
+
+    batch_sizer = batch_sizer or AdaptiveBatchSizer()
+    results: dict[int, np.ndarray] = {}
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        pending = {}
+        start = 0
+
+        while start < len(texts) or pending:
+            # Batches are sized when they are submitted, so that later batches benefit from observed latencies.
+            while start < len(texts) and len(pending) < max_concurrency:
+                end = batch_sizer.next_batch(texts, start)
+                pending[executor.submit(embed_with_retries, backend, texts[start:end], batch_sizer, request_stats)] = start
+                start = end
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                results[pending.pop(future)] = future.result()
+
+    return np.concatenate([results[start] for start in sorted(results)])
+
+
+def compute_buffered_embeddings(
+        backend: EmbeddingBackend,
+        text_batches: Iterable[list[str]],
+        max_concurrency: int = 4,
+        batch_sizer: AdaptiveBatchSizer | None = None,
+        request_stats: EmbeddingRequestStats | None = None,
+) -> Iterator[np.ndarray]:
+    # Yields the embeddings of every batch of texts in order. Spark hands the texts to a UDF in small Arrow batches;
+    # they are buffered until they fill max_concurrency requests of the current batch size, so that the batch size can
+    # grow and the requests are sent concurrently instead of one small request per Arrow batch.
+    batch_sizer = batch_sizer or AdaptiveBatchSizer()
+    buffered_batches = []
+    buffered_texts = []
+
+    def flush() -> Iterator[np.ndarray]:
+        embeddings = compute_embeddings(backend, buffered_texts, max_concurrency, batch_sizer, request_stats)
+        start = 0
+
+        for texts in buffered_batches:
+            yield embeddings[start:start + len(texts)]
+            start += len(texts)
+
+    for texts in text_batches:
+        buffered_batches.append(texts)
+        buffered_texts.extend(texts)
+
+        if len(buffered_texts) >= batch_sizer.batch_size * max_concurrency:
+            yield from flush()
+            buffered_batches = []
+            buffered_texts = []
+
+    if buffered_batches:
+        yield from flush()
+
+
+def normalize_embedding_text(text: str) -> str:
+    return ' '.join(text.split())
+
+
+def embedding_cache_key(text: str, model_name: str) -> str:
+    # Must be kept in sync with SeaRuntime.embedding_cache_key_column().
+    return hashlib.sha256(f'{model_name}|{normalize_embedding_text(text)}'.encode('utf-8')).hexdigest()
+
+
+@dataclass
+class EmbeddingCacheStats:
+    # Distinct texts found in the cache and distinct texts sent to the endpoint. Repeated occurrences of a text
+    # within the same call are counted as duplicates, so that they do not inflate the hit rate.
+    hits: int = 0
+    misses: int = 0
+    duplicates: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hits / (self.hits + self.misses) if self.hits + self.misses > 0 else 0.0
+
+    def add(self, other: 'EmbeddingCacheStats') -> None:
+        self.hits += other.hits
+        self.misses += other.misses
+        self.duplicates += other.duplicates
+
+    def to_dict(self) -> dict:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'duplicates': self.duplicates,
+            'hit_rate': self.hit_rate,
+        }
+
+
+class LocalEmbeddingCache:
+    def __init__(self, file_name: str):
+        self.file_name = file_name
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(file_name, check_same_thread=False)
+        self._connection.execute(r'''
+            CREATE TABLE IF NOT EXISTS embedding_cache (
+                text_hash           TEXT PRIMARY KEY,
+                embeddings          BLOB
+            )
+        ''')
+
+    def get_many(self, keys: list[str]) -> dict[str, np.ndarray]:
+        embeddings = {}
+        batch_size = 500
+
+        with self._lock:
+            for i in range(0, len(keys), batch_size):
+                batch = keys[i:i + batch_size]
+                rows = self._connection.execute(
+                    f'SELECT text_hash, embeddings FROM embedding_cache WHERE text_hash IN ({",".join("?" * len(batch))})',
+                    batch,
+                )
+
+                for text_hash, data in rows:
+                    embeddings[text_hash] = np.frombuffer(data, dtype=np.float32)
+
+        return embeddings
+
+    def put_many(self, embeddings: dict[str, np.ndarray]) -> None:
+        with self._lock, self._connection:
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO embedding_cache (text_hash, embeddings) VALUES (?, ?)',
+                [(key, np.asarray(value, dtype=np.float32).tobytes()) for key, value in embeddings.items()],
+            )
+
+
+def compute_cached_embeddings(
+        backend: EmbeddingBackend,
+        texts: list[str],
+        cache: LocalEmbeddingCache,
+        stats: EmbeddingCacheStats | None = None,
+        **kwargs,
+) -> np.ndarray:
+    keys = [embedding_cache_key(text, backend.model_name) for text in texts]
+    distinct_keys = set(keys)
+    cached = cache.get_many(list(distinct_keys))
+
+    # Texts that occur multiple times are only sent once.
+    missing = {}
+    for key, text in zip(keys, texts):
+        if key not in cached:
+            missing.setdefault(key, text)
+
+    if missing:
+        computed = compute_embeddings(backend, list(missing.values()), **kwargs)
+        computed = dict(zip(missing.keys(), computed))
+        cache.put_many(computed)
+        cached.update(computed)
+
+    if stats is not None:
+        stats.add(EmbeddingCacheStats(
+            hits=len(distinct_keys) - len(missing),
+            misses=len(missing),
+            duplicates=len(keys) - len(distinct_keys),
+        ))
+
+    if not texts:
+        return np.zeros((0, 0), dtype=np.float32)
+
+    return np.stack([cached[key] for key in keys])
@@ -5,18 +5,23 @@
 
 
 import os
+import asyncio
+import functools
+import threading
 
-from dataclasses import dataclass
-
-from databricks.vector_search.client import VectorSearchClient
-from langchain.prompts import PromptTemplate
-from langchain.schema.output_parser import StrOutputParser
-from langchain.schema.runnable import RunnableLambda
-from langchain_community.chat_models import ChatDatabricks
-from langchain_community.embeddings import DatabricksEmbeddings
-from langchain_community.vectorstores import DatabricksVectorSearch
+from concurrent.futures import Executor, ThreadPoolExecutor
+from dataclasses import dataclass, replace
+from typing import TYPE_CHECKING, Any, AsyncIterator, Awaitable, Callable, Iterator
 
 from sea import utils
+from sea.classification import InteractionClassification, InteractionClassifier
+
+# LangChain and the Databricks clients take seconds to import, so they are only imported once they are needed.
+if TYPE_CHECKING:
+    from langchain.prompts import PromptTemplate
+    from langchain.schema.runnable import Runnable
+
+    from sea.answercache import SemanticAnswerCache
 
 
 @dataclass
@@ -47,6 +52,14 @@ class InferenceSource:
 class InferenceResult:
     text: str
     sources: list[InferenceSource]
+    classification: InteractionClassification | None = None
+    retrieval: 'RetrievalMetrics | None' = None
+
+    # Seconds from the start of the interaction until the first token of the answer was available.
+    time_to_first_token: float | None = None
+
+    # Either 'exact' or 'semantic' if the answer has been served from the answer cache.
+    answer_cache: str | None = None
 
     def to_dict(self) -> dict:
         return {
@@ -81,6 +94,107 @@ class InferenceInteraction:
         }
 
 
+@dataclass
+class RetrievalMetrics:
+    speculative: bool
+    used: bool
+    wall_time: float
+    overlapped_time: float
+
+    def to_dict(self) -> dict:
+        return {
+            'speculative': self.speculative,
+            'used': self.used,
+            'wall_time': self.wall_time,
+            'overlapped_time': self.overlapped_time,
+        }
+
+
+class BackgroundSearch:
+    # A search that runs in the background while the caller keeps working, e.g. on classifying the question. The
+    # overlapped time is the part of the search the caller did not have to wait for.
+    def __init__(self):
+        self.start_time = utils.epoch()
+        self.end_time: float | None = None
+        self.wait_time = 0.0
+
+    def metrics(self, used: bool = True) -> RetrievalMetrics:
+        wall_time = (self.end_time or utils.epoch()) - self.start_time
+
+        return RetrievalMetrics(
+            speculative=True,
+            used=used,
+            wall_time=wall_time,
+            overlapped_time=max(0.0, wall_time - self.wait_time),
+        )
+
+
+class SpeculativeSearch(BackgroundSearch):
+    def __init__(self, executor: Executor, search: Callable[[], list]):
+        super().__init__()
+        self._future = executor.submit(self._run, search)
+
+    def _run(self, search: Callable[[], list]) -> list:
+        try:
+            return search()
+        finally:
+            self.end_time = utils.epoch()
+
+    def results(self) -> list:
+        wait_start_time = utils.epoch()
+
+        try:
+            return self._future.result()
+        finally:
+            self.wait_time = utils.epoch() - wait_start_time
+
+    def discard(self) -> None:
+        # A search that has already started cannot be interrupted; its results are dropped once it completes.
+        self._future.cancel()
+
+
+class AsyncSpeculativeSearch(BackgroundSearch):
+    # Same as SpeculativeSearch, but runs as a task on the event loop of the caller.
+    def __init__(self, search: Callable[[], Awaitable[list]]):
+        super().__init__()
+        self._task = asyncio.ensure_future(self._run(search))
+
+    async def _run(self, search: Callable[[], Awaitable[list]]) -> list:
+        try:
+            return await search()
+        finally:
+            self.end_time = utils.epoch()
+
+    async def results(self) -> list:
+        wait_start_time = utils.epoch()
+
+        try:
+            return await self._task
+        finally:
+            self.wait_time = utils.epoch() - wait_start_time
+
+    def discard(self) -> None:
+        self._task.cancel()
+
+
+@dataclass
+class InferenceStreamEvent:
+    # Either 'sources' (sent once before the answer), 'token' (a part of the answer), or 'result' (sent last).
+    event: str
+    text: str | None = None
+    sources: list[InferenceSource] | None = None
+    result: InferenceResult | None = None
+
+    def to_dict(self) -> dict:
+        if self.event == 'sources':
+            return {'sources': [s.to_dict() for s in self.sources]}
+
+        if self.event == 'token':
+            return {'text': self.text}
+
+        return self.result.to_dict()
+
+
 class SeaInferenceClient:
     DEFAULT_TECHNICAL_PROMPT_TEMPLATE = r'''
         You are called Eugine and you are an assistant to a qualified engineer and about to answer their question.
@@ -140,20 +254,138 @@ class SeaInferenceClient:
             vector_search_endpoint: str,
             vector_search_index: str,
             result_count: int,
-            prompt_template_override: str | None = None
+            prompt_template_override: str | None = None,
+            retriever_backend: str = 'databricks',
+            pgvector_cursor_factory: Callable[[], Any] | None = None,
+            vector_index_dir: str | None = None,
+            interaction_classifier: InteractionClassifier | None = None,
+            min_classifier_confidence: float = 0.95,
+            speculative_retrieval: bool = False,
+            answer_cache: 'SemanticAnswerCache | None' = None,
+            search_threads: int | None = None,
     ):
         self.vector_search_endpoint = vector_search_endpoint
         self.vector_search_index = vector_search_index
         self.result_count = max(1, min(result_count, 16))
         self.prompt_template_override = prompt_template_override
+        self.retriever_backend = retriever_backend
+        self.pgvector_cursor_factory = pgvector_cursor_factory
+        self.vector_index_dir = vector_index_dir
+        self.interaction_classifier = interaction_classifier
+        self.min_classifier_confidence = min_classifier_confidence
+        self.speculative_retrieval = speculative_retrieval
+        self.answer_cache = answer_cache
+        self.search_threads = search_threads
+
+        # Models, retrievers, and chains are built on first use and then shared by all threads using this client;
+        # the lock is reentrant because chains are built from the models.
+        self._lock = threading.RLock()
+        self._components = {}
+        self._initialized = False
+
+        if retriever_backend == 'pgvector' and pgvector_cursor_factory is None:
+            raise ValueError('The pgvector retriever requires a cursor factory')
+
+        if retriever_backend == 'mmap' and vector_index_dir is None:
+            raise ValueError('The memory-mapped retriever requires a vector index directory')
+
+    def _component(self, name: str, factory: Callable[[], Any]) -> Any:
+        if (component := self._components.get(name)) is None:
+            with self._lock:
+                if (component := self._components.get(name)) is None:
+                    component = self._components[name] = factory()
+
+        return component
+
+    def initialize(self) -> None:
+        # Builds the models, the retriever, and the chains up front; this imports LangChain and the Databricks
+        # clients, and the Databricks retriever looks up the index in the workspace.
+        for name in ('technical_chain', 'casual_chain', 'initial_chain', 'search_chain'):
+            getattr(self, name)
+
+        self._initialized = True
+
+    async def ainitialize(self) -> None:
+        # Building the components blocks, so it must not run on the event loop.
+        if not self._initialized:
+            await asyncio.get_running_loop().run_in_executor(None, self.initialize)
+
+    @property
+    def embedding_model(self):
+        def create_embedding_model():
+            from langchain_community.embeddings import DatabricksEmbeddings
+
+            embedding_model = DatabricksEmbeddings(endpoint="databricks-bge-large-en")
+
+            # The answer cache and the (speculative) search embed the same question, often at the same time; both
+            # share a single request to the embedding model.
+            if self.answer_cache is not None:
+                from sea.retrieval import MemoizedQueryEmbeddings
+
+                return MemoizedQueryEmbeddings(embedding_model)
+
+            return embedding_model
+
+        return self._component('embedding_model', create_embedding_model)
+
+    @property
+    def agent_model(self):
+        def create_agent_model():
+            from langchain_community.chat_models import ChatDatabricks
+
+            return ChatDatabricks(
+                endpoint="databricks-dbrx-instruct",
+                max_tokens=620,
+            )
 
-        self.embedding_model = DatabricksEmbeddings(endpoint="databricks-bge-large-en")
-        self.agent_model = ChatDatabricks(
-            endpoint="databricks-dbrx-instruct",
-            max_tokens=620,
-        )
+        return self._component('agent_model', create_agent_model)
+
+    @property
+    def search_executor(self) -> Executor:
+        return self._component('search_executor', lambda: ThreadPoolExecutor(max_workers=self.search_threads,
+                                                                              thread_name_prefix='sea-search'))
+
+    @property
+    def retriever(self):
+        return self._component('retriever', self._retriever)
 
     def _retriever(self):
+        if self.retriever_backend == 'databricks':
+            return self._databricks_retriever()
+
+        if self.retriever_backend == 'pgvector':
+            return self._pgvector_retriever()
+
+        if self.retriever_backend == 'mmap':
+            return self._memory_mapped_retriever()
+
+        raise ValueError(f'Unknown retriever backend {self.retriever_backend}')
+
+    def _pgvector_retriever(self):
+        from sea.retrieval import PgVectorRetriever
+
+        return PgVectorRetriever(
+            embedding=self.embedding_model,
+            cursor_factory=self.pgvector_cursor_factory,
+            executor=self.search_executor,
+            k=self.result_count,
+        )
+
+    def _memory_mapped_retriever(self):
+        from sea.retrieval import MemoryMappedRetriever
+        from sea.vectorindex import shared_vector_index
+
+        return MemoryMappedRetriever(
+            embedding=self.embedding_model,
+            index=shared_vector_index(self.vector_index_dir),
+            k=self.result_count,
+        )
+
+    def _databricks_retriever(self):
+        from databricks.vector_search.client import VectorSearchClient
+        from langchain_community.vectorstores import DatabricksVectorSearch
+
+        # Looking up the index is a round trip to the workspace, so the retriever is only built once per client.
         vector_search_client = VectorSearchClient()
         vector_search_index = vector_search_client.get_index(
             endpoint_name=self.vector_search_endpoint,
@@ -174,19 +406,51 @@ class SeaInferenceClient:
             'k': self.result_count,
         })
 
-    def _technical_prompt_template(self) -> PromptTemplate:
+    def _answer_chain(self, prompt_template: 'PromptTemplate') -> 'Runnable':
+        from langchain.schema.output_parser import StrOutputParser
+
+        return prompt_template | self.agent_model | StrOutputParser()
+
+    @property
+    def technical_chain(self) -> 'Runnable':
+        return self._component('technical_chain', lambda: self._answer_chain(self._technical_prompt_template()))
+
+    @property
+    def casual_chain(self) -> 'Runnable':
+        return self._component('casual_chain', lambda: self._answer_chain(self._casual_prompt_template()))
+
+    @property
+    def initial_chain(self) -> 'Runnable':
+        return self._component('initial_chain', lambda: self._answer_chain(self._initial_prompt_template()))
+
+    @property
+    def search_chain(self) -> 'Runnable':
+        def create_search_chain():
+            from langchain.schema.runnable import RunnableLambda
+
+            return RunnableLambda(SeaInferenceClient._extract_question) | self.retriever
+
+        return self._component('search_chain', create_search_chain)
+
+    def _technical_prompt_template(self) -> 'PromptTemplate':
+        from langchain.prompts import PromptTemplate
+
         return PromptTemplate(
             input_variables=['history', 'question', 'search_results'],
             template=utils.dedent(self.prompt_template_override or SeaInferenceClient.DEFAULT_TECHNICAL_PROMPT_TEMPLATE),
         )
 
-    def _casual_prompt_template(self) -> PromptTemplate:
+    def _casual_prompt_template(self) -> 'PromptTemplate':
+        from langchain.prompts import PromptTemplate
+
         return PromptTemplate(
             input_variables=['history', 'question', ],
             template=utils.dedent(SeaInferenceClient.DEFAULT_CASUAL_PROMPT_TEMPLATE),
         )
 
-    def _initial_prompt_template(self) -> PromptTemplate:
+    def _initial_prompt_template(self) -> 'PromptTemplate':
+        from langchain.prompts import PromptTemplate
+
         return PromptTemplate(
             input_variables=['history', 'question'],
             template=utils.dedent(SeaInferenceClient.DEFAULT_INITIAL_PROMPT_TEMPLATE),
@@ -233,10 +497,10 @@ class SeaInferenceClient:
         ]
 
     def _search_index(self, interaction_history: list[InferenceInteraction]):
-        return (
-                RunnableLambda(SeaInferenceClient._extract_question)
-                | self._retriever()
-        ).invoke(interaction_history)
+        return self.search_chain.invoke(interaction_history)
+
+    def start_search_index(self, interaction_history: list[InferenceInteraction]) -> SpeculativeSearch:
+        return SpeculativeSearch(self.search_executor, lambda: self._search_index(interaction_history))
 
     def query_search_index(self, query: str) -> list[InferenceSource]:
         search_results = self._search_index([
@@ -245,18 +509,30 @@ class SeaInferenceClient:
 
         return SeaInferenceClient._extract_sources(search_results)
 
-    def infer_technical_question(self, interaction_history: list[InferenceInteraction]) -> bool:
-        prompt_template = self._initial_prompt_template()
+    async def _asearch_index(self, interaction_history: list[InferenceInteraction]):
+        return await self.search_chain.ainvoke(interaction_history)
+
+    def astart_search_index(self, interaction_history: list[InferenceInteraction]) -> AsyncSpeculativeSearch:
+        return AsyncSpeculativeSearch(lambda: self._asearch_index(interaction_history))
 
-        inference_result = (
-                prompt_template
-                | self.agent_model
-                | StrOutputParser()
-        ).invoke({
+    async def aquery_search_index(self, query: str) -> list[InferenceSource]:
+        await self.ainitialize()
+
+        search_results = await self._asearch_index([
+            InferenceInteraction('user', query),
+        ])
+
+        return SeaInferenceClient._extract_sources(search_results)
+
+    @staticmethod
+    def _classification_input(interaction_history: list[InferenceInteraction]) -> dict:
+        return {
             'history': SeaInferenceClient._concatenate_history_text(interaction_history),
             'question': SeaInferenceClient._extract_question(interaction_history),
-        })
+        }
 
+    @staticmethod
+    def _is_technical_answer(inference_result: str) -> bool:
         if 'CASUAL' in inference_result:
             return False
 
@@ -271,28 +547,407 @@ class SeaInferenceClient:
 
         return False
 
-    def infer_interaction(self, interaction_history: list[InferenceInteraction]) -> InferenceResult:
+    def infer_technical_question(self, interaction_history: list[InferenceInteraction]) -> bool:
+        inference_result = self.initial_chain.invoke(SeaInferenceClient._classification_input(interaction_history))
+        return SeaInferenceClient._is_technical_answer(inference_result)
+
+    async def ainfer_technical_question(self, interaction_history: list[InferenceInteraction]) -> bool:
+        inference_result = await self.initial_chain.ainvoke(SeaInferenceClient._classification_input(interaction_history))
+        return SeaInferenceClient._is_technical_answer(inference_result)
+
+    def _classify_locally(self, interaction_history: list[InferenceInteraction]) -> InteractionClassification | None:
+        # The classifier only sees the question; follow-ups such as "How do I do that?" depend on the previous turns,
+        # which only the model takes into account.
+        if self.interaction_classifier is None or len(interaction_history) > 1:
+            return None
+
+        start_time = utils.epoch()
+        classification = self.interaction_classifier.classify(SeaInferenceClient._extract_question(interaction_history))
+        classification.latency = utils.epoch() - start_time
+        classification.local_confidence = classification.confidence
+
+        return classification
+
+    def _classify_with_model(
+            self,
+            interaction_history: list[InferenceInteraction],
+            local_classification: InteractionClassification | None,
+    ) -> InteractionClassification:
+        start_time = utils.epoch()
+        technical = self.infer_technical_question(interaction_history)
+
+        return SeaInferenceClient._model_classification(technical, start_time, local_classification)
+
+    async def _aclassify_with_model(
+            self,
+            interaction_history: list[InferenceInteraction],
+            local_classification: InteractionClassification | None,
+    ) -> InteractionClassification:
+        start_time = utils.epoch()
+        technical = await self.ainfer_technical_question(interaction_history)
+
+        return SeaInferenceClient._model_classification(technical, start_time, local_classification)
+
+    @staticmethod
+    def _model_classification(
+            technical: bool,
+            start_time: float,
+            local_classification: InteractionClassification | None,
+    ) -> InteractionClassification:
+        return InteractionClassification(
+            technical=technical,
+            confidence=1.0,
+            path='llm' if local_classification is None else 'llm_fallback',
+            latency=utils.epoch() - start_time + (local_classification.latency if local_classification else 0.0),
+            local_confidence=local_classification.confidence if local_classification else None,
+        )
+
+    def _is_confident(self, classification: InteractionClassification | None) -> bool:
+        return classification is not None and classification.confidence >= self.min_classifier_confidence
+
+    def _prepare_answer(self, interaction_history: list[InferenceInteraction], start_time: float):
+        # Returns the cached result instead if a near-duplicate technical question has been answered before.
         if len(interaction_history) == 0:
             raise ValueError('Interaction history must not be empty')
 
-        if self.infer_technical_question(interaction_history):
+        local_classification = self._classify_locally(interaction_history)
+        speculative_search = None
+        retrieval = None
+
+        if self._is_confident(local_classification):
+            classification = local_classification
+        else:
+            # While the model classifies the question, the search already runs; for casual questions it is discarded.
+            if self.speculative_retrieval:
+                speculative_search = self.start_search_index(interaction_history)
+
+            try:
+                classification = self._classify_with_model(interaction_history, local_classification)
+            except Exception as e:
+                if speculative_search is not None:
+                    speculative_search.discard()
+
+                raise e
+
+        if classification.technical and (cached_result := self._lookup_similar_answer(interaction_history,
+                                                                                      start_time)) is not None:
+            if speculative_search is not None:
+                speculative_search.discard()
+
+            return cached_result
+
+        if classification.technical and speculative_search is not None:
+            search_results = speculative_search.results()
+            retrieval = speculative_search.metrics()
+        elif classification.technical:
+            start_time = utils.epoch()
             search_results = self._search_index(interaction_history)
-            prompt_template = self._technical_prompt_template()
+            retrieval = RetrievalMetrics(speculative=False, used=True, wall_time=utils.epoch() - start_time,
+                                         overlapped_time=0.0)
         else:
+            if speculative_search is not None:
+                speculative_search.discard()
+                retrieval = speculative_search.metrics(used=False)
+
             search_results = []
-            prompt_template = self._casual_prompt_template()
 
-        inference_result = (
-                prompt_template
-                | self.agent_model
-                | StrOutputParser()
-        ).invoke({
+        return self._answer(interaction_history, search_results, classification, retrieval)
+
+    async def _aprepare_answer(self, interaction_history: list[InferenceInteraction], start_time: float):
+        if len(interaction_history) == 0:
+            raise ValueError('Interaction history must not be empty')
+
+        local_classification = self._classify_locally(interaction_history)
+        speculative_search = None
+        retrieval = None
+
+        if self._is_confident(local_classification):
+            classification = local_classification
+        else:
+            if self.speculative_retrieval:
+                speculative_search = self.astart_search_index(interaction_history)
+
+            try:
+                classification = await self._aclassify_with_model(interaction_history, local_classification)
+            except BaseException as e:
+                # Also covers the cancellation of the request, which must not leave the search task behind.
+                if speculative_search is not None:
+                    speculative_search.discard()
+
+                raise e
+
+        if classification.technical:
+            try:
+                cached_result = await self._alookup_similar_answer(interaction_history, start_time)
+            except BaseException as e:
+                if speculative_search is not None:
+                    speculative_search.discard()
+
+                raise e
+
+            if cached_result is not None:
+                if speculative_search is not None:
+                    speculative_search.discard()
+
+                return cached_result
+
+        if classification.technical and speculative_search is not None:
+            search_results = await speculative_search.results()
+            retrieval = speculative_search.metrics()
+        elif classification.technical:
+            start_time = utils.epoch()
+            search_results = await self._asearch_index(interaction_history)
+            retrieval = RetrievalMetrics(speculative=False, used=True, wall_time=utils.epoch() - start_time,
+                                         overlapped_time=0.0)
+        else:
+            if speculative_search is not None:
+                speculative_search.discard()
+                retrieval = speculative_search.metrics(used=False)
+
+            search_results = []
+
+        return self._answer(interaction_history, search_results, classification, retrieval)
+
+    def _answer(
+            self,
+            interaction_history: list[InferenceInteraction],
+            search_results: list,
+            classification: InteractionClassification,
+            retrieval: RetrievalMetrics | None,
+    ):
+        answer_chain = self.technical_chain if classification.technical else self.casual_chain
+        answer_input = {
             'search_results': SeaInferenceClient._concatenate_search_results(search_results),
             'history': SeaInferenceClient._concatenate_history_text(interaction_history),
             'question': SeaInferenceClient._extract_question(interaction_history),
-        })
+        }
+
+        return answer_chain, answer_input, search_results, classification, retrieval
+
+    @staticmethod
+    def _answer_cache_key(interaction_history: list[InferenceInteraction]) -> tuple[str, str]:
+        from sea.answercache import history_fingerprint
+
+        return (
+            SeaInferenceClient._extract_question(interaction_history),
+            history_fingerprint([(ii.originator, ii.text) for ii in interaction_history[:-1]]),
+        )
+
+    def _cached_answer(self, cached_result: InferenceResult, answer_cache: str, start_time: float) -> InferenceResult:
+        return replace(cached_result, retrieval=None, answer_cache=answer_cache,
+                       time_to_first_token=utils.epoch() - start_time)
+
+    def _lookup_answer(self, interaction_history: list[InferenceInteraction], start_time: float):
+        # Exact matches are served before the question is classified and without any request.
+        if self.answer_cache is None or len(interaction_history) == 0:
+            return None
+
+        question, fingerprint = SeaInferenceClient._answer_cache_key(interaction_history)
+
+        if (cached_result := self.answer_cache.get_exact(question, fingerprint)) is not None:
+            return self._cached_answer(cached_result, 'exact', start_time)
+
+        return None
+
+    def _lookup_similar_answer(self, interaction_history: list[InferenceInteraction], start_time: float):
+        # Near-duplicates require the embedding of the question, so they are only looked up for technical questions,
+        # which need the embedding for retrieval anyway if the answer is not in the cache.
+        if self.answer_cache is None:
+            return None
+
+        question, fingerprint = SeaInferenceClient._answer_cache_key(interaction_history)
+        embedding = self.embedding_model.embed_query(question)
+
+        if (cached_result := self.answer_cache.get_similar(fingerprint, embedding)) is not None:
+            return self._cached_answer(cached_result, 'semantic', start_time)
+
+        return None
 
-        return InferenceResult(
-            text=inference_result,
+    async def _alookup_similar_answer(self, interaction_history: list[InferenceInteraction], start_time: float):
+        if self.answer_cache is None:
+            return None
+
+        question, fingerprint = SeaInferenceClient._answer_cache_key(interaction_history)
+        embedding = await self.embedding_model.aembed_query(question)
+
+        if (cached_result := self.answer_cache.get_similar(fingerprint, embedding)) is not None:
+            return self._cached_answer(cached_result, 'semantic', start_time)
+
+        return None
+
+    @staticmethod
+    def _is_technical_result(inference_result: InferenceResult) -> bool:
+        return inference_result.classification is not None and inference_result.classification.technical
+
+    def _answer_cache_version(self) -> str | None:
+        return self.answer_cache.version() if self.answer_cache is not None else None
+
+    def _store_answer(
+            self,
+            interaction_history: list[InferenceInteraction],
+            inference_result: InferenceResult,
+            cache_version: str | None,
+    ) -> None:
+        if self.answer_cache is None:
+            return
+
+        # Answers to casual questions are only matched exactly, so that they never require an embedding. The
+        # embedding of a technical question has been memoized during the lookup, so this does not send a request.
+        question, fingerprint = SeaInferenceClient._answer_cache_key(interaction_history)
+        embedding = (self.embedding_model.embed_query(question)
+                     if SeaInferenceClient._is_technical_result(inference_result) else None)
+
+        self.answer_cache.put(question, fingerprint, embedding, inference_result, cache_version)
+
+    async def _astore_answer(
+            self,
+            interaction_history: list[InferenceInteraction],
+            inference_result: InferenceResult,
+            cache_version: str | None,
+    ) -> None:
+        if self.answer_cache is None:
+            return
+
+        question, fingerprint = SeaInferenceClient._answer_cache_key(interaction_history)
+        embedding = (await self.embedding_model.aembed_query(question)
+                     if SeaInferenceClient._is_technical_result(inference_result) else None)
+
+        self.answer_cache.put(question, fingerprint, embedding, inference_result, cache_version)
+
+    @staticmethod
+    def _cached_answer_events(cached_result: InferenceResult) -> Iterator[InferenceStreamEvent]:
+        yield InferenceStreamEvent('sources', sources=cached_result.sources)
+        yield InferenceStreamEvent('token', text=cached_result.text)
+        yield InferenceStreamEvent('result', result=cached_result)
+
+    def infer_interaction(self, interaction_history: list[InferenceInteraction]) -> InferenceResult:
+        start_time = utils.epoch()
+        cache_version = self._answer_cache_version()
+
+        if (cached_result := self._lookup_answer(interaction_history, start_time)) is not None:
+            return cached_result
+
+        prepared_answer = self._prepare_answer(interaction_history, start_time)
+
+        if isinstance(prepared_answer, InferenceResult):
+            return prepared_answer
+
+        answer_chain, answer_input, search_results, classification, retrieval = prepared_answer
+        inference_result = InferenceResult(
+            text=answer_chain.invoke(answer_input),
             sources=SeaInferenceClient._extract_sources(search_results),
+            classification=classification,
+            retrieval=retrieval,
+            time_to_first_token=utils.epoch() - start_time,
         )
+
+        self._store_answer(interaction_history, inference_result, cache_version)
+        return inference_result
+
+    async def ainfer_interaction(self, interaction_history: list[InferenceInteraction]) -> InferenceResult:
+        # Same as infer_interaction(), but waits for the models without blocking a thread of the caller.
+        start_time = utils.epoch()
+        await self.ainitialize()
+        cache_version = self._answer_cache_version()
+
+        if (cached_result := self._lookup_answer(interaction_history, start_time)) is not None:
+            return cached_result
+
+        prepared_answer = await self._aprepare_answer(interaction_history, start_time)
+
+        if isinstance(prepared_answer, InferenceResult):
+            return prepared_answer
+
+        answer_chain, answer_input, search_results, classification, retrieval = prepared_answer
+        inference_result = InferenceResult(
+            text=await answer_chain.ainvoke(answer_input),
+            sources=SeaInferenceClient._extract_sources(search_results),
+            classification=classification,
+            retrieval=retrieval,
+            time_to_first_token=utils.epoch() - start_time,
+        )
+
+        await self._astore_answer(interaction_history, inference_result, cache_version)
+        return inference_result
+
+    async def astream_interaction(
+            self,
+            interaction_history: list[InferenceInteraction],
+    ) -> AsyncIterator[InferenceStreamEvent]:
+        # Same as ainfer_interaction(), but the sources are yielded as soon as they are known and the answer is yielded
+        # token by token while it is being generated; the complete result is yielded last.
+        start_time = utils.epoch()
+        await self.ainitialize()
+        cache_version = self._answer_cache_version()
+
+        if (cached_result := self._lookup_answer(interaction_history, start_time)) is not None:
+            for event in SeaInferenceClient._cached_answer_events(cached_result):
+                yield event
+
+            return
+
+        prepared_answer = await self._aprepare_answer(interaction_history, start_time)
+
+        if isinstance(prepared_answer, InferenceResult):
+            for event in SeaInferenceClient._cached_answer_events(prepared_answer):
+                yield event
+
+            return
+
+        answer_chain, answer_input, search_results, classification, retrieval = prepared_answer
+        sources = SeaInferenceClient._extract_sources(search_results)
+
+        yield InferenceStreamEvent('sources', sources=sources)
+
+        tokens = []
+        time_to_first_token = None
+
+        async for token in answer_chain.astream(answer_input):
+            if time_to_first_token is None:
+                time_to_first_token = utils.epoch() - start_time
+
+            tokens.append(token)
+            yield InferenceStreamEvent('token', text=token)
+
+        inference_result = InferenceResult(
+            text=''.join(tokens),
+            sources=sources,
+            classification=classification,
+            retrieval=retrieval,
+            time_to_first_token=time_to_first_token,
+        )
+
+        await self._astore_answer(interaction_history, inference_result, cache_version)
+        yield InferenceStreamEvent('result', result=inference_result)
+
+
+@functools.cache
+def shared_inference_client(
+        vector_search_endpoint: str,
+        vector_search_index: str,
+        result_count: int,
+        prompt_template_override: str | None = None,
+        retriever_backend: str = 'databricks',
+        pgvector_cursor_factory: Callable[[], Any] | None = None,
+        vector_index_dir: str | None = None,
+        interaction_classifier: InteractionClassifier | None = None,
+        min_classifier_confidence: float = 0.95,
+        speculative_retrieval: bool = False,
+        answer_cache: 'SemanticAnswerCache | None' = None,
+        search_threads: int | None = None,
+) -> SeaInferenceClient:
+    # One client per distinct configuration and process, reused by all requests and threads of a server worker.
+    return SeaInferenceClient(
+        vector_search_endpoint=vector_search_endpoint,
+        vector_search_index=vector_search_index,
+        result_count=result_count,
+        prompt_template_override=prompt_template_override,
+        retriever_backend=retriever_backend,
+        pgvector_cursor_factory=pgvector_cursor_factory,
+        vector_index_dir=vector_index_dir,
+        interaction_classifier=interaction_classifier,
+        min_classifier_confidence=min_classifier_confidence,
+        speculative_retrieval=speculative_retrieval,
+        answer_cache=answer_cache,
+        search_threads=search_threads,
+    )
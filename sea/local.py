@@ -0,0 +1,351 @@
+# #
+# # SEA / SMART ENGINEERING ASSISTANT
+# # Copyright (c) 2024 SilentByte <https://silentbyte.com/>
+# #
+
+
+import os
+import json
+import itertools
+import sqlite3
+import threading
+
+from concurrent.futures import FIRST_COMPLETED, Executor, ProcessPoolExecutor, wait
+from dataclasses import dataclass
+from glob import glob
+from typing import Iterator
+
+import numpy as np
+
+from sea import cache, dataprocessing, embedding, metrics, utils
+from sea.config import SeaConfig
+
+
+@dataclass
+class LocalDocumentChunks:
+    file_name: str
+    file_hash: str
+    file_size: int
+    file_timestamp: float
+    chunk_key: str
+    page_count: int
+    chunks: list[dataprocessing.LocalizedText]
+
+    # Seconds the worker spent hashing and chunking this document.
+    chunk_time: float = 0.0
+
+
+@dataclass
+class LocalDocumentVector:
+    id: str
+    file_name: str
+    file_hash: str
+    start_page_no: int
+    end_page_no: int
+    content: str
+    embeddings: np.ndarray
+
+
+def read_document_vectors_json(path: str) -> Iterator[LocalDocumentVector]:
+    # Reads an export written by SeaRuntime.export_document_vectors(), i.e. a directory of JSON Lines part files.
+    file_names = sorted(glob(os.path.join(path, '*.json'))) if os.path.isdir(path) else [path]
+
+    for file_name in file_names:
+        with open(file_name, 'r', encoding='utf-8') as fp:
+            for line in fp:
+                if not line.strip():
+                    continue
+
+                v = json.loads(line)
+                yield LocalDocumentVector(
+                    id=v['id'],
+                    file_name=v['file_name'],
+                    file_hash=v['file_hash'],
+                    start_page_no=v['start_page_no'],
+                    end_page_no=v['end_page_no'],
+                    content=v['content'],
+                    embeddings=np.asarray(v['embeddings'], dtype=np.float32),
+                )
+
+
+def chunk_local_document(
+        file_name: str,
+        chunk_size: int,
+        chunk_overlap: int,
+        normalizer: dataprocessing.TextNormalizer,
+        chunk_cache_dir: str | None = None,
+        tokenizer_cache_dir: str | None = None,
+        page_extraction_workers: int = 1,
+) -> LocalDocumentChunks:
+    # Runs in a worker process; the file is hashed in blocks and opened by path, so it is never loaded as a whole.
+    start_time = utils.epoch()
+    file_hash = dataprocessing.compute_file_hash(file_name)
+    chunk_kwargs = {
+        'document_data': file_name,
+        'chunk_size': chunk_size,
+        'chunk_overlap': chunk_overlap,
+        'normalizer': normalizer,
+        'tokenizer_cache_dir': tokenizer_cache_dir,
+        'page_extraction_workers': page_extraction_workers,
+    }
+
+    if chunk_cache_dir is not None:
+        chunks = list(cache.extract_cached_document_sentence_chunks(
+            cache=cache.LocalChunkCache(chunk_cache_dir),
+            file_hash=file_hash,
+            **chunk_kwargs,
+        ))
+    else:
+        chunks = list(dataprocessing.extract_document_sentence_chunks(**chunk_kwargs))
+
+    return LocalDocumentChunks(
+        file_name=file_name,
+        file_hash=file_hash,
+        file_size=os.path.getsize(file_name),
+        file_timestamp=os.path.getmtime(file_name),
+        chunk_key=cache.chunk_cache_key(file_hash, chunk_size, chunk_overlap, normalizer.version),
+        page_count=dataprocessing.count_document_pages(file_name),
+        chunks=chunks,
+        chunk_time=utils.epoch() - start_time,
+    )
+
+
+class LocalDocumentVectorStore:
+    # SQLite counterpart of the documents and document_vectors tables of the Spark runtime.
+    def __init__(self, file_name: str):
+        self.file_name = file_name
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(file_name, check_same_thread=False)
+        self._connection.executescript(r'''
+            CREATE TABLE IF NOT EXISTS documents (
+                file_name           TEXT PRIMARY KEY,
+                file_hash           TEXT,
+                file_size           INTEGER,
+                file_timestamp      REAL,
+                chunk_key           TEXT,
+                page_count          INTEGER
+            );
+
+            CREATE TABLE IF NOT EXISTS document_vectors (
+                id                  TEXT PRIMARY KEY,
+                file_name           TEXT,
+                file_hash           TEXT,
+                start_page_no       INTEGER,
+                end_page_no         INTEGER,
+                content             TEXT,
+                embeddings          BLOB
+            );
+
+            CREATE INDEX IF NOT EXISTS documents_file_hash ON documents (file_hash);
+            CREATE INDEX IF NOT EXISTS document_vectors_file_hash ON document_vectors (file_hash);
+        ''')
+
+    def is_up_to_date(self, file_name: str, chunk_size: int, chunk_overlap: int, normalizer_version: str) -> bool:
+        # Files whose size and modification time are unchanged are not hashed again.
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT file_hash, file_size, file_timestamp, chunk_key FROM documents WHERE file_name = ?',
+                (file_name,),
+            ).fetchone()
+
+        if row is None:
+            return False
+
+        file_hash, file_size, file_timestamp, chunk_key = row
+
+        return (file_size == os.path.getsize(file_name)
+                and file_timestamp == os.path.getmtime(file_name)
+                and chunk_key == cache.chunk_cache_key(file_hash, chunk_size, chunk_overlap, normalizer_version))
+
+    def _remove_stale_vectors(self) -> None:
+        # Vectors are shared by all copies of a file (same hash), so they are only removed once no document refers to
+        # their hash anymore; vectors of a removed or revised copy are reassigned to a remaining copy.
+        self._connection.execute('DELETE FROM document_vectors WHERE file_hash NOT IN (SELECT file_hash FROM documents)')
+        self._connection.execute(r'''
+            UPDATE document_vectors
+            SET file_name = (SELECT MIN(d.file_name) FROM documents d WHERE d.file_hash = document_vectors.file_hash)
+            WHERE file_name NOT IN (SELECT d.file_name FROM documents d WHERE d.file_hash = document_vectors.file_hash)
+        ''')
+
+    def put_document(self, document: LocalDocumentChunks, embeddings: np.ndarray) -> int:
+        # Vectors are upserted by their deterministic chunk ID and vectors of the previous revision of the file are
+        # removed in the same transaction, so that the store never contains a mix of both revisions.
+        with self._lock, self._connection:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO documents (file_name, file_hash, file_size, file_timestamp, chunk_key, page_count) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (document.file_name, document.file_hash, document.file_size, document.file_timestamp,
+                 document.chunk_key, document.page_count),
+            )
+
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO document_vectors '
+                '(id, file_name, file_hash, start_page_no, end_page_no, content, embeddings) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [
+                    (cache.chunk_id(document.chunk_key, chunk_no), document.file_name, document.file_hash,
+                     chunk.start_page_no, chunk.end_page_no, chunk.text,
+                     np.asarray(chunk_embeddings, dtype=np.float32).tobytes())
+                    for chunk_no, (chunk, chunk_embeddings) in enumerate(zip(document.chunks, embeddings))
+                ],
+            )
+
+            self._remove_stale_vectors()
+
+        return len(document.chunks)
+
+    def remove_missing_documents(self, file_names: list[str]) -> int:
+        with self._lock, self._connection:
+            existing_file_names = {r[0] for r in self._connection.execute('SELECT file_name FROM documents')}
+            missing_file_names = [(f,) for f in existing_file_names - set(file_names)]
+
+            self._connection.executemany('DELETE FROM documents WHERE file_name = ?', missing_file_names)
+            self._remove_stale_vectors()
+
+        return len(missing_file_names)
+
+    def vectors(self, batch_size: int = 1000) -> Iterator[LocalDocumentVector]:
+        with self._lock:
+            cursor = self._connection.execute(
+                'SELECT id, file_name, file_hash, start_page_no, end_page_no, content, embeddings '
+                'FROM document_vectors ORDER BY id'
+            )
+
+        while True:
+            with self._lock:
+                rows = cursor.fetchmany(batch_size)
+
+            if not rows:
+                break
+
+            for *values, embeddings in rows:
+                yield LocalDocumentVector(*values, np.frombuffer(embeddings, dtype=np.float32))
+
+
+class LocalSeaRuntime:
+    def __init__(
+            self,
+            config: SeaConfig,
+            embedding_backend: embedding.EmbeddingBackend,
+            vector_store: LocalDocumentVectorStore,
+            max_workers: int | None = None,
+    ):
+        self.config = config
+        self.embedding_backend = embedding_backend
+        self.vector_store = vector_store
+        self.max_workers = max_workers
+
+    def text_normalizer(self) -> dataprocessing.TextNormalizer:
+        return dataprocessing.TextNormalizer.from_rule_packs(self.config.normalization_rule_packs)
+
+    def chunk_documents(
+            self,
+            executor: Executor,
+            file_names: list[str],
+            normalizer: dataprocessing.TextNormalizer,
+    ) -> Iterator[LocalDocumentChunks]:
+        # Yields documents in the order they complete. Only a few documents per worker are in flight at any time and
+        # every future is released once its document has been yielded, so memory does not grow with the corpus.
+        max_pending = (self.max_workers or os.cpu_count() or 1) * 2
+        remaining_file_names = iter(file_names)
+        pending = set()
+
+        while True:
+            for file_name in itertools.islice(remaining_file_names, max_pending - len(pending)):
+                pending.add(executor.submit(
+                    chunk_local_document,
+                    file_name=file_name,
+                    chunk_size=self.config.chunk_size,
+                    chunk_overlap=self.config.chunk_overlap,
+                    normalizer=normalizer,
+                    chunk_cache_dir=self.config.chunk_cache_dir,
+                    tokenizer_cache_dir=self.config.tokenizer_cache_dir,
+                    page_extraction_workers=self.config.page_extraction_workers,
+                ))
+
+            if not pending:
+                return
+
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                yield future.result()
+
+    def compute_document_vectors(self, document_dir: str) -> metrics.PipelineRun:
+        run = metrics.PipelineRun('local_document_vectors')
+        normalizer = self.text_normalizer()
+        embedding_cache = None
+
+        if self.config.embedding_cache_file is not None:
+            embedding_cache = embedding.LocalEmbeddingCache(self.config.embedding_cache_file)
+
+        with run.measure('ingest') as ingest_stage:
+            file_names = sorted(glob(os.path.join(document_dir, '**/*.pdf'), recursive=True))
+            removed_count = self.vector_store.remove_missing_documents(file_names)
+
+            pending_file_names = [
+                f
+                for f in file_names
+                if not self.vector_store.is_up_to_date(f, self.config.chunk_size, self.config.chunk_overlap, normalizer.version)
+            ]
+
+            ingest_stage.documents = ingest_stage.rows = len(pending_file_names)
+
+        print(f'{len(pending_file_names)} of {len(file_names)} documents need to be processed, '
+              f'{removed_count} removed documents')
+
+        start_time = utils.epoch()
+        chunk_stage = run.stage('chunk')
+
+        # Documents are chunked in worker processes while the main process embeds and stores completed documents,
+        # so the chunk stage overlaps with the embed and write stages.
+        with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+            for i, document in enumerate(self.chunk_documents(executor, pending_file_names, normalizer), 1):
+                chunk_stage.wall_time = utils.epoch() - start_time
+                chunk_stage.documents += 1
+                chunk_stage.pages += document.page_count
+                chunk_stage.bytes_read += document.file_size
+                chunk_stage.chunks += len(document.chunks)
+                chunk_stage.rows += len(document.chunks)
+
+                with run.measure('embed') as embed_stage:
+                    texts = [c.text for c in document.chunks]
+                    request_stats = embedding.EmbeddingRequestStats()
+
+                    if embedding_cache is not None:
+                        cache_stats = embedding.EmbeddingCacheStats()
+                        embeddings = embedding.compute_cached_embeddings(
+                            backend=self.embedding_backend,
+                            texts=texts,
+                            cache=embedding_cache,
+                            stats=cache_stats,
+                            request_stats=request_stats,
+                        )
+
+                        embed_stage.cache_hits += cache_stats.hits
+                        embed_stage.cache_misses += cache_stats.misses
+                    else:
+                        embeddings = embedding.compute_embeddings(
+                            backend=self.embedding_backend,
+                            texts=texts,
+                            request_stats=request_stats,
+                        )
+
+                    embed_stage.chunks += len(texts)
+                    embed_stage.rows += len(texts)
+                    embed_stage.embedding_requests += request_stats.requests
+                    embed_stage.embedding_retries += request_stats.retries
+
+                with run.measure('write') as write_stage:
+                    write_stage.rows += self.vector_store.put_document(document, embeddings)
+
+                print(f'Processed document {i}/{len(pending_file_names)} {document.file_name}: '
+                      f'{document.page_count} pages, {len(document.chunks)} chunks, '
+                      f'{document.page_count / max(document.chunk_time, 1e-9):.1f} pages/s '
+                      f'({chunk_stage.pages / max(utils.epoch() - start_time, 1e-9):.1f} pages/s cumulative)')
+
+        run.wall_time = (utils.epoch() - start_time) + ingest_stage.wall_time
+        print(run)
+        print(f'{chunk_stage.pages} pages in {run.wall_time:.1f}s, {chunk_stage.pages / max(run.wall_time, 1e-9):.1f} pages/s')
+
+        return run
@@ -0,0 +1,138 @@
+# #
+# # SEA / SMART ENGINEERING ASSISTANT
+# # Copyright (c) 2024 SilentByte <https://silentbyte.com/>
+# #
+
+
+import uuid
+
+from contextlib import contextmanager
+from dataclasses import dataclass, field, fields
+from datetime import datetime, timezone
+from typing import Iterator
+
+from sea import utils
+from sea.embedding import EmbeddingCacheStats
+
+PIPELINE_STAGES = ['ingest', 'chunk', 'embed', 'write', 'index_sync']
+
+PIPELINE_RUN_SCHEMA = (
+    'run_id STRING, '
+    'pipeline STRING, '
+    'started_on TIMESTAMP, '
+    'run_wall_time DOUBLE, '
+    'stage STRING, '
+    'wall_time DOUBLE, '
+    'documents BIGINT, '
+    'pages BIGINT, '
+    'chunks BIGINT, '
+    'bytes_read BIGINT, '
+    'embedding_requests BIGINT, '
+    'embedding_retries BIGINT, '
+    'cache_hits BIGINT, '
+    'cache_misses BIGINT, '
+    'rows BIGINT, '
+    'rows_per_second DOUBLE'
+)
+
+
+@dataclass
+class StageMetrics:
+    stage: str
+    wall_time: float = 0.0
+    documents: int = 0
+    pages: int = 0
+    chunks: int = 0
+    bytes_read: int = 0
+    embedding_requests: int = 0
+    embedding_retries: int = 0
+    cache_hits: int = 0
+    cache_misses: int = 0
+    rows: int = 0
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.wall_time if self.wall_time > 0 else 0.0
+
+    @property
+    def pages_per_second(self) -> float:
+        return self.pages / self.wall_time if self.wall_time > 0 else 0.0
+
+    def add(self, other: 'StageMetrics') -> None:
+        for f in fields(self):
+            if f.name != 'stage':
+                setattr(self, f.name, getattr(self, f.name) + getattr(other, f.name))
+
+    def to_dict(self) -> dict:
+        return {
+            'stage': self.stage,
+            'wall_time': self.wall_time,
+            'documents': self.documents,
+            'pages': self.pages,
+            'chunks': self.chunks,
+            'bytes_read': self.bytes_read,
+            'embedding_requests': self.embedding_requests,
+            'embedding_retries': self.embedding_retries,
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+            'rows': self.rows,
+            'rows_per_second': self.rows_per_second,
+            'pages_per_second': self.pages_per_second,
+        }
+
+    def __str__(self) -> str:
+        return (f'{self.stage}: {self.wall_time:.1f}s, {self.documents} documents, {self.pages} pages, '
+                f'{self.chunks} chunks, {self.bytes_read} bytes, {self.embedding_requests} requests '
+                f'({self.embedding_retries} retries), {self.rows} rows ({self.rows_per_second:.1f} rows/s)')
+
+
+@dataclass
+class PipelineRun:
+    pipeline: str
+    run_id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    started_on: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
+    wall_time: float = 0.0
+    stages: dict[str, StageMetrics] = field(default_factory=dict)
+
+    def stage(self, name: str) -> StageMetrics:
+        if name not in self.stages:
+            self.stages[name] = StageMetrics(name)
+
+        return self.stages[name]
+
+    @contextmanager
+    def measure(self, name: str) -> Iterator[StageMetrics]:
+        # Spark evaluates lazily, so a measured block must contain the action that actually executes the stage.
+        stage = self.stage(name)
+        start_time = utils.epoch()
+
+        try:
+            yield stage
+        finally:
+            stage.wall_time += utils.epoch() - start_time
+
+    @property
+    def embedding_cache_stats(self) -> EmbeddingCacheStats:
+        stage = self.stage('embed')
+        return EmbeddingCacheStats(hits=stage.cache_hits, misses=stage.cache_misses)
+
+    def ordered_stages(self) -> list[StageMetrics]:
+        def stage_order(name: str) -> int:
+            return PIPELINE_STAGES.index(name) if name in PIPELINE_STAGES else len(PIPELINE_STAGES)
+
+        return [self.stages[name] for name in sorted(self.stages, key=stage_order)]
+
+    def to_dict(self) -> dict:
+        return {
+            'pipeline': self.pipeline,
+            'run_id': self.run_id,
+            'started_on': self.started_on.isoformat(),
+            'wall_time': self.wall_time,
+            'stages': [s.to_dict() for s in self.ordered_stages()],
+        }
+
+    def __str__(self) -> str:
+        return '\n'.join([
+            f'Pipeline run {self.pipeline} ({self.run_id}): {self.wall_time:.1f}s',
+            *[f'  {s}' for s in self.ordered_stages()],
+        ])
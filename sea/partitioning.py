@@ -0,0 +1,118 @@
+# #
+# # SEA / SMART ENGINEERING ASSISTANT
+# # Copyright (c) 2024 SilentByte <https://silentbyte.com/>
+# #
+
+
+import heapq
+
+from dataclasses import dataclass
+
+# Rough number of bytes that cost about as much to process as a single page.
+BYTES_PER_PAGE_EQUIVALENT = 100_000
+
+
+@dataclass
+class WorkUnit:
+    key: str
+    start_page_no: int
+    end_page_no: int | None
+    page_count: int
+    byte_count: int
+
+    @property
+    def cost(self) -> float:
+        return self.page_count + self.byte_count / BYTES_PER_PAGE_EQUIVALENT
+
+
+def estimate_page_count(file_size: int, page_count: int | None) -> int:
+    if page_count is not None and page_count > 0:
+        return page_count
+
+    return max(1, file_size // BYTES_PER_PAGE_EQUIVALENT)
+
+
+def split_work_units(key: str, file_size: int, page_count: int | None, max_pages_per_unit: int | None) -> list[WorkUnit]:
+    page_count = estimate_page_count(file_size, page_count)
+
+    # The last unit of a document is open-ended in case the page count was only estimated.
+    if max_pages_per_unit is None or page_count <= max_pages_per_unit:
+        return [WorkUnit(key, 0, None, page_count, file_size)]
+
+    units = []
+    for start_page_no in range(0, page_count, max_pages_per_unit):
+        unit_page_count = min(max_pages_per_unit, page_count - start_page_no)
+        end_page_no = start_page_no + unit_page_count
+
+        units.append(WorkUnit(
+            key=key,
+            start_page_no=start_page_no,
+            end_page_no=end_page_no if end_page_no < page_count else None,
+            page_count=unit_page_count,
+            byte_count=file_size * unit_page_count // page_count,
+        ))
+
+    return units
+
+
+@dataclass
+class PartitionSkewMetrics:
+    unit_counts: list[int]
+    page_counts: list[int]
+    byte_counts: list[int]
+
+    @property
+    def partition_count(self) -> int:
+        return len(self.page_counts)
+
+    @property
+    def page_skew(self) -> float:
+        # Ratio of the largest partition to the average partition; 1.0 means perfectly balanced.
+        mean = sum(self.page_counts) / max(1, self.partition_count)
+        return max(self.page_counts, default=0) / mean if mean else 1.0
+
+    @property
+    def byte_skew(self) -> float:
+        mean = sum(self.byte_counts) / max(1, self.partition_count)
+        return max(self.byte_counts, default=0) / mean if mean else 1.0
+
+    def to_dict(self) -> dict:
+        return {
+            'partition_count': self.partition_count,
+            'unit_counts': self.unit_counts,
+            'page_counts': self.page_counts,
+            'byte_counts': self.byte_counts,
+            'page_skew': self.page_skew,
+            'byte_skew': self.byte_skew,
+        }
+
+    def __str__(self) -> str:
+        return (f'{self.partition_count} partitions, '
+                f'pages min/max {min(self.page_counts, default=0)}/{max(self.page_counts, default=0)} '
+                f'(skew {self.page_skew:.2f}), '
+                f'bytes min/max {min(self.byte_counts, default=0)}/{max(self.byte_counts, default=0)} '
+                f'(skew {self.byte_skew:.2f})')
+
+
+def assign_partitions(units: list[WorkUnit], partition_count: int) -> tuple[list[int], PartitionSkewMetrics]:
+    # Longest-processing-time-first: the most expensive unit is always assigned to the least loaded partition.
+    partition_count = max(1, min(partition_count, len(units)))
+    partitions = [(0.0, partition_id) for partition_id in range(partition_count)]
+    assignments = [0] * len(units)
+
+    metrics = PartitionSkewMetrics(
+        unit_counts=[0] * partition_count,
+        page_counts=[0] * partition_count,
+        byte_counts=[0] * partition_count,
+    )
+
+    for index in sorted(range(len(units)), key=lambda i: units[i].cost, reverse=True):
+        cost, partition_id = heapq.heappop(partitions)
+        heapq.heappush(partitions, (cost + units[index].cost, partition_id))
+
+        assignments[index] = partition_id
+        metrics.unit_counts[partition_id] += 1
+        metrics.page_counts[partition_id] += units[index].page_count
+        metrics.byte_counts[partition_id] += units[index].byte_count
+
+    return assignments, metrics
@@ -0,0 +1,198 @@
+# #
+# # SEA / SMART ENGINEERING ASSISTANT
+# # Copyright (c) 2024 SilentByte <https://silentbyte.com/>
+# #
+
+
+import asyncio
+import threading
+
+from collections import OrderedDict
+from concurrent.futures import CancelledError, Executor, Future
+from typing import Any, Callable
+
+from langchain.callbacks.manager import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain.schema import BaseRetriever, Document
+from langchain.schema.embeddings import Embeddings
+
+from sea import utils
+from sea.vectorindex import MemoryMappedVectorIndex
+
+
+class MemoizedQueryEmbeddings(Embeddings):
+    # Remembers the embeddings of the most recent queries, so that looking up a question in the answer cache and
+    # retrieving documents for it only requires a single request to the embedding model. The speculative search
+    # embeds the question while the answer cache is looked up, so a query that is already being embedded waits for
+    # the pending request instead of sending another one.
+    def __init__(self, embeddings: Embeddings, max_entries: int = 256):
+        self.embeddings = embeddings
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, list[float]] = OrderedDict()
+        self._pending: dict[str, Future] = {}
+
+    def _get_or_claim(self, text: str) -> tuple[list[float] | None, Future | None, bool]:
+        # Returns the memoized embedding, or the future of the pending request and whether the caller must send it.
+        with self._lock:
+            if (embedding := self._entries.get(text)) is not None:
+                self._entries.move_to_end(text)
+                return embedding, None, False
+
+            if (future := self._pending.get(text)) is not None:
+                return None, future, False
+
+            future = self._pending[text] = Future()
+            return None, future, True
+
+    def _put(self, text: str, future: Future, embedding: list[float]) -> list[float]:
+        with self._lock:
+            del self._pending[text]
+
+            self._entries[text] = embedding
+            self._entries.move_to_end(text)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+        future.set_result(embedding)
+
+        return embedding
+
+    def _fail(self, text: str, future: Future, error: BaseException) -> None:
+        with self._lock:
+            del self._pending[text]
+
+        # If the request has been cancelled rather than failed, the waiting callers send their own.
+        if isinstance(error, Exception):
+            future.set_exception(error)
+        else:
+            future.cancel()
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        return await self.embeddings.aembed_documents(texts)
+
+    def embed_query(self, text: str) -> list[float]:
+        embedding, future, claimed = self._get_or_claim(text)
+
+        if embedding is not None:
+            return embedding
+
+        if not claimed:
+            try:
+                return future.result()
+            except CancelledError:
+                return self.embeddings.embed_query(text)
+
+        try:
+            embedding = self.embeddings.embed_query(text)
+        except BaseException as e:
+            self._fail(text, future, e)
+            raise e
+
+        return self._put(text, future, embedding)
+
+    async def aembed_query(self, text: str) -> list[float]:
+        embedding, future, claimed = self._get_or_claim(text)
+
+        if embedding is not None:
+            return embedding
+
+        if not claimed:
+            try:
+                # Shielded, so that cancelling this caller does not cancel the request of the caller that sent it.
+                return await asyncio.shield(asyncio.wrap_future(future))
+            except asyncio.CancelledError as e:
+                if not future.cancelled():
+                    raise e
+
+            return await self.embeddings.aembed_query(text)
+
+        try:
+            embedding = await self.embeddings.aembed_query(text)
+        except BaseException as e:
+            self._fail(text, future, e)
+            raise e
+
+        return self._put(text, future, embedding)
+
+
+class PgVectorRetriever(BaseRetriever):
+    # Returns the same documents as the Databricks Vector Search retriever, but from a pgvector table; the
+    # cursor factory is expected to return a DB-API cursor that can be used as a context manager. Async queries run
+    # on the given executor, which bounds the number of database connections used by concurrent requests.
+    embedding: Embeddings
+    cursor_factory: Callable[[], Any]
+    executor: Executor | None = None
+    table_name: str = 'document_vector'
+    k: int = 4
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> list[Document]:
+        return self._query(self.embedding.embed_query(query))
+
+    async def _aget_relevant_documents(
+            self,
+            query: str,
+            *,
+            run_manager: AsyncCallbackManagerForRetrieverRun,
+    ) -> list[Document]:
+        embedding = await self.embedding.aembed_query(query)
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self._query, embedding)
+
+    def _query(self, embedding: list[float]) -> list[Document]:
+        query_vector = utils.format_vector(embedding)
+
+        with self.cursor_factory() as cursor:
+            # <=> is the cosine distance, which is what the HNSW index is built for (vector_cosine_ops).
+            cursor.execute(
+                f'SELECT content, file_name, file_hash, start_page_no, end_page_no '
+                f'FROM {self.table_name} '
+                f'ORDER BY embeddings <=> %s::vector '
+                f'LIMIT %s',
+                [query_vector, self.k],
+            )
+
+            rows = cursor.fetchall()
+
+        return [
+            Document(
+                page_content=content,
+                metadata={
+                    'file_name': file_name,
+                    'file_hash': file_hash,
+                    'start_page_no': start_page_no,
+                    'end_page_no': end_page_no,
+                },
+            )
+            for content, file_name, file_hash, start_page_no, end_page_no in rows
+        ]
+
+
+class MemoryMappedRetriever(BaseRetriever):
+    # Searches the most recently published vector index snapshot within the process.
+    embedding: Embeddings
+    index: MemoryMappedVectorIndex
+    k: int = 4
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> list[Document]:
+        return [
+            Document(
+                page_content=hit.content,
+                metadata={
+                    'file_name': hit.file_name,
+                    'file_hash': hit.file_hash,
+                    'start_page_no': hit.start_page_no,
+                    'end_page_no': hit.end_page_no,
+                    'score': hit.score,
+                },
+            )
+            for hit in self.index.search(self.embedding.embed_query(query), self.k)
+        ]
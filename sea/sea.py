@@ -4,16 +4,27 @@
 # #
 
 
+import os
+
 from typing import Any
 from textwrap import dedent
+from datetime import datetime, timezone
 
 import pyspark.sql.functions as F
 
+from pyspark.sql import Window
+
 from databricks.vector_search.client import VectorSearchClient
 
 from sea.config import SeaConfig
-from sea.udf import extract_document_chunks, compute_embeddings
-from sea import utils
+from sea.udf import (
+    make_extract_document_records,
+    count_document_pages,
+    compute_document_file_metadata,
+    make_compute_embeddings,
+    DOCUMENT_RECORD_SCHEMA,
+)
+from sea import answercache, dataprocessing, embedding, metrics, partitioning, utils
 
 
 class SeaVectorSearchIndex:
@@ -86,6 +97,41 @@ class SeaVectorSearchIndex:
     def sync(self) -> None:
         self._index().sync()
 
+    def await_sync(
+            self,
+            source_version: int,
+            timeout: int | None = None,
+            report_progress: bool = True,
+    ) -> bool:
+        # sync() only triggers an update of a TRIGGERED index and returns immediately. The update is complete once
+        # the index has processed the given version of the source table and has no pending update.
+        start_time = utils.epoch()
+
+        while timeout is None or utils.epoch() < start_time + timeout:
+            description = self._index().describe()
+            status = utils.dict_item_from_path(description, 'status.detailed_state', 'UNKNOWN')
+            processed_version = utils.dict_item_from_path(
+                description,
+                'status.triggered_update_status.last_processed_commit_version',
+            )
+
+            if 'FAILED' in status:
+                raise ValueError(f'Vector Search Index {self.index_name} @ {self.endpoint_name} failed to sync: {status}')
+
+            if status == 'ONLINE_NO_PENDING_UPDATE' and processed_version is not None \
+                    and int(processed_version) >= source_version:
+                print(f'Vector Search Index {self.index_name} @ {self.endpoint_name} is synced '
+                      f'up to version {processed_version}')
+                return True
+
+            if report_progress:
+                print(f'Waiting for Vector Search Index {self.index_name} @ {self.endpoint_name} to sync version '
+                      f'{source_version}: {status}, processed version {processed_version}')
+
+            utils.sleep(10)
+
+        return False
+
 
 class SeaRuntime:
     def __init__(self, config: SeaConfig, spark, dbutils):
@@ -93,6 +139,32 @@ class SeaRuntime:
         self.spark = spark
         self.dbutils = dbutils
 
+    def invalidate_answer_cache(self) -> None:
+        # Answers cached by the server may be based on documents that have just been updated or removed.
+        if self.config.answer_cache_version_file is None:
+            return
+
+        version = answercache.write_index_version(utils.local_file_name(self.config.answer_cache_version_file))
+        print(f'Invalidated answer caches (vector index version {version})')
+
+    def table_version(self, table_name: str) -> int:
+        return self.spark_query(f'DESCRIBE HISTORY {table_name} LIMIT 1').first()['version']
+
+    def await_index_sync(self, index: SeaVectorSearchIndex, source_version: int) -> None:
+        # Answers cached while the index is being updated are based on the previous vectors, so the answer caches
+        # are only invalidated once the index serves the new ones.
+        if not index.await_sync(source_version, timeout=self.config.index_sync_timeout):
+            print(f'Vector Search Index {index.index_name} @ {index.endpoint_name} has not been synced after '
+                  f'{self.config.index_sync_timeout}s')
+
+        self.invalidate_answer_cache()
+
+    def sync_index(self, index: SeaVectorSearchIndex) -> None:
+        source_version = self.table_version('document_vectors')
+
+        index.sync()
+        self.await_index_sync(index, source_version)
+
     def spark_query(self, query: str, args: dict[str, Any] | list | None = None, **kwargs: Any) -> Any:
         query = dedent(query).strip()
         print(query)
@@ -125,15 +197,25 @@ class SeaRuntime:
                 file_name           STRING,
                 file_hash           STRING,
                 file_size           BIGINT,
+                page_count          INT,
                 file_timestamp      TIMESTAMP,
                 content             BINARY,
                 created_on          TIMESTAMP
             )
         ''')
 
+        # Documents are never deleted, as the document vector stream reads the table as an append-only source;
+        # documents whose files have been removed from the volume are recorded here instead.
+        self.spark_query(r'''
+            CREATE TABLE IF NOT EXISTS removed_documents (
+                file_name           STRING,
+                removed_on          TIMESTAMP
+            )
+        ''')
+
         self.spark_query(r'''
             CREATE TABLE IF NOT EXISTS document_vectors (
-                id                  BIGINT GENERATED BY DEFAULT AS IDENTITY,
+                id                  STRING,
                 file_name           STRING,
                 file_hash           STRING,
                 start_page_no       INT,
@@ -144,9 +226,110 @@ class SeaRuntime:
             ) TBLPROPERTIES (delta.enableChangeDataFeed = true)
         ''')
 
+        self.spark_query(r'''
+            CREATE TABLE IF NOT EXISTS document_chunks (
+                chunk_key           STRING,
+                file_hash           STRING,
+                chunk_size          INT,
+                chunk_overlap       INT,
+                normalizer_version  STRING,
+                chunk_no            INT,
+                content             STRING,
+                start_page_no       INT,
+                end_page_no         INT,
+                carried_from_file_hash STRING,
+                created_on          TIMESTAMP
+            )
+        ''')
+
+        self.spark_query(r'''
+            CREATE TABLE IF NOT EXISTS embedding_cache (
+                text_hash           STRING,
+                model_name          STRING,
+                embeddings          ARRAY<FLOAT>,
+                created_on          TIMESTAMP
+            )
+        ''')
+
+        self.spark_query(r'''
+            CREATE TABLE IF NOT EXISTS document_pages (
+                file_hash           STRING,
+                page_no             INT,
+                page_hash           STRING,
+                created_on          TIMESTAMP
+            )
+        ''')
+
+        self.spark_query(r'''
+            CREATE TABLE IF NOT EXISTS pipeline_runs (
+                run_id              STRING,
+                pipeline            STRING,
+                started_on          TIMESTAMP,
+                run_wall_time       DOUBLE,
+                stage               STRING,
+                wall_time           DOUBLE,
+                documents           BIGINT,
+                pages               BIGINT,
+                chunks              BIGINT,
+                bytes_read          BIGINT,
+                embedding_requests  BIGINT,
+                embedding_retries   BIGINT,
+                cache_hits          BIGINT,
+                cache_misses        BIGINT,
+                rows                BIGINT,
+                rows_per_second     DOUBLE,
+                created_on          TIMESTAMP
+            )
+        ''')
+
         # Ensure the properties are set correctly in case the table already existed.
         self.spark_query(r'ALTER TABLE document_vectors SET TBLPROPERTIES (delta.enableChangeDataFeed = true)')
 
+        # Columns added after the table was first created; rows ingested before have no value for them.
+        self.add_missing_columns('documents', {'page_count': 'INT'})
+
+        self.migrate_document_vector_ids()
+
+    def add_missing_columns(self, table_name: str, columns: dict[str, str]) -> None:
+        existing_columns = set(self.spark.table(table_name).columns)
+        missing_columns = [f'{name} {data_type}' for name, data_type in columns.items() if name not in existing_columns]
+
+        if missing_columns:
+            self.spark_query(f'ALTER TABLE {table_name} ADD COLUMNS ({", ".join(missing_columns)})')
+
+    def migrate_document_vector_ids(self) -> None:
+        # Document vectors used to have generated BIGINT IDs; they are now derived from the chunk (see
+        # chunk_id_column()). Tables created before are rewritten with the existing IDs as strings, which never collide
+        # with the hex digests of new IDs. The vector search index cannot change the type of its primary key, so it is
+        # dropped and created again by the next run of create_document_vectors_index().
+        id_type = dict(self.spark.table('document_vectors').dtypes)['id']
+
+        if id_type == 'string':
+            return
+
+        if id_type not in ('bigint', 'int'):
+            raise ValueError(f'Unsupported type {id_type} of document_vectors.id, expected STRING')
+
+        print(f'Migrating document_vectors.id from {id_type.upper()} to STRING')
+
+        index = SeaVectorSearchIndex(
+            endpoint_name=self.config.vector_search_endpoint,
+            index_name=self.config.document_vectors_index,
+        )
+
+        if index.query_exists():
+            index.drop()
+
+        (
+            self.spark.table('document_vectors')
+            .withColumn('id', F.col('id').cast('STRING'))
+            .write.mode('overwrite')
+            .option('overwriteSchema', 'true')
+            .saveAsTable('document_vectors')
+        )
+
+        self.spark_query(r'ALTER TABLE document_vectors SET TBLPROPERTIES (delta.enableChangeDataFeed = true)')
+
     def destroy_runtime(self) -> None:
         index = SeaVectorSearchIndex(
             endpoint_name=self.config.vector_search_endpoint,
@@ -157,72 +340,724 @@ class SeaRuntime:
             index.drop()
 
         self.spark_query(r'DROP TABLE IF EXISTS document_vectors')
+        self.spark_query(r'DROP TABLE IF EXISTS document_chunks')
+        self.spark_query(r'DROP TABLE IF EXISTS document_pages')
+        self.spark_query(r'DROP TABLE IF EXISTS embedding_cache')
         self.spark_query(r'DROP TABLE IF EXISTS documents')
+        self.spark_query(r'DROP TABLE IF EXISTS removed_documents')
+        self.spark_query(r'DROP TABLE IF EXISTS pipeline_runs')
 
         self.dbutils.fs.rm(self.config.checkpoints_dir("documents"), True)
         self.dbutils.fs.rm(self.config.checkpoints_dir("document_vectors"), True)
+        self.dbutils.fs.rm(self.config.checkpoints_dir("document_pipeline"), True)
+        self.dbutils.fs.rm(self.config.volume_dir('staging'), True)
 
-    def ingest_documents(self) -> None:
-        (
+    def read_documents_stream(self):
+        documents_df = (
             self.spark
             .readStream
             .format('cloudFiles')
             .option('cloudFiles.format', 'BINARYFILE')
             .option('pathGlobFilter', '*.pdf')
             .load(self.config.documents_dir())
+        )
 
-            .withColumn('file_hash', F.sha2('content', 256))
+        if self.config.store_document_content:
+            documents_df = (
+                documents_df
+                .withColumn('file_hash', F.sha2('content', 256))
+                .withColumn('page_count', count_document_pages('content'))
+            )
+        else:
+            # The content column is never referenced, so the binary file source does not read the files at all;
+            # hashing streams each file from the volume and chunking reads it again lazily.
+            documents_df = (
+                documents_df
+                .withColumn('file_metadata', compute_document_file_metadata('path'))
+                .withColumn('file_hash', F.col('file_metadata.file_hash'))
+                .withColumn('page_count', F.col('file_metadata.page_count'))
+                .withColumn('content', F.lit(None).cast('BINARY'))
+            )
+
+        return (
+            documents_df
             .withColumn('created_on', F.now())
             .selectExpr(
                 'path AS file_name',
                 'file_hash',
                 'length AS file_size',
+                'page_count',
                 'modificationTime AS file_timestamp',
                 'content',
                 'created_on',
             )
+        )
 
-            .writeStream
-            .trigger(availableNow=True)
-            .option('checkpointLocation', self.config.checkpoints_dir('documents'))
-            .table('documents')
-            .awaitTermination()
+    def ingest_documents(self) -> metrics.PipelineRun:
+        run = metrics.PipelineRun('ingest')
+
+        with run.measure('ingest') as stage:
+            # Every micro-batch is counted as it is written; the progress of the query only retains the most recent
+            # updates, which under-reports long runs.
+            def write_batch(documents_df, batch_id: int) -> None:
+                documents_df = documents_df.persist()
+
+                # The transaction options make the append idempotent if a micro-batch is retried.
+                (
+                    documents_df.write.mode('append')
+                    .option('txnAppId', 'sea_ingest_documents')
+                    .option('txnVersion', batch_id)
+                    .saveAsTable('documents')
+                )
+
+                ingested = documents_df.agg(
+                    F.count('*').alias('documents'),
+                    F.sum('file_size').alias('bytes_read'),
+                    F.sum('page_count').alias('pages'),
+                ).first()
+
+                documents_df.unpersist()
+
+                stage.documents += ingested['documents']
+                stage.rows += ingested['documents']
+                stage.bytes_read += ingested['bytes_read'] or 0
+                stage.pages += ingested['pages'] or 0
+
+            (
+                self.read_documents_stream()
+                .writeStream
+                .trigger(availableNow=True)
+                .option('checkpointLocation', self.config.checkpoints_dir('documents'))
+                .foreachBatch(write_batch)
+                .start()
+                .awaitTermination()
+            )
+
+        self.record_pipeline_run(run)
+        return run
+
+    def current_documents_df(self):
+        # Documents ingested before their file was removed from the volume are hidden; a file that has been uploaded
+        # again after its removal is a current document again.
+        removed_documents_df = self.spark.table('removed_documents').alias('r')
+
+        return (
+            self.spark.table('documents').alias('d')
+            .join(
+                removed_documents_df,
+                (F.col('d.file_name') == F.col('r.file_name')) & (F.col('d.created_on') <= F.col('r.removed_on')),
+                'left_anti',
+            )
+        )
+
+    def text_normalizer(self) -> dataprocessing.TextNormalizer:
+        return dataprocessing.TextNormalizer.from_rule_packs(self.config.normalization_rule_packs)
+
+    def chunk_cache_key_column(self, normalizer: dataprocessing.TextNormalizer, file_hash_column: str = 'file_hash'):
+        # Must be kept in sync with sea.cache.chunk_cache_key().
+        return F.sha2(F.concat_ws(
+            '|',
+            F.col(file_hash_column),
+            F.lit(str(self.config.chunk_size)),
+            F.lit(str(self.config.chunk_overlap)),
+            F.lit(normalizer.version),
+        ), 256)
+
+    def chunk_id_column(self):
+        # Must be kept in sync with sea.cache.chunk_id(). The chunk key already covers the file hash and the
+        # chunking parameters, so the same chunk always ends up with the same ID no matter how often it is processed.
+        return F.sha2(F.concat_ws('|', F.col('chunk_key'), F.col('chunk_no').cast('STRING')), 256)
+
+    def with_previous_revisions(self, documents_df, normalizer: dataprocessing.TextNormalizer):
+        # The previous revision of a document is the most recently ingested document with the same file name.
+        previous_revisions_df = (
+            documents_df.select('chunk_key', 'file_name', 'file_hash', 'created_on').alias('d')
+            .join(
+                self.current_documents_df().select('file_name', 'file_hash', 'created_on').alias('p'),
+                (F.col('p.file_name') == F.col('d.file_name'))
+                & (F.col('p.file_hash') != F.col('d.file_hash'))
+                & (F.col('p.created_on') <= F.col('d.created_on')),
+            )
+            .withColumn('revision_rank', F.row_number().over(
+                Window.partitionBy('d.chunk_key').orderBy(F.col('p.created_on').desc()),
+            ))
+            .filter('revision_rank = 1')
+            .select(F.col('d.chunk_key').alias('chunk_key'), F.col('p.file_hash').alias('previous_file_hash'))
+        )
+
+        previous_file_hashes_df = previous_revisions_df.select('previous_file_hash').distinct()
+
+        previous_page_hashes_df = (
+            self.spark.table('document_pages')
+            .withColumnRenamed('file_hash', 'previous_file_hash')
+            .join(previous_file_hashes_df, 'previous_file_hash', 'left_semi')
+            .groupBy('previous_file_hash')
+            .agg(F.array_sort(F.collect_list(F.struct('page_no', 'page_hash'))).alias('previous_page_hashes'))
+        )
+
+        previous_chunks_df = (
+            previous_file_hashes_df
+            .withColumn('previous_chunk_key', self.chunk_cache_key_column(normalizer, 'previous_file_hash'))
+            .join(self.spark.table('document_chunks').withColumnRenamed('chunk_key', 'previous_chunk_key'), 'previous_chunk_key')
+            .groupBy('previous_file_hash')
+            .agg(F.array_sort(F.collect_list(F.struct('chunk_no', 'start_page_no', 'end_page_no'))).alias('previous_chunks'))
+        )
+
+        return (
+            documents_df
+            .join(previous_revisions_df, 'chunk_key', 'left')
+            .join(previous_page_hashes_df, 'previous_file_hash', 'left')
+            .join(previous_chunks_df, 'previous_file_hash', 'left')
+        )
+
+    def embedding_cache_key_column(self):
+        # Must be kept in sync with sea.embedding.embedding_cache_key().
+        return F.sha2(F.concat_ws(
+            '|',
+            F.lit(embedding.DEFAULT_EMBEDDING_ENDPOINT),
+            F.trim(F.regexp_replace('content', r'\s+', ' ')),
+        ), 256)
+
+    def cached_embeddings_df(self, text_hashes_df):
+        # Only the given texts are looked up, so that the cost does not grow with the size of the cache. Texts are
+        # merged into the cache, but caches written by earlier versions may still contain duplicates.
+        return (
+            self.spark.table('embedding_cache')
+            .filter(F.col('model_name') == embedding.DEFAULT_EMBEDDING_ENDPOINT)
+            .join(text_hashes_df, 'text_hash', 'left_semi')
+            .dropDuplicates(['text_hash'])
+            .select('text_hash', 'embeddings')
+        )
+
+    def document_partition_count(self) -> int:
+        return self.config.document_partition_count or self.spark.sparkContext.defaultParallelism
+
+    def plan_work_units(self, documents_df):
+        # Large documents are split into page ranges, which are then distributed across partitions so that every
+        # partition receives about the same amount of work. Each page range of a revised document is diffed against
+        # the previous revision on its own.
+        documents = documents_df.select('chunk_key', 'file_size', 'page_count').collect()
+
+        units = [
+            unit
+            for d in documents
+            for unit in partitioning.split_work_units(
+                key=d['chunk_key'],
+                file_size=d['file_size'] or 0,
+                page_count=d['page_count'],
+                max_pages_per_unit=self.config.max_pages_per_work_unit,
+            )
+        ]
+
+        partition_ids, metrics = partitioning.assign_partitions(units, self.document_partition_count())
+        split_keys = {u.key for u in units if u.start_page_no > 0}
+
+        units_df = self.spark.createDataFrame(
+            [
+                (u.key, u.start_page_no, u.end_page_no, partition_id, u.key in split_keys)
+                for u, partition_id in zip(units, partition_ids)
+            ],
+            'chunk_key STRING, unit_start_page_no INT, unit_end_page_no INT, partition_id INT, split BOOLEAN',
+        )
+
+        return units_df, metrics
+
+    def stage_document_content(self, documents_df, staging_dir: str) -> None:
+        def write_documents(documents) -> None:
+            local_staging_dir = utils.local_file_name(staging_dir)
+            os.makedirs(local_staging_dir, exist_ok=True)
+
+            for document in documents:
+                with open(os.path.join(local_staging_dir, f'{document.file_hash}.pdf'), 'wb') as fp:
+                    fp.write(document.content)
+
+        (
+            documents_df
+            .filter(F.col('content').isNotNull())
+            .select('file_hash', 'content')
+            .foreachPartition(write_documents)
+        )
+
+    def document_vectors_batch_processor(self, run: metrics.PipelineRun):
+        normalizer = self.text_normalizer()
+        extract_document_records = make_extract_document_records(
+            chunk_size=self.config.chunk_size,
+            chunk_overlap=self.config.chunk_overlap,
+            normalizer=normalizer,
+            tokenizer_cache_dir=self.config.tokenizer_cache_dir,
         )
 
-    def compute_document_vectors(self) -> None:
+        # Requests and retries happen inside the UDF on the executors and are collected via accumulators.
+        embedding_request_accumulator = self.spark.sparkContext.accumulator(0)
+        embedding_retry_accumulator = self.spark.sparkContext.accumulator(0)
+        compute_embeddings = make_compute_embeddings(embedding_request_accumulator, embedding_retry_accumulator)
+
+        def process_batch(documents_df, batch_id: int) -> None:
+            chunk_stage = run.stage('chunk')
+            embed_stage = run.stage('embed')
+            write_stage = run.stage('write')
+
+            start_time = utils.epoch()
+            documents_df = documents_df.withColumn('chunk_key', self.chunk_cache_key_column(normalizer))
+
+            # Only documents whose content has not been chunked with the same parameters before are parsed;
+            # duplicates within the batch (e.g. renamed copies) are only parsed once. If a previous revision of
+            # a document exists, only pages that changed are re-chunked and all other chunks are carried over.
+            new_documents_df = self.with_previous_revisions(
+                documents_df
+                .join(self.spark.table('document_chunks').select('chunk_key'), 'chunk_key', 'left_anti')
+                .dropDuplicates(['chunk_key']),
+                normalizer,
+            )
+
+            units_df, partition_metrics = self.plan_work_units(new_documents_df)
+            print(f'Batch {batch_id} partitions: {partition_metrics}')
+
+            # The stored content of documents that have been split into multiple units is written to the volume once,
+            # from where every unit reads it lazily by reference, instead of being copied into every unit.
+            staging_dir = self.config.volume_dir(f'staging/document_vectors/{run.run_id}-{batch_id}')
+            self.stage_document_content(
+                new_documents_df.join(units_df.filter('split').select('chunk_key').distinct(), 'chunk_key', 'left_semi'),
+                staging_dir,
+            )
+
+            units_df = (
+                new_documents_df
+                .join(F.broadcast(units_df), 'chunk_key')
+                .withColumn('file_name', F.when(
+                    F.col('split') & F.col('content').isNotNull(),
+                    F.concat(F.lit(f'{staging_dir}/'), F.col('file_hash'), F.lit('.pdf')),
+                ).otherwise(F.col('file_name')))
+                .withColumn('content', F.when(F.col('split'), F.lit(None).cast('BINARY')).otherwise(F.col('content')))
+                .select('chunk_key', 'file_name', 'file_hash', 'previous_file_hash', 'content', 'previous_page_hashes',
+                        'previous_chunks', 'unit_start_page_no', 'unit_end_page_no', 'partition_id')
+            )
+
+            # The partition ID is used as the partition index as is, so that every planned partition ends up in a
+            # Spark partition of its own; a range or hash partitioner may place several of them into the same one.
+            records_df = (
+                self.spark.createDataFrame(
+                    units_df.rdd
+                    .keyBy(lambda unit: unit['partition_id'])
+                    .partitionBy(partition_metrics.partition_count, lambda partition_id: partition_id)
+                    .values(),
+                    units_df.schema,
+                )
+                .drop('partition_id')
+                .mapInPandas(extract_document_records, DOCUMENT_RECORD_SCHEMA)
+                .persist()
+            )
+
+            record_counts = {r['record_type']: r['count'] for r in records_df.groupBy('record_type').count().collect()}
+
+            chunk_stage.wall_time += utils.epoch() - start_time
+            chunk_stage.documents += units_df.select('chunk_key').distinct().count()
+            chunk_stage.pages += sum(partition_metrics.page_counts)
+            chunk_stage.bytes_read += sum(partition_metrics.byte_counts)
+            chunk_stage.chunks += record_counts.get('chunk', 0)
+            chunk_stage.rows += sum(record_counts.values())
+
+            start_time = utils.epoch()
+
+            (
+                records_df
+                .filter(F.col('record_type') == 'page')
+                .withColumn('created_on', F.now())
+                .selectExpr('file_hash', 'page_no', 'page_hash', 'created_on')
+                .write.mode('append')
+                .saveAsTable('document_pages')
+            )
+
+            carried_chunks_df = (
+                self.spark.table('document_chunks')
+                .selectExpr('chunk_key AS carried_chunk_key', 'chunk_no AS carried_chunk_no', 'content AS carried_content')
+            )
+
+            (
+                records_df
+                .filter(F.col('record_type') == 'chunk')
+                .withColumn('carried_chunk_key', F.when(
+                    F.col('carried_from_file_hash').isNotNull(),
+                    self.chunk_cache_key_column(normalizer, 'carried_from_file_hash'),
+                ))
+                .join(carried_chunks_df, ['carried_chunk_key', 'carried_chunk_no'], 'left')
+                .withColumn('content', F.coalesce('content', 'carried_content'))
+                .withColumn('chunk_no', F.row_number().over(
+                    Window.partitionBy('chunk_key').orderBy('unit_start_page_no', 'chunk_no'),
+                ) - 1)
+                .withColumn('chunk_size', F.lit(self.config.chunk_size))
+                .withColumn('chunk_overlap', F.lit(self.config.chunk_overlap))
+                .withColumn('normalizer_version', F.lit(normalizer.version))
+                .withColumn('created_on', F.now())
+                .selectExpr('chunk_key', 'file_hash', 'chunk_size', 'chunk_overlap', 'normalizer_version', 'chunk_no',
+                            'content', 'start_page_no', 'end_page_no', 'carried_from_file_hash', 'created_on')
+                .write.mode('append')
+                .saveAsTable('document_chunks')
+            )
+
+            records_df.unpersist()
+            self.dbutils.fs.rm(staging_dir, True)
+
+            write_stage.wall_time += utils.epoch() - start_time
+            write_stage.rows += sum(record_counts.values())
+
+            start_time = utils.epoch()
+
+            chunks_df = (
+                documents_df
+                .select('file_name', 'chunk_key')
+                .join(self.spark.table('document_chunks'), 'chunk_key')
+            )
+
+            # Embeddings of chunks carried over from a previous revision are reused.
+            carried_embeddings_df = (
+                self.spark.table('document_vectors')
+                .selectExpr('file_hash AS carried_from_file_hash', 'content', 'embeddings')
+                .join(chunks_df.select('carried_from_file_hash').distinct(), 'carried_from_file_hash', 'left_semi')
+                .dropDuplicates(['carried_from_file_hash', 'content'])
+            )
+
+            chunks_df = (
+                chunks_df
+                .join(carried_embeddings_df, ['carried_from_file_hash', 'content'], 'left')
+                .withColumn('text_hash', self.embedding_cache_key_column())
+            )
+
+            # All other chunks are looked up in the embedding cache; only texts that are missing from the cache are
+            # sent to the endpoint (once per distinct text) and then added to the cache.
+            pending_df = chunks_df.filter(F.col('embeddings').isNull()).drop('embeddings')
+            pending_hashes_df = pending_df.select('text_hash').distinct().persist()
+
+            missing_df = (
+                pending_df
+                .join(self.cached_embeddings_df(pending_hashes_df), 'text_hash', 'left_anti')
+                .dropDuplicates(['text_hash'])
+                .select('text_hash', 'content')
+                .persist()
+            )
+
+            misses = missing_df.count()
+            embed_stage.cache_misses += misses
+            embed_stage.cache_hits += pending_hashes_df.count() - misses
+
+            # The embeddings are materialized before the merge, which may evaluate its source more than once.
+            computed_embeddings_df = (
+                missing_df
+                .repartition(self.document_partition_count())
+                .withColumn('model_name', F.lit(embedding.DEFAULT_EMBEDDING_ENDPOINT))
+                .withColumn('embeddings', compute_embeddings('content'))
+                .withColumn('created_on', F.now())
+                .selectExpr('text_hash', 'model_name', 'embeddings', 'created_on')
+                .persist()
+            )
+
+            computed_embeddings_df.count()
+
+            # Merging keeps text_hash unique per model, e.g. if a concurrent run has embedded the same text.
+            computed_embeddings_df.createOrReplaceTempView('embedding_cache_updates')
+            self.spark_query(r'''
+                MERGE INTO embedding_cache AS c
+                USING embedding_cache_updates AS u
+                ON c.text_hash = u.text_hash AND c.model_name = u.model_name
+                WHEN NOT MATCHED THEN INSERT *
+            ''')
+
+            computed_embeddings_df.unpersist()
+            missing_df.unpersist()
+
+            embed_stage.wall_time += utils.epoch() - start_time
+            embed_stage.chunks += misses
+            embed_stage.rows += misses
+            embed_stage.embedding_requests = embedding_request_accumulator.value
+            embed_stage.embedding_retries = embedding_retry_accumulator.value
+
+            start_time = utils.epoch()
+
+            vectors_df = (
+                chunks_df
+                .filter(F.col('embeddings').isNotNull())
+                .drop('text_hash')
+                .unionByName(
+                    pending_df
+                    .join(self.cached_embeddings_df(pending_hashes_df), 'text_hash')
+                    .drop('text_hash'),
+                )
+                .withColumn('id', self.chunk_id_column())
+                .dropDuplicates(['id'])
+                .withColumn('created_on', F.now())
+                .selectExpr('id', 'file_name', 'file_hash', 'start_page_no', 'end_page_no', 'content', 'embeddings',
+                            'created_on')
+            )
+
+            # Chunks that are already stored are left untouched unless the file has been renamed, so that
+            # reprocessing a document neither duplicates its vectors nor causes needless changes in the index.
+            vectors_df.createOrReplaceTempView('document_vector_updates')
+            merge_result = self.spark_query(r'''
+                MERGE INTO document_vectors AS v
+                USING document_vector_updates AS u
+                ON v.id = u.id
+                WHEN MATCHED AND v.file_name != u.file_name THEN UPDATE SET
+                    v.file_name = u.file_name,
+                    v.created_on = u.created_on
+                WHEN NOT MATCHED THEN INSERT *
+            ''').first()
+
+            pending_hashes_df.unpersist()
+
+            write_stage.wall_time += utils.epoch() - start_time
+            write_stage.rows += merge_result['num_affected_rows'] if merge_result is not None else 0
+
+        return process_batch
+
+    def compute_document_vectors(self) -> metrics.PipelineRun:
+        run = metrics.PipelineRun('document_vectors')
+
+        # documents is append-only (removals are recorded in removed_documents), but earlier versions deleted the rows
+        # of removed files. Those commits do not contain any new documents, so the stream can safely skip them instead
+        # of failing on them.
         (
             self.spark
             .readStream
+            .option('skipChangeCommits', 'true')
             .table('documents')
-            .withColumn('processed', F.explode(extract_document_chunks('content')))
-            .withColumn('content', F.col('processed.text'))
-            .withColumn('start_page_no', F.col('processed.start_page_no'))
-            .withColumn('end_page_no', F.col('processed.end_page_no'))
-            .withColumn('embeddings', compute_embeddings('content'))
-            .withColumn('created_on', F.now())
-            .selectExpr('file_name', 'file_hash', 'start_page_no', 'end_page_no', 'content', 'embeddings', 'created_on')
             .writeStream.trigger(availableNow=True)
             .option('checkpointLocation', self.config.checkpoints_dir('document_vectors'))
-            .table('document_vectors')
+            .foreachBatch(self.document_vectors_batch_processor(run))
+            .start()
             .awaitTermination()
         )
 
-    def create_document_vectors_index(self) -> None:
+        self.record_pipeline_run(run)
+        return run
+
+    def create_document_vectors_index(self) -> metrics.PipelineRun:
+        run = metrics.PipelineRun('document_vectors_index')
         index = SeaVectorSearchIndex(
             endpoint_name=self.config.vector_search_endpoint,
             index_name=self.config.document_vectors_index,
         )
 
-        if index.query_exists():
-            index.await_deployment()
-            index.sync()
+        with run.measure('index_sync'):
+            if index.query_exists():
+                index.await_deployment()
+                self.sync_index(index)
+            else:
+                source_version = self.table_version('document_vectors')
+
+                index.create(
+                    source_table_name=f'{self.config.catalog}.{self.config.schema}.document_vectors',
+                    pipeline_type='TRIGGERED',
+                    primary_key='id',
+                    embedding_vector_column='embeddings',
+                    embedding_dimension=1024,
+                )
+
+                index.await_deployment()
+                self.await_index_sync(index, source_version)
+
+        self.record_pipeline_run(run)
+        return run
+
+    def run_document_pipeline(self, processing_time: str | None = None) -> list[metrics.PipelineRun]:
+        # Ingests, chunks and embeds documents in a single streaming query and syncs the index after each
+        # micro-batch. Without a processing time (e.g. '5 minutes'), all available documents are processed once;
+        # otherwise the query keeps running and picks up new uploads on every trigger. Since a continuous query
+        # never finishes, every micro-batch is recorded as a pipeline run of its own.
+        runs = []
+
+        self.create_document_vectors_index()
+        index = SeaVectorSearchIndex(
+            endpoint_name=self.config.vector_search_endpoint,
+            index_name=self.config.document_vectors_index,
+        )
+
+        def process_batch(documents_df, batch_id: int) -> None:
+            run = metrics.PipelineRun('document_pipeline')
+
+            with run.measure('ingest') as ingest_stage:
+                # The batch is persisted so that the files are only read once for both writes.
+                documents_df = documents_df.persist()
+
+                # Documents are still recorded, as later revisions of a document are diffed against them.
+                documents_df.write.mode('append').saveAsTable('documents')
+
+                ingested = documents_df.agg(
+                    F.count('*').alias('documents'),
+                    F.sum('file_size').alias('bytes_read'),
+                    F.sum('page_count').alias('pages'),
+                ).first()
+
+                ingest_stage.documents = ingest_stage.rows = ingested['documents']
+                ingest_stage.bytes_read = ingested['bytes_read'] or 0
+                ingest_stage.pages = ingested['pages'] or 0
+
+            self.document_vectors_batch_processor(run)(documents_df, batch_id)
+            documents_df.unpersist()
+
+            with run.measure('index_sync'):
+                self.sync_index(index)
+
+            self.record_pipeline_run(run)
+            runs.append(run)
+
+        stream_writer = self.read_documents_stream().writeStream
+
+        if processing_time is None:
+            stream_writer = stream_writer.trigger(availableNow=True)
         else:
-            index.create(
-                source_table_name=f'{self.config.catalog}.{self.config.schema}.document_vectors',
-                pipeline_type='TRIGGERED',
-                primary_key='id',
-                embedding_vector_column='embeddings',
-                embedding_dimension=1024,
+            stream_writer = stream_writer.trigger(processingTime=processing_time)
+
+        (
+            stream_writer
+            .option('checkpointLocation', self.config.checkpoints_dir('document_pipeline'))
+            .foreachBatch(process_batch)
+            .start()
+            .awaitTermination()
+        )
+
+        return runs
+
+    def record_pipeline_run(self, run: metrics.PipelineRun) -> None:
+        if run.wall_time == 0:
+            run.wall_time = (datetime.now(timezone.utc) - run.started_on).total_seconds()
+
+        print(run)
+
+        (
+            self.spark
+            .createDataFrame(
+                [
+                    (
+                        run.run_id, run.pipeline, run.started_on, run.wall_time, stage.stage, stage.wall_time,
+                        stage.documents, stage.pages, stage.chunks, stage.bytes_read, stage.embedding_requests,
+                        stage.embedding_retries, stage.cache_hits, stage.cache_misses, stage.rows,
+                        stage.rows_per_second,
+                    )
+                    for stage in run.ordered_stages()
+                ],
+                metrics.PIPELINE_RUN_SCHEMA,
             )
+            .withColumn('created_on', F.now())
+            .write.mode('append')
+            .saveAsTable('pipeline_runs')
+        )
+
+    def remove_stale_document_vectors(self) -> int:
+        # Reconciles the documents table against the files that are currently in the volume. Vectors of files that
+        # have been removed are deleted, as are vectors of revisions that have been superseded by a newer revision of
+        # the same file name. Deletions flow through the change data feed of document_vectors into the index.
+        # Documents of removed files are recorded in removed_documents, as documents must stay append-only.
+        volume_files_df = (
+            self.spark.read
+            .format('binaryFile')
+            .option('pathGlobFilter', '*.pdf')
+            .option('recursiveFileLookup', 'true')
+            .load(self.config.documents_dir())
+            .selectExpr('path AS file_name')
+        )
+
+        removed_file_names = [
+            r['file_name']
+            for r in (
+                self.current_documents_df()
+                .select('file_name')
+                .distinct()
+                .join(volume_files_df, 'file_name', 'left_anti')
+                .collect()
+            )
+        ]
+
+        documents_df = (
+            self.current_documents_df()
+            .select('file_name', 'file_hash', 'created_on')
+            .join(volume_files_df, 'file_name', 'left_semi')
+        )
+
+        latest_revisions_df = (
+            documents_df
+            .withColumn('revision_rank', F.row_number().over(
+                Window.partitionBy('file_name').orderBy(F.col('created_on').desc()),
+            ))
+            .filter('revision_rank = 1')
+            .selectExpr('file_name', 'file_hash AS latest_file_hash')
+        )
+
+        vectorized_file_hashes_df = self.spark.table('document_vectors').select('file_hash').distinct()
+
+        # Previous revisions stay searchable until the latest revision of the file has been vectorized. A file hash
+        # that is still current under any file name (e.g. a copy) is never removed.
+        current_file_hashes_df = (
+            documents_df
+            .join(latest_revisions_df, 'file_name')
+            .join(
+                vectorized_file_hashes_df.selectExpr('file_hash AS latest_file_hash', 'true AS latest_vectorized'),
+                'latest_file_hash',
+                'left',
+            )
+            .filter((F.col('file_hash') == F.col('latest_file_hash')) | F.col('latest_vectorized').isNull())
+            .select('file_hash')
+            .distinct()
+        )
+
+        stale_file_hashes = [
+            r['file_hash']
+            for r in vectorized_file_hashes_df.join(current_file_hashes_df, 'file_hash', 'left_anti').collect()
+        ]
+
+        stale_vector_count = 0
+
+        if stale_file_hashes:
+            # The hashes are materialized first so that the deletion does not depend on the table it modifies.
+            (
+                self.spark
+                .createDataFrame([(h,) for h in stale_file_hashes], 'file_hash STRING')
+                .createOrReplaceTempView('stale_file_hashes')
+            )
+
+            stale_vector_count = (
+                self.spark.table('document_vectors')
+                .filter(F.col('file_hash').isin(stale_file_hashes))
+                .count()
+            )
+
+            self.spark_query(r'''
+                DELETE FROM document_vectors
+                WHERE file_hash IN (SELECT file_hash FROM stale_file_hashes)
+            ''')
+
+        if removed_file_names:
+            # The documents are only hidden, so that the document vector stream never sees a deletion.
+            (
+                self.spark
+                .createDataFrame([(n,) for n in removed_file_names], 'file_name STRING')
+                .withColumn('removed_on', F.now())
+                .write.mode('append')
+                .saveAsTable('removed_documents')
+            )
+
+        print(f'Removed {len(removed_file_names)} deleted documents and {stale_vector_count} stale vectors '
+              f'of {len(stale_file_hashes)} superseded or deleted revisions')
+
+        index = SeaVectorSearchIndex(
+            endpoint_name=self.config.vector_search_endpoint,
+            index_name=self.config.document_vectors_index,
+        )
+
+        if stale_vector_count and index.query_exists():
+            self.sync_index(index)
+
+        return stale_vector_count
+
+    def export_document_vectors(self) -> str:
+        # Writes a snapshot of document_vectors as JSON Lines to the volume, from where it can be downloaded and
+        # loaded into retrieval backends outside of Databricks (e.g. manage.py loaddocumentvectors).
+        path = self.config.volume_dir('exports/document_vectors')
+
+        (
+            self.spark.table('document_vectors')
+            .select('id', 'file_name', 'file_hash', 'start_page_no', 'end_page_no', 'content', 'embeddings')
+            .write.mode('overwrite')
+            .json(path)
+        )
 
-            index.await_deployment()
+        return path
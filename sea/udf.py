@@ -3,54 +3,247 @@
 # # Copyright (c) 2024 SilentByte <https://silentbyte.com/>
 # #
 
+import os
+import functools
+
 from typing import Iterator
 
-from sea import dataprocessing
+from sea import dataprocessing, embedding, utils
 
 import pandas as pd
-import mlflow.deployments
 from pyspark.sql.functions import pandas_udf, PandasUDFType
 
 
-@pandas_udf('ARRAY<STRUCT<text: STRING, start_page_no: INT, end_page_no: INT>>', PandasUDFType.SCALAR_ITER)
-def extract_document_chunks(document_data_series: Iterator[pd.Series]) -> Iterator[pd.Series]:
+DOCUMENT_RECORD_SCHEMA = (
+    'record_type STRING, '
+    'chunk_key STRING, '
+    'file_hash STRING, '
+    'unit_start_page_no INT, '
+    'chunk_no INT, '
+    'content STRING, '
+    'start_page_no INT, '
+    'end_page_no INT, '
+    'carried_from_file_hash STRING, '
+    'carried_chunk_no INT, '
+    'page_no INT, '
+    'page_hash STRING'
+)
+
+DOCUMENT_RECORD_COLUMNS = [c.strip().split(' ')[0] for c in DOCUMENT_RECORD_SCHEMA.split(',')]
+DOCUMENT_RECORD_INT_COLUMNS = ['unit_start_page_no', 'chunk_no', 'start_page_no', 'end_page_no', 'carried_chunk_no', 'page_no']
+
+
+@functools.lru_cache(maxsize=256)
+def cached_file_hash(file_name: str, file_size: int, modification_time_ns: int) -> str:
+    # Work units of the same document often end up on the same worker, which then only hashes the file once; the
+    # size and modification time are part of the key, so that a file that has been replaced is hashed again.
+    return dataprocessing.compute_file_hash(file_name)
+
+
+def verified_file_name(file_name: str, file_hash: str) -> str | None:
+    # A file read by reference may have been overwritten by a newer revision since it was ingested (revisions keep
+    # their path), in which case its chunks must not be recorded under the hash of the ingested revision.
+    try:
+        stat = os.stat(file_name)
+    except FileNotFoundError:
+        return None
+
+    if cached_file_hash(file_name, stat.st_size, stat.st_mtime_ns) != file_hash:
+        return None
+
+    return file_name
+
+
+def make_extract_document_records(
+        chunk_size: int = 640,
+        chunk_overlap: int = 60,
+        normalizer: dataprocessing.TextNormalizer = dataprocessing.DEFAULT_TEXT_NORMALIZER,
+        tokenizer_cache_dir: str | None = None,
+        max_records_per_batch: int = 64,
+):
+    # Emits one row per chunk (record_type 'chunk') and per page hash (record_type 'page') while documents are
+    # processed, so that no single cell ever holds all chunks of a document. Chunks carried over from a previous
+    # revision reference the previous chunk via carried_chunk_no instead of repeating its content.
+    #
+    # Each input row is a work unit covering the page range [unit_start_page_no, unit_end_page_no) of a document;
+    # chunk numbers are local to the work unit.
+    def chunk_record(document, chunk_no: int, chunk: dataprocessing.LocalizedText) -> dict:
+        return {
+            'record_type': 'chunk',
+            'chunk_key': document.chunk_key,
+            'file_hash': document.file_hash,
+            'unit_start_page_no': document.unit_start_page_no,
+            'chunk_no': chunk_no,
+            'content': chunk.text,
+            'start_page_no': chunk.start_page_no,
+            'end_page_no': chunk.end_page_no,
+        }
+
+    def carried_chunk_record(document, chunk_no: int, chunk: dataprocessing.LocalizedText, carried_chunk_no: int) -> dict:
+        return {
+            'record_type': 'chunk',
+            'chunk_key': document.chunk_key,
+            'file_hash': document.file_hash,
+            'unit_start_page_no': document.unit_start_page_no,
+            'chunk_no': chunk_no,
+            'start_page_no': chunk.start_page_no,
+            'end_page_no': chunk.end_page_no,
+            'carried_from_file_hash': document.previous_file_hash,
+            'carried_chunk_no': carried_chunk_no,
+        }
+
+    def page_record(document, page_hash: dataprocessing.PageHash) -> dict:
+        return {
+            'record_type': 'page',
+            'chunk_key': document.chunk_key,
+            'file_hash': document.file_hash,
+            'unit_start_page_no': document.unit_start_page_no,
+            'page_no': page_hash.page_no,
+            'page_hash': page_hash.page_hash,
+        }
+
+    def document_data(document) -> bytes | str | None:
+        # Documents ingested by reference are read lazily from the volume, page by page.
+        if document.content is None:
+            return verified_file_name(utils.local_file_name(document.file_name), document.file_hash)
+
+        return document.content
+
+    def extract_records(document) -> Iterator[dict]:
+        if (data := document_data(document)) is None:
+            # The current file will be ingested as a revision of its own; this one can no longer be chunked.
+            print(f'Skipping {document.file_name} ({document.file_hash}), the file has been changed or removed')
+            return
+
+        if document.previous_page_hashes is None or document.previous_chunks is None:
+            page_hashes = []
+
+            def hashed_pages() -> Iterator[dataprocessing.LocalizedText]:
+                for page in dataprocessing.extract_document_pages(
+                        document_data=data,
+                        normalizer=normalizer,
+                        start_page_no=document.unit_start_page_no,
+                        end_page_no=None if pd.isna(document.unit_end_page_no) else int(document.unit_end_page_no),
+                ):
+                    page_hashes.append(dataprocessing.PageHash(page.start_page_no, dataprocessing.compute_page_hash(page.text)))
+                    yield page
+
+            for chunk_no, chunk in enumerate(dataprocessing.split_page_sentence_chunks(
+                    pages=hashed_pages(),
+                    chunk_size=chunk_size,
+                    chunk_overlap=chunk_overlap,
+                    tokenizer_cache_dir=tokenizer_cache_dir,
+            )):
+                yield chunk_record(document, chunk_no, chunk)
+
+            for page_hash in page_hashes:
+                yield page_record(document, page_hash)
+
+            return
+
+        revision = dataprocessing.extract_revised_document_sentence_chunks(
+            document_data=data,
+            previous_page_hashes=[
+                dataprocessing.PageHash(ph['page_no'], ph['page_hash'])
+                for ph in document.previous_page_hashes
+            ],
+            previous_chunks=[
+                dataprocessing.LocalizedText('', c['start_page_no'], c['end_page_no'])
+                for c in document.previous_chunks
+            ],
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            normalizer=normalizer,
+            tokenizer_cache_dir=tokenizer_cache_dir,
+            start_page_no=document.unit_start_page_no,
+            end_page_no=None if pd.isna(document.unit_end_page_no) else int(document.unit_end_page_no),
+        )
+
+        chunks = sorted(
+            [(chunk, None) for chunk in revision.chunks]
+            + [
+                (chunk, document.previous_chunks[index]['chunk_no'])
+                for chunk, index in zip(revision.carried_chunks, revision.carried_chunk_indices)
+            ],
+            key=lambda c: (c[0].start_page_no, c[0].end_page_no),
+        )
+
+        for chunk_no, (chunk, carried_chunk_no) in enumerate(chunks):
+            if carried_chunk_no is None:
+                yield chunk_record(document, chunk_no, chunk)
+            else:
+                yield carried_chunk_record(document, chunk_no, chunk, carried_chunk_no)
+
+        for page_hash in revision.page_hashes:
+            yield page_record(document, page_hash)
+
+    def to_records_df(records: list[dict]) -> pd.DataFrame:
+        # Columns are typed explicitly, otherwise columns without any values in a batch would be inferred as float.
+        return pd.DataFrame({
+            c: pd.array([r.get(c) for r in records], dtype='Int32' if c in DOCUMENT_RECORD_INT_COLUMNS else object)
+            for c in DOCUMENT_RECORD_COLUMNS
+        })
+
+    def extract_document_records(documents: Iterator[pd.DataFrame]) -> Iterator[pd.DataFrame]:
+        records = []
+
+        for documents_df in documents:
+            for document in documents_df.itertuples(index=False):
+                for record in extract_records(document):
+                    records.append(record)
+
+                    if len(records) >= max_records_per_batch:
+                        yield to_records_df(records)
+                        records = []
+
+        if records:
+            yield to_records_df(records)
+
+    return extract_document_records
+
+
+@pandas_udf('INT', PandasUDFType.SCALAR_ITER)
+def count_document_pages(document_data_series: Iterator[pd.Series]) -> Iterator[pd.Series]:
     for document_data in document_data_series:
-        yield document_data.apply(lambda dd: [
-            {
-                'text': chunk.text,
-                'start_page_no': chunk.start_page_no,
-                'end_page_no': chunk.end_page_no,
-            } for chunk in dataprocessing.extract_document_sentence_chunks(
-                document_data=dd,
-                chunk_size=640,
-                chunk_overlap=60,
-            )
-        ])
-
-
-@pandas_udf('ARRAY<FLOAT>', PandasUDFType.SCALAR)
-def compute_embeddings(content_series: pd.Series) -> pd.Series:
-    deploy_client = mlflow.deployments.get_deploy_client('databricks')
-
-    def predict(batch):
-        return [
-            e['embedding']
-            for e in deploy_client.predict(
-                endpoint='databricks-bge-large-en',
-                inputs={
-                    'input': batch,
-                },
-            ).data
-        ]
-
-    model_chunk_size = 150
-    chunks = [
-        content_series.iloc[i: i + model_chunk_size]
-        for i in range(0, len(content_series), model_chunk_size)
-    ]
-
-    return pd.Series([
-        embedding
-        for batch in chunks
-        for embedding in predict(batch.tolist())
-    ])
+        yield document_data.apply(dataprocessing.count_document_pages)
+
+
+@pandas_udf('STRUCT<file_hash: STRING, page_count: INT>', PandasUDFType.SCALAR_ITER)
+def compute_document_file_metadata(path_series: Iterator[pd.Series]) -> Iterator[pd.DataFrame]:
+    # Used when documents are ingested by reference; the file is hashed in blocks and never loaded as a whole.
+    for paths in path_series:
+        file_names = paths.apply(utils.local_file_name)
+
+        yield pd.DataFrame({
+            'file_hash': file_names.apply(dataprocessing.compute_file_hash),
+            'page_count': file_names.apply(dataprocessing.count_document_pages).astype('int32'),
+        })
+
+
+def make_compute_embeddings(request_accumulator=None, retry_accumulator=None):
+    # The (optional) Spark accumulators collect the number of endpoint requests and retries across all executors.
+    @pandas_udf('ARRAY<FLOAT>', PandasUDFType.SCALAR_ITER)
+    def compute_embeddings(content_series: Iterator[pd.Series]) -> Iterator[pd.Series]:
+        request_stats = embedding.EmbeddingRequestStats()
+
+        # Only the total number of output rows has to match the input, so the texts of several Arrow batches are
+        # embedded together and the results are yielded once they are available.
+        for embeddings in embedding.compute_buffered_embeddings(
+                backend=embedding.shared_databricks_embedding_backend(),
+                text_batches=(content.tolist() for content in content_series),
+                batch_sizer=embedding.AdaptiveBatchSizer(),
+                request_stats=request_stats,
+        ):
+            # Rows are float32 views into one matrix, which Arrow converts without going through Python floats.
+            yield pd.Series(list(embeddings), dtype=object)
+
+        if request_accumulator is not None:
+            request_accumulator.add(request_stats.requests)
+
+        if retry_accumulator is not None:
+            retry_accumulator.add(request_stats.retries)
+
+    return compute_embeddings
+
+
+compute_embeddings = make_compute_embeddings()
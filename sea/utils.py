@@ -30,3 +30,17 @@ def sleep(seconds: float) -> None:
 
 def dedent(text: str) -> str:
     return textwrap.dedent(text).strip('\n')
+
+
+def local_file_name(path: str) -> str:
+    # Unity Catalog volumes are mounted under /Volumes on cluster nodes, so the files can be opened directly.
+    return path.removeprefix('dbfs:')
+
+
+def format_vector(values) -> str:
+    # Text representation of vectors as used by pgvector, e.g. '[0.1,0.2,0.3]'.
+    return '[' + ','.join(map(str, values)) + ']'
+
+
+def parse_vector(text: str) -> list[float]:
+    return [float(v) for v in text.strip('[]').split(',') if v]
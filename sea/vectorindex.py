@@ -0,0 +1,207 @@
+# #
+# # SEA / SMART ENGINEERING ASSISTANT
+# # Copyright (c) 2024 SilentByte <https://silentbyte.com/>
+# #
+
+
+import os
+import json
+import mmap
+import shutil
+import functools
+import tempfile
+import threading
+
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Iterable, Protocol
+
+import numpy as np
+
+from sea import utils
+
+CURRENT_SNAPSHOT_FILE_NAME = 'CURRENT'
+
+
+class DocumentVectorLike(Protocol):
+    id: str
+    file_name: str
+    file_hash: str
+    start_page_no: int
+    end_page_no: int
+    content: str
+    embeddings: np.ndarray
+
+
+@dataclass
+class VectorSearchHit:
+    score: float
+    id: str
+    file_name: str
+    file_hash: str
+    start_page_no: int
+    end_page_no: int
+    content: str
+
+
+def write_vector_index_snapshot(
+        root_dir: str,
+        vectors: Iterable[DocumentVectorLike],
+        dtype: str = 'float32',
+        keep_snapshots: int = 2,
+) -> str:
+    # A snapshot consists of the (L2-normalized) embeddings as a raw matrix, the chunk metadata as JSON Lines and the
+    # byte offset of every metadata line, so that readers can memory-map all of it instead of loading it per process.
+    os.makedirs(root_dir, exist_ok=True)
+
+    snapshot_name = datetime.now(timezone.utc).strftime('%Y%m%d%H%M%S%f')
+    snapshot_dir = tempfile.mkdtemp(prefix=f'.{snapshot_name}-', dir=root_dir)
+
+    count = 0
+    dimensions = None
+    offsets = [0]
+
+    with (open(os.path.join(snapshot_dir, 'embeddings.bin'), 'wb') as embeddings_fp,
+          open(os.path.join(snapshot_dir, 'metadata.jsonl'), 'wb') as metadata_fp):
+        for v in vectors:
+            embeddings = np.asarray(v.embeddings, dtype=np.float32)
+            dimensions = dimensions or len(embeddings)
+
+            if len(embeddings) != dimensions:
+                raise ValueError(f'Vector {v.id} has {len(embeddings)} dimensions instead of {dimensions}')
+
+            norm = np.linalg.norm(embeddings)
+            embeddings_fp.write((embeddings / norm if norm > 0 else embeddings).astype(dtype).tobytes())
+
+            metadata_fp.write(json.dumps({
+                'id': v.id,
+                'file_name': v.file_name,
+                'file_hash': v.file_hash,
+                'start_page_no': v.start_page_no,
+                'end_page_no': v.end_page_no,
+                'content': v.content,
+            }).encode('utf-8') + b'\n')
+
+            offsets.append(metadata_fp.tell())
+            count += 1
+
+    np.asarray(offsets, dtype=np.int64).tofile(os.path.join(snapshot_dir, 'offsets.bin'))
+
+    with open(os.path.join(snapshot_dir, 'manifest.json'), 'w', encoding='utf-8') as fp:
+        json.dump({
+            'count': count,
+            'dimensions': dimensions or 0,
+            'dtype': dtype,
+        }, fp)
+
+    os.replace(snapshot_dir, os.path.join(root_dir, snapshot_name))
+
+    # Readers switch to the new snapshot as soon as the pointer has been replaced, which happens atomically.
+    with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=root_dir, delete=False) as fp:
+        fp.write(snapshot_name)
+
+    os.replace(fp.name, os.path.join(root_dir, CURRENT_SNAPSHOT_FILE_NAME))
+
+    # Older snapshots that may still be mapped by other processes remain readable after they have been unlinked.
+    snapshot_names = sorted(n for n in os.listdir(root_dir) if n.isdigit())
+    for name in snapshot_names[:-keep_snapshots]:
+        shutil.rmtree(os.path.join(root_dir, name), ignore_errors=True)
+
+    return snapshot_name
+
+
+class VectorIndexSnapshot:
+    def __init__(self, snapshot_dir: str):
+        self.snapshot_dir = snapshot_dir
+
+        with open(os.path.join(snapshot_dir, 'manifest.json'), 'r', encoding='utf-8') as fp:
+            manifest = json.load(fp)
+
+        self.count = manifest['count']
+        self.dimensions = manifest['dimensions']
+
+        if self.count > 0:
+            self.embeddings = np.memmap(os.path.join(snapshot_dir, 'embeddings.bin'), dtype=manifest['dtype'], mode='r',
+                                        shape=(self.count, self.dimensions))
+        else:
+            self.embeddings = np.zeros((0, self.dimensions), dtype=manifest['dtype'])
+
+        self.offsets = np.fromfile(os.path.join(snapshot_dir, 'offsets.bin'), dtype=np.int64)
+
+        with open(os.path.join(snapshot_dir, 'metadata.jsonl'), 'rb') as fp:
+            self.metadata = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) if self.offsets[-1] > 0 else b''
+
+    def search(self, query: np.ndarray, k: int, block_size: int = 4096) -> list[VectorSearchHit]:
+        if self.count == 0:
+            return []
+
+        query = np.asarray(query, dtype=np.float32)
+        query = query / max(np.linalg.norm(query), 1e-12)
+
+        # Scores are computed block by block in float32, which bounds the temporary memory for float16 snapshots;
+        # float16 halves the size of the index, but converting it makes scoring considerably slower.
+        scores = np.empty(self.count, dtype=np.float32)
+        for start in range(0, self.count, block_size):
+            block = self.embeddings[start:start + block_size]
+            scores[start:start + len(block)] = block.astype(np.float32, copy=False) @ query
+
+        k = min(k, self.count)
+        indices = np.argpartition(-scores, k - 1)[:k]
+        indices = indices[np.argsort(-scores[indices])]
+
+        return [
+            VectorSearchHit(score=float(scores[i]), **json.loads(self.metadata[self.offsets[i]:self.offsets[i + 1]]))
+            for i in indices
+        ]
+
+
+class MemoryMappedVectorIndex:
+    def __init__(self, root_dir: str, refresh_interval: float = 5.0):
+        self.root_dir = root_dir
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._snapshot: VectorIndexSnapshot | None = None
+        self._snapshot_name: str | None = None
+        self._last_refresh = 0.0
+
+    def _current_snapshot_name(self) -> str | None:
+        try:
+            with open(os.path.join(self.root_dir, CURRENT_SNAPSHOT_FILE_NAME), 'r', encoding='utf-8') as fp:
+                return fp.read().strip()
+        except FileNotFoundError:
+            return None
+
+    def snapshot(self) -> VectorIndexSnapshot | None:
+        # The pointer is checked at most every refresh interval; requests that are still using the previous snapshot
+        # keep their reference, so swapping never affects a search in progress.
+        now = utils.epoch()
+
+        with self._lock:
+            if now - self._last_refresh >= self.refresh_interval:
+                self._last_refresh = now
+
+                if (snapshot_name := self._current_snapshot_name()) != self._snapshot_name and snapshot_name:
+                    self._snapshot = VectorIndexSnapshot(os.path.join(self.root_dir, snapshot_name))
+                    self._snapshot_name = snapshot_name
+
+            return self._snapshot
+
+    def snapshot_name(self) -> str | None:
+        # Name of the snapshot searches are currently served from, which changes up to a refresh interval after a
+        # new snapshot has been published.
+        self.snapshot()
+        return self._snapshot_name
+
+    def search(self, query: np.ndarray, k: int) -> list[VectorSearchHit]:
+        snapshot = self.snapshot()
+
+        if snapshot is None:
+            raise ValueError(f'No vector index snapshot has been published in {self.root_dir}')
+
+        return snapshot.search(query, k)
+
+
+@functools.cache
+def shared_vector_index(root_dir: str) -> MemoryMappedVectorIndex:
+    # One index per process; the mapped pages themselves are shared between processes by the OS page cache.
+    return MemoryMappedVectorIndex(root_dir)
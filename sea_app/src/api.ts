@@ -27,6 +27,11 @@ export interface IInferenceResult {
     sources: IInferenceSource[];
 }
 
+export interface IInferenceStreamHandlers {
+    onSources?: (sources: IInferenceSource[]) => void;
+    onToken?: (text: string) => void;
+}
+
 export interface IDocumentSearchResult {
     file_name: string;
     file_hash: string;
@@ -124,6 +129,72 @@ export class SeaApiClient {
         });
     }
 
+    async inferenceQueryStream(inference_interactions: IInferenceInteraction[],
+                               handlers: IInferenceStreamHandlers): Promise<IInferenceResult> {
+        const url = "api/inference/query/stream";
+
+        console.log(`Sending API request to POST ${url}:`);
+
+        const response = await fetch(new URL(url, this.baseUrl), {
+            method: "POST",
+            body: JSON.stringify({
+                inference_interactions,
+            }),
+            credentials: "include",
+            headers: {
+                "Authorization": `Bearer ${this.token}`,
+                "Content-Type": "application/json",
+            },
+        });
+
+        if(!response.ok || !response.body) {
+            throw new Error(`Request Failed: ${response.status} ${response.statusText}`);
+        }
+
+        // Server-sent events are parsed by hand because EventSource only supports GET requests.
+        const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+        let buffer = "";
+        let result: IInferenceResult | null = null;
+
+        while(true) {
+            const {value, done} = await reader.read();
+
+            if(done) {
+                break;
+            }
+
+            buffer += value;
+
+            let separatorIndex;
+            while((separatorIndex = buffer.indexOf("\n\n")) >= 0) {
+                const message = buffer.slice(0, separatorIndex);
+                buffer = buffer.slice(separatorIndex + 2);
+
+                const event = message.match(/^event: (.*)$/m)?.[1];
+                const data = JSON.parse(message.match(/^data: (.*)$/m)?.[1] ?? "null");
+
+                if(event === "sources") {
+                    handlers.onSources?.(data.sources);
+                } else if(event === "token") {
+                    handlers.onToken?.(data.text);
+                } else if(event === "result") {
+                    result = data;
+                } else if(event === "error") {
+                    throw new Error("Inference Failed");
+                }
+            }
+        }
+
+        if(!result) {
+            throw new Error("Inference Failed: Stream ended without a result");
+        }
+
+        console.log(`Received API response from POST ${url}:`);
+        console.log(result);
+
+        return result;
+    }
+
     async searchDocuments(query: string): Promise<IDocumentSearchResult[]> {
         return await this.request("GET", "api/search_documents", {
             query: {
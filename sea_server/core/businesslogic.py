@@ -6,6 +6,8 @@
 
 import logging
 import hashlib
+import contextlib
+import functools
 import os.path
 import re
 
@@ -15,16 +17,26 @@ from glob import glob
 from pathlib import Path
 from datetime import datetime, timedelta
 from dataclasses import dataclass
+from typing import TYPE_CHECKING, AsyncIterator, Iterable
 
-from django.db import transaction
+from django.db import connection, transaction
 from django.db.models import Q
 from django.utils import timezone
+from psycopg.conninfo import make_conninfo
 
+from sea import utils
+from sea.classification import (
+    ClassifierEvaluation,
+    KeywordInteractionClassifier,
+    evaluate_interaction_classifier,
+)
 from sea.config import SeaConfig
 from sea.inference import (
     SeaInferenceClient,
     InferenceInteraction,
     InferenceResult,
+    InferenceStreamEvent,
+    shared_inference_client,
 )
 
 from server import settings
@@ -32,11 +44,19 @@ from server import settings
 from core import auth
 from core.models import (
     Document,
+    DocumentVector,
     InferenceLog,
     UserAccount,
     AuthToken,
 )
 
+if TYPE_CHECKING:
+    from psycopg_pool import ConnectionPool
+
+    from sea.answercache import SemanticAnswerCache
+    from sea.local import LocalDocumentVector
+    from sea.metrics import PipelineRun
+
 log = logging.getLogger(__name__)
 
 
@@ -123,6 +143,24 @@ def authenticate_with_token(token: str) -> UserAccount | None:
     return auth_token.user
 
 
+async def aauthenticate_with_token(token: str) -> UserAccount | None:
+    now = timezone.now()
+
+    auth_token: AuthToken = await AuthToken.objects \
+        .select_related('user') \
+        .filter(token=token) \
+        .filter(Q(expires_on__isnull=True) | Q(expires_on__gt=now)) \
+        .afirst()
+
+    if auth_token is None:
+        return None
+
+    auth_token.last_auth_on = now
+    await auth_token.asave(update_fields=['last_auth_on'])
+
+    return auth_token.user
+
+
 def extract_document_search_tags(file_name: str) -> list[str]:
     file_name = Path(file_name).stem.lower()
     return list(set(re.split(r'[\s\-_.]+', file_name)))
@@ -161,6 +199,292 @@ def synchronize_documents() -> None:
             )
 
 
+def interaction_classifier_file() -> str:
+    return os.path.join(settings.SEA_DATA_DIR, 'interaction_classifier.json')
+
+
+def local_sea_config() -> SeaConfig:
+    return SeaConfig(
+        chunk_cache_dir=os.path.join(settings.SEA_DATA_DIR, 'chunks'),
+        embedding_cache_file=os.path.join(settings.SEA_DATA_DIR, 'embedding_cache.sqlite'),
+        local_vectors_file=os.path.join(settings.SEA_DATA_DIR, 'document_vectors.sqlite'),
+        vector_index_dir=os.path.join(settings.SEA_DATA_DIR, 'vector_index'),
+        embedding_endpoint_url=settings.SEA_EMBEDDING_URL,
+        retriever_backend=settings.SEA_RETRIEVER_BACKEND,
+        interaction_classifier_file=interaction_classifier_file() if settings.SEA_INTERACTION_CLASSIFIER else None,
+        speculative_retrieval=settings.SEA_SPECULATIVE_RETRIEVAL,
+        answer_cache=settings.SEA_ANSWER_CACHE,
+        answer_cache_version_file=settings.SEA_ANSWER_CACHE_VERSION_FILE,
+    )
+
+
+def compute_local_document_vectors(
+        max_workers: int | None = None,
+        page_extraction_workers: int | None = None,
+) -> 'PipelineRun':
+    # The local runtime pulls in PyMuPDF, LlamaIndex, and NumPy, which the web server does not need otherwise.
+    from sea.embedding import DatabricksEmbeddingBackend, HttpEmbeddingBackend
+    from sea.local import LocalSeaRuntime, LocalDocumentVectorStore
+
+    sea_config = local_sea_config()
+    os.makedirs(settings.SEA_DATA_DIR, exist_ok=True)
+
+    if page_extraction_workers is not None:
+        sea_config.page_extraction_workers = page_extraction_workers
+
+    if sea_config.embedding_endpoint_url is not None:
+        embedding_backend = HttpEmbeddingBackend(sea_config.embedding_endpoint_url)
+    else:
+        embedding_backend = DatabricksEmbeddingBackend()
+
+    log.info('Computing document vectors for %s in %s', settings.DOCUMENT_DIR, settings.SEA_DATA_DIR)
+
+    runtime = LocalSeaRuntime(
+        config=sea_config,
+        embedding_backend=embedding_backend,
+        vector_store=LocalDocumentVectorStore(sea_config.local_vectors_file),
+        max_workers=max_workers,
+    )
+
+    return runtime.compute_document_vectors(settings.DOCUMENT_DIR)
+
+
+def read_local_document_vectors(input_path: str | None = None) -> Iterable['LocalDocumentVector']:
+    from sea.local import LocalDocumentVectorStore, read_document_vectors_json
+
+    if input_path is not None:
+        return read_document_vectors_json(input_path)
+
+    return LocalDocumentVectorStore(local_sea_config().local_vectors_file).vectors()
+
+
+def create_document_vector_table() -> None:
+    # The migration only creates the table if pgvector is the configured retriever backend, so that other
+    # deployments do not require the extension; it is created on first use otherwise.
+    if DocumentVector._meta.db_table in connection.introspection.table_names():
+        return
+
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'vector'")
+
+        if cursor.fetchone() is None:
+            raise ValueError('The pgvector extension is not available on the database server')
+
+        cursor.execute('CREATE EXTENSION IF NOT EXISTS vector')
+
+    with connection.schema_editor() as schema_editor:
+        schema_editor.create_model(DocumentVector)
+
+
+def load_document_vectors(vectors: Iterable['LocalDocumentVector']) -> int:
+    # Replaces all document vectors in a single transaction. The HNSW index is dropped during the load and then
+    # built once, which is much faster than maintaining it row by row.
+    create_document_vector_table()
+
+    hnsw_index = next(i for i in DocumentVector._meta.indexes if i.name == 'document_vector_hnsw')
+    count = 0
+
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(f'TRUNCATE {DocumentVector._meta.db_table}')
+
+        with connection.schema_editor() as schema_editor:
+            schema_editor.remove_index(DocumentVector, hnsw_index)
+
+        with connection.connection.cursor() as cursor:
+            with cursor.copy(
+                    f'COPY {DocumentVector._meta.db_table} '
+                    f'(id, file_name, file_hash, start_page_no, end_page_no, content, embeddings) FROM STDIN'
+            ) as copy:
+                for v in vectors:
+                    copy.write_row((
+                        v.id,
+                        v.file_name,
+                        v.file_hash,
+                        v.start_page_no,
+                        v.end_page_no,
+                        v.content,
+                        utils.format_vector(v.embeddings.tolist()),
+                    ))
+
+                    count += 1
+
+        with connection.schema_editor() as schema_editor:
+            schema_editor.add_index(DocumentVector, hnsw_index)
+
+    invalidate_answer_cache()
+    return count
+
+
+def publish_vector_index(vectors: Iterable['LocalDocumentVector'], dtype: str = 'float32') -> str:
+    from sea.vectorindex import write_vector_index_snapshot
+
+    # Answer caches are cleared once their process has switched to the new snapshot (see answer_cache_version()).
+    return write_vector_index_snapshot(local_sea_config().vector_index_dir, vectors, dtype=dtype)
+
+
+def invalidate_answer_cache() -> str:
+    from sea.answercache import write_index_version
+
+    return write_index_version(local_sea_config().answer_cache_version_file)
+
+
+def answer_cache_version(version_file: str, vector_index_dir: str | None) -> str | None:
+    # The memory-mapped retriever switches to a published snapshot up to a few seconds later, so the answers of a
+    # process are tied to the snapshot it actually serves rather than to the time the snapshot was published.
+    from sea.answercache import read_index_version
+
+    version = read_index_version(version_file)
+
+    if vector_index_dir is not None:
+        from sea.vectorindex import shared_vector_index
+
+        return f'{version}/{shared_vector_index(vector_index_dir).snapshot_name()}'
+
+    return version
+
+
+@functools.cache
+def shared_answer_cache(
+        max_entries: int,
+        ttl: float,
+        similarity_threshold: float,
+        version_file: str | None,
+        vector_index_dir: str | None = None,
+) -> 'SemanticAnswerCache':
+    from sea.answercache import SemanticAnswerCache
+
+    return SemanticAnswerCache(
+        max_entries=max_entries,
+        ttl=ttl,
+        similarity_threshold=similarity_threshold,
+        index_version=(functools.partial(answer_cache_version, version_file, vector_index_dir)
+                       if version_file else None),
+    )
+
+
+def is_acceptable_classifier_evaluation(sea_config: SeaConfig, evaluation: ClassifierEvaluation | None) -> bool:
+    return (evaluation is not None
+            and evaluation.examples >= sea_config.min_classifier_holdout_examples
+            and evaluation.accuracy >= sea_config.min_classifier_accuracy)
+
+
+@functools.cache
+def load_interaction_classifier(file_name: str) -> KeywordInteractionClassifier | None:
+    # Loaded once per process; a retrained classifier is picked up when the server is restarted. Until a classifier
+    # has been trained and evaluated well enough, every question is classified by the model.
+    if not os.path.exists(file_name):
+        log.warning('Interaction classifier %s has not been trained, classifying with the model', file_name)
+        return None
+
+    evaluation = KeywordInteractionClassifier.load_evaluation(file_name)
+
+    if not is_acceptable_classifier_evaluation(local_sea_config(), evaluation):
+        log.warning('Interaction classifier %s is not accurate enough (%s), classifying with the model',
+                    file_name, evaluation or 'not evaluated')
+        return None
+
+    return KeywordInteractionClassifier.load(file_name)
+
+
+def read_interaction_classifier_examples() -> Iterable[tuple[str, bool]]:
+    # Questions the model classified as technical were answered with sources. Questions classified locally are
+    # skipped, so that the classifier is never trained on its own decisions.
+    for inference_log in InferenceLog.objects.only('input', 'output', 'metrics').iterator():
+        if not inference_log.input or inference_log.output is None:
+            continue
+
+        path = utils.dict_item_from_path(inference_log.metrics or {}, 'classification.path', 'llm')
+
+        if path == 'local':
+            continue
+
+        yield inference_log.input[-1]['text'].strip(), len(inference_log.output.get('sources', [])) > 0
+
+
+def train_interaction_classifier(holdout_ratio: float = 0.2) -> tuple[KeywordInteractionClassifier, ClassifierEvaluation]:
+    sea_config = local_sea_config()
+    examples = KeywordInteractionClassifier.default_examples() + list(read_interaction_classifier_examples())
+
+    # The evaluation holds out a deterministic share of the examples; the saved classifier is trained on all of them.
+    holdout = [int(hashlib.sha256(text.encode('utf-8')).hexdigest(), 16) % 100 < holdout_ratio * 100 for text, _ in examples]
+
+    evaluation = evaluate_interaction_classifier(
+        classifier=KeywordInteractionClassifier.train(e for e, h in zip(examples, holdout) if not h),
+        examples=[e for e, h in zip(examples, holdout) if h],
+        min_confidence=sea_config.min_classifier_confidence,
+    )
+
+    classifier = KeywordInteractionClassifier.train(examples)
+
+    os.makedirs(settings.SEA_DATA_DIR, exist_ok=True)
+    classifier.save(interaction_classifier_file(), evaluation)
+
+    return classifier, evaluation
+
+
+@functools.cache
+def pgvector_connection_pool() -> 'ConnectionPool':
+    from psycopg_pool import ConnectionPool
+
+    database = settings.DATABASES['default']
+
+    # Sized to the search threads of an inference client, which run all pgvector queries; connections are kept open
+    # and reused instead of being opened per thread or per query.
+    return ConnectionPool(
+        conninfo=make_conninfo(
+            host=database['HOST'],
+            port=database['PORT'],
+            dbname=database['NAME'],
+            user=database['USER'],
+            password=database['PASSWORD'],
+            sslmode=database['OPTIONS']['sslmode'],
+        ),
+        min_size=1,
+        max_size=settings.SEA_SEARCH_THREADS,
+        open=True,
+    )
+
+
+@contextlib.contextmanager
+def pgvector_cursor():
+    with pgvector_connection_pool().connection() as pgvector_connection:
+        with pgvector_connection.cursor() as cursor:
+            yield cursor
+
+
+def create_inference_client(sea_config: SeaConfig, result_count: int) -> SeaInferenceClient:
+    # Clients are pooled per process; the models, retriever, and chains of a client are built only once.
+    return shared_inference_client(
+        vector_search_endpoint=sea_config.vector_search_endpoint,
+        vector_search_index=sea_config.document_vectors_index,
+        result_count=result_count,
+        retriever_backend=sea_config.retriever_backend,
+        pgvector_cursor_factory=pgvector_cursor,
+        vector_index_dir=sea_config.vector_index_dir,
+        interaction_classifier=(load_interaction_classifier(sea_config.interaction_classifier_file)
+                                if sea_config.interaction_classifier_file is not None else None),
+        min_classifier_confidence=sea_config.min_classifier_confidence,
+        speculative_retrieval=sea_config.speculative_retrieval,
+        search_threads=settings.SEA_SEARCH_THREADS,
+        answer_cache=shared_answer_cache(
+            max_entries=sea_config.answer_cache_entries,
+            ttl=sea_config.answer_cache_ttl,
+            similarity_threshold=sea_config.answer_cache_similarity,
+            version_file=sea_config.answer_cache_version_file,
+            vector_index_dir=sea_config.vector_index_dir if sea_config.retriever_backend == 'mmap' else None,
+        ) if sea_config.answer_cache else None,
+    )
+
+
+def initialize_inference_clients() -> None:
+    # Builds the shared clients used by the inference and search views when the server starts.
+    sea_config = local_sea_config()
+
+    for result_count in (4, 8):
+        create_inference_client(sea_config, result_count=result_count).initialize()
+
+
 def get_document_path(file_hash: str) -> str | None:
     document: Document = Document.objects \
         .filter(file_hash=file_hash) \
@@ -204,36 +528,65 @@ def search_documents(query: str) -> list[DocumentInfo]:
     ]
 
 
-def execute_inference_vector_search(query: str) -> list[DocumentInfo]:
-    sea_config = SeaConfig()
-
-    client = SeaInferenceClient(
-        vector_search_endpoint=sea_config.vector_search_endpoint,
-        vector_search_index=sea_config.document_vectors_index,
-        result_count=8,
-    )
+async def aexecute_inference_vector_search(query: str) -> list[DocumentInfo]:
+    client = create_inference_client(local_sea_config(), result_count=8)
 
     return [
         DocumentInfo(s.file_name, s.file_hash)
-        for s in client.query_search_index(query)
+        for s in await client.aquery_search_index(query)
     ]
 
 
-def execute_inference_query(user: UserAccount | None, inference_interactions: list[InferenceInteraction]) -> InferenceResult:
-    sea_config = SeaConfig()
-
-    client = SeaInferenceClient(
-        vector_search_endpoint=sea_config.vector_search_endpoint,
-        vector_search_index=sea_config.document_vectors_index,
-        result_count=4,
-    )
-
-    inference_result = client.infer_interaction(inference_interactions)
-
-    InferenceLog.objects.create(
+def inference_log(
+        user: UserAccount | None,
+        inference_interactions: list[InferenceInteraction],
+        inference_result: InferenceResult,
+        streamed: bool,
+) -> InferenceLog:
+    return InferenceLog(
         user=user,
         input=[ii.to_dict() for ii in inference_interactions],
         output=inference_result.to_dict(),
+        metrics={
+            'classification': inference_result.classification.to_dict(),
+            'retrieval': inference_result.retrieval.to_dict() if inference_result.retrieval else None,
+            'time_to_first_token': inference_result.time_to_first_token,
+            'streamed': streamed,
+            'answer_cache': inference_result.answer_cache,
+        },
     )
 
+
+async def alog_inference(
+        user: UserAccount | None,
+        inference_interactions: list[InferenceInteraction],
+        inference_result: InferenceResult,
+        streamed: bool,
+) -> None:
+    await inference_log(user, inference_interactions, inference_result, streamed).asave()
+
+
+async def aexecute_inference_query(
+        user: UserAccount | None,
+        inference_interactions: list[InferenceInteraction],
+) -> InferenceResult:
+    client = create_inference_client(local_sea_config(), result_count=4)
+
+    inference_result = await client.ainfer_interaction(inference_interactions)
+    await alog_inference(user, inference_interactions, inference_result, streamed=False)
+
     return inference_result
+
+
+async def astream_inference_query(
+        user: UserAccount | None,
+        inference_interactions: list[InferenceInteraction],
+) -> AsyncIterator[InferenceStreamEvent]:
+    client = create_inference_client(local_sea_config(), result_count=4)
+
+    async for event in client.astream_interaction(inference_interactions):
+        # The interaction is logged once the answer is complete, before the final event is sent.
+        if event.result is not None:
+            await alog_inference(user, inference_interactions, event.result, streamed=True)
+
+        yield event
@@ -0,0 +1,34 @@
+# #
+# # SEA / SMART ENGINEERING ASSISTANT
+# # Copyright (c) 2024 SilentByte <https://silentbyte.com/>
+# #
+
+import sys
+
+from django.core.management.base import BaseCommand
+
+from core import businesslogic
+
+
+def eprint(*args):
+    print(*args, file=sys.stderr, flush=True)
+
+
+class Command(BaseCommand):
+    help = 'Chunks and embeds all documents in the configured folder on this machine without Spark'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None, help='Number of chunking processes (default: CPU count)')
+        parser.add_argument('--page-workers', type=int, default=None,
+                            help='Number of processes the pages of each document are extracted with (default: 1)')
+
+    def handle(self, *args, **options):
+        eprint('INGESTING ALL DOCUMENTS...')
+        run = businesslogic.compute_local_document_vectors(
+            max_workers=options['workers'],
+            page_extraction_workers=options['page_workers'],
+        )
+
+        chunk_stage = run.stage('chunk')
+        eprint(f'{chunk_stage.documents} documents, {chunk_stage.pages} pages, {chunk_stage.chunks} chunks '
+               f'in {run.wall_time:.1f}s ({chunk_stage.pages / run.wall_time if run.wall_time > 0 else 0.0:.1f} pages/s)')
@@ -0,0 +1,22 @@
+# #
+# # SEA / SMART ENGINEERING ASSISTANT
+# # Copyright (c) 2024 SilentByte <https://silentbyte.com/>
+# #
+
+import sys
+
+from django.core.management.base import BaseCommand
+
+from core import businesslogic
+
+
+def eprint(*args):
+    print(*args, file=sys.stderr, flush=True)
+
+
+class Command(BaseCommand):
+    help = 'Clears the answer caches of all server processes, e.g. after the Databricks Vector Search index was synced'
+
+    def handle(self, *args, **options):
+        version = businesslogic.invalidate_answer_cache()
+        eprint(f'Invalidated answer caches (vector index version {version})')
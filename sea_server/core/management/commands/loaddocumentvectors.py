@@ -0,0 +1,32 @@
+# #
+# # SEA / SMART ENGINEERING ASSISTANT
+# # Copyright (c) 2024 SilentByte <https://silentbyte.com/>
+# #
+
+import sys
+
+from django.core.management.base import BaseCommand
+
+from core import businesslogic
+from sea import utils
+
+
+def eprint(*args):
+    print(*args, file=sys.stderr, flush=True)
+
+
+class Command(BaseCommand):
+    help = 'Replaces the document vectors used by the pgvector retriever'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--input', default=None,
+                            help='JSON Lines export of document_vectors (default: vectors of manage.py ingestdocuments)')
+
+    def handle(self, *args, **options):
+        eprint('LOADING DOCUMENT VECTORS...')
+
+        start_time = utils.epoch()
+        count = businesslogic.load_document_vectors(businesslogic.read_local_document_vectors(options['input']))
+        duration = utils.epoch() - start_time
+
+        eprint(f'Loaded {count} document vectors in {duration:.1f}s ({count / max(duration, 1e-9):.1f} rows/s)')
@@ -0,0 +1,36 @@
+# #
+# # SEA / SMART ENGINEERING ASSISTANT
+# # Copyright (c) 2024 SilentByte <https://silentbyte.com/>
+# #
+
+import sys
+
+from django.core.management.base import BaseCommand
+
+from core import businesslogic
+from sea import utils
+
+
+def eprint(*args):
+    print(*args, file=sys.stderr, flush=True)
+
+
+class Command(BaseCommand):
+    help = 'Publishes a new snapshot of the memory-mapped vector index that all server processes switch to'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--input', default=None,
+                            help='JSON Lines export of document_vectors (default: vectors of manage.py ingestdocuments)')
+        parser.add_argument('--dtype', default='float32', choices=['float32', 'float16'],
+                            help='Precision of the stored embeddings; float16 halves the memory footprint')
+
+    def handle(self, *args, **options):
+        eprint('PUBLISHING VECTOR INDEX...')
+
+        start_time = utils.epoch()
+        snapshot_name = businesslogic.publish_vector_index(
+            vectors=businesslogic.read_local_document_vectors(options['input']),
+            dtype=options['dtype'],
+        )
+
+        eprint(f'Published vector index snapshot {snapshot_name} in {utils.epoch() - start_time:.1f}s')
@@ -0,0 +1,35 @@
+# #
+# # SEA / SMART ENGINEERING ASSISTANT
+# # Copyright (c) 2024 SilentByte <https://silentbyte.com/>
+# #
+
+import sys
+
+from django.core.management.base import BaseCommand
+
+from core import businesslogic
+from sea import utils
+
+
+def eprint(*args):
+    print(*args, file=sys.stderr, flush=True)
+
+
+class Command(BaseCommand):
+    help = 'Trains the local casual/technical question classifier from the inference log'
+
+    def handle(self, *args, **options):
+        eprint('TRAINING INTERACTION CLASSIFIER...')
+
+        start_time = utils.epoch()
+        classifier, evaluation = businesslogic.train_interaction_classifier()
+
+        eprint(f'Trained on {classifier.casual_example_count} casual and {classifier.technical_example_count} '
+               f'technical questions in {utils.epoch() - start_time:.1f}s')
+        eprint(f'Holdout: {evaluation}')
+
+        if not businesslogic.is_acceptable_classifier_evaluation(businesslogic.local_sea_config(), evaluation):
+            eprint('The classifier is not accurate enough yet and will not be used, questions keep being classified '
+                   'by the model')
+        else:
+            eprint('Set SEA_INTERACTION_CLASSIFIER=true and restart the server to use the new classifier')
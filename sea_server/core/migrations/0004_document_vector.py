@@ -0,0 +1,65 @@
+# Generated by Django 5.0.4 on 2026-10-18 17:01
+
+import core.models
+from django.conf import settings
+from django.db import migrations, models
+
+
+def is_pgvector_available(connection) -> bool:
+    if connection.vendor != 'postgresql':
+        return False
+
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'vector'")
+        return cursor.fetchone() is not None
+
+
+def create_document_vector_table(apps, schema_editor):
+    # The table and the extension are only needed by the pgvector retriever; other deployments may run on a
+    # Postgres server without pgvector installed.
+    if settings.SEA_RETRIEVER_BACKEND != 'pgvector':
+        return
+
+    if not is_pgvector_available(schema_editor.connection):
+        print('\n  Skipping the document_vector table, the pgvector extension is not available')
+        return
+
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS vector')
+    schema_editor.create_model(apps.get_model('core', 'DocumentVector'))
+
+
+def drop_document_vector_table(apps, schema_editor):
+    schema_editor.execute('DROP TABLE IF EXISTS document_vector')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_document_search_tags_and_more'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(create_document_vector_table, drop_document_vector_table),
+            ],
+            state_operations=[
+                migrations.CreateModel(
+                    name='DocumentVector',
+                    fields=[
+                        ('id', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                        ('file_name', models.CharField(max_length=1024)),
+                        ('file_hash', models.CharField(max_length=64)),
+                        ('start_page_no', models.IntegerField()),
+                        ('end_page_no', models.IntegerField()),
+                        ('content', models.TextField()),
+                        ('embeddings', core.models.VectorField(dimensions=1024)),
+                    ],
+                    options={
+                        'db_table': 'document_vector',
+                        'indexes': [models.Index(fields=['file_hash'], name='document_ve_file_ha_0f6f6e_idx'), core.models.HnswIndex(fields=['embeddings'], name='document_vector_hnsw', opclasses=['vector_cosine_ops'])],
+                    },
+                ),
+            ],
+        ),
+    ]
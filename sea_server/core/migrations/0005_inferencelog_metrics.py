@@ -0,0 +1,18 @@
+# Generated by Django 5.0.4 on 2026-10-18 17:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_document_vector'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='inferencelog',
+            name='metrics',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -10,10 +10,12 @@ from uuid import uuid4
 
 from django.contrib.admin import ModelAdmin
 from django.contrib.postgres.fields import ArrayField
-from django.contrib.postgres.indexes import  GinIndex
+from django.contrib.postgres.indexes import  GinIndex, PostgresIndex
 from django.db import models
 from django.utils.html import format_html, escape
 
+from sea.utils import format_vector, parse_vector
+
 from core import utils, auth
 
 
@@ -37,6 +39,31 @@ class LastModifiedOnField(models.DateTimeField):
         super().__init__(*args, **kwargs)
 
 
+class VectorField(models.Field):
+    # Column of the pgvector extension; values are lists of floats.
+    def __init__(self, *args, dimensions: int, **kwargs):
+        self.dimensions = dimensions
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        kwargs['dimensions'] = self.dimensions
+        return name, path, args, kwargs
+
+    def db_type(self, connection) -> str:
+        return f'vector({self.dimensions})'
+
+    def from_db_value(self, value, expression, connection):
+        return parse_vector(value) if value is not None else None
+
+    def get_prep_value(self, value):
+        return format_vector(value) if value is not None else None
+
+
+class HnswIndex(PostgresIndex):
+    suffix = 'hnsw'
+
+
 class SeaModelAdmin(ModelAdmin):
     list_per_page = 100
     list_max_show_all = 1000
@@ -249,9 +276,40 @@ class InferenceLog(models.Model):
 
     output = models.JSONField()
 
+    metrics = models.JSONField(null=True,
+                               blank=True)
+
     created_on = CreatedOnField()
 
     last_modified_on = LastModifiedOnField()
 
     def __str__(self):
         return str(self.id)
+
+
+class DocumentVector(models.Model):
+    # Mirror of the document_vectors table for retrieval from Postgres via pgvector.
+    class Meta:
+        db_table = 'document_vector'
+        indexes = [
+            models.Index(fields=['file_hash']),
+            HnswIndex(fields=['embeddings'], name='document_vector_hnsw', opclasses=['vector_cosine_ops']),
+        ]
+
+    id = models.CharField(max_length=64,
+                          primary_key=True)
+
+    file_name = models.CharField(max_length=1024)
+
+    file_hash = models.CharField(max_length=64)
+
+    start_page_no = models.IntegerField()
+
+    end_page_no = models.IntegerField()
+
+    content = models.TextField()
+
+    embeddings = VectorField(dimensions=1024)
+
+    def __str__(self):
+        return self.id
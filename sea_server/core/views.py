@@ -10,6 +10,7 @@ from django.http import (
     HttpRequest,
     HttpResponse,
     JsonResponse,
+    StreamingHttpResponse,
 )
 
 from django.shortcuts import render, redirect
@@ -123,38 +124,38 @@ def search_documents(request: HttpRequest) -> HttpResponse:
 
 
 @csrf_exempt
-def inference_search(request: HttpRequest) -> HttpResponse:
+async def inference_search(request: HttpRequest) -> HttpResponse:
     if request.method != 'POST':
         return HttpMethodNotAllowedResponse()
 
     if request.content_type != 'application/json':
         return HttpUnsupportedMediaTypeResponse()
 
-    if businesslogic.authenticate_with_token(extract_token(request)) is None:
+    if await businesslogic.aauthenticate_with_token(extract_token(request)) is None:
         return HttpUnauthorizedResponse()
 
     body = json.loads(request.body)
 
     return JsonResponse([
         di.to_dict()
-        for di in businesslogic.execute_inference_vector_search(body['query'])
+        for di in await businesslogic.aexecute_inference_vector_search(body['query'])
     ], safe=False)
 
 
 @csrf_exempt
-def inference_query(request: HttpRequest) -> HttpResponse:
+async def inference_query(request: HttpRequest) -> HttpResponse:
     if request.method != 'POST':
         return HttpMethodNotAllowedResponse()
 
     if request.content_type != 'application/json':
         return HttpUnsupportedMediaTypeResponse()
 
-    if (user := businesslogic.authenticate_with_token(extract_token(request))) is None:
+    if (user := await businesslogic.aauthenticate_with_token(extract_token(request))) is None:
         return HttpUnauthorizedResponse()
 
     body = json.loads(request.body)
 
-    inference_result = businesslogic.execute_inference_query(
+    inference_result = await businesslogic.aexecute_inference_query(
         user=user,
         inference_interactions=[
             InferenceInteraction(ii['originator'], ii['text'])
@@ -163,3 +164,43 @@ def inference_query(request: HttpRequest) -> HttpResponse:
     )
 
     return JsonResponse(inference_result.to_dict())
+
+
+@csrf_exempt
+async def inference_query_stream(request: HttpRequest) -> HttpResponse:
+    if request.method != 'POST':
+        return HttpMethodNotAllowedResponse()
+
+    if request.content_type != 'application/json':
+        return HttpUnsupportedMediaTypeResponse()
+
+    if (user := await businesslogic.aauthenticate_with_token(extract_token(request))) is None:
+        return HttpUnauthorizedResponse()
+
+    body = json.loads(request.body)
+
+    events = businesslogic.astream_inference_query(
+        user=user,
+        inference_interactions=[
+            InferenceInteraction(ii['originator'], ii['text'])
+            for ii in body['inference_interactions']
+        ],
+    )
+
+    async def format_events():
+        try:
+            async for e in events:
+                yield f'event: {e.event}\ndata: {json.dumps(e.to_dict())}\n\n'
+        except Exception as e:
+            # The status has already been sent, so the client can only be told about the failure by an event.
+            yield 'event: error\ndata: {}\n\n'
+            raise e
+
+    # Tokens are only sent as they arrive when served via ASGI; a WSGI server collects the whole response first.
+    response = StreamingHttpResponse(format_events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+
+    # Prevents nginx from buffering the response, which would hold back the tokens until the answer is complete.
+    response['X-Accel-Buffering'] = 'no'
+
+    return response
@@ -4,9 +4,61 @@
 # #
 
 import os
+import asyncio
+import logging
 
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'server.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+log = logging.getLogger(__name__)
+
+executor_loop: asyncio.AbstractEventLoop | None = None
+
+
+def install_executor() -> None:
+    # The Databricks model clients block, so LangChain runs them on the default executor of the event loop; its size
+    # bounds the number of model calls that can be in flight at the same time.
+    global executor_loop
+
+    if (loop := asyncio.get_running_loop()) is not executor_loop:
+        loop.set_default_executor(ThreadPoolExecutor(max_workers=settings.SEA_INFERENCE_THREADS,
+                                                     thread_name_prefix='sea-inference'))
+        executor_loop = loop
+
+
+async def lifespan(receive, send):
+    from core import businesslogic
+
+    while True:
+        message = await receive()
+
+        if message['type'] == 'lifespan.startup':
+            # The shared inference clients are built before the first request is accepted; if that fails, they are
+            # built by the first request instead.
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, businesslogic.initialize_inference_clients)
+            except Exception as e:
+                log.warning('Could not initialize the inference clients: %s', e)
+
+            await send({'type': 'lifespan.startup.complete'})
+
+        elif message['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    install_executor()
+
+    # Django does not handle lifespan events itself.
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+
+    await django_application(scope, receive, send)
@@ -26,6 +26,33 @@ SECRET_KEY = os.environ['SECRET_KEY']
 
 DOCUMENT_DIR = os.path.abspath(os.environ['DOCUMENT_DIR'])
 
+# Chunks, embeddings, and vectors computed by the local document ingestion (manage.py ingestdocuments).
+SEA_DATA_DIR = os.path.abspath(os.environ.get('SEA_DATA_DIR', os.path.join(BASE_DIR, 'data')))
+SEA_EMBEDDING_URL = os.environ.get('SEA_EMBEDDING_URL') or None
+
+# Either 'databricks', 'pgvector' (requires document vectors loaded via manage.py loaddocumentvectors), or 'mmap'
+# (requires a vector index published via manage.py publishvectorindex).
+SEA_RETRIEVER_BACKEND = os.environ.get('SEA_RETRIEVER_BACKEND', 'databricks')
+
+# Starts the vector search while the chat model classifies a question; results of casual questions are discarded.
+SEA_SPECULATIVE_RETRIEVAL = os.environ.get('SEA_SPECULATIVE_RETRIEVAL', 'false').lower() in ('1', 'true', 'yes')
+
+# Serves repeated and near-duplicate questions from an in-memory cache per server process; the cache is cleared when
+# the version file changes. The Databricks pipelines bump the file after every index sync if their configuration
+# points answer_cache_version_file to it, otherwise run manage.py invalidateanswercache after a sync.
+SEA_ANSWER_CACHE = os.environ.get('SEA_ANSWER_CACHE', 'false').lower() in ('1', 'true', 'yes')
+SEA_ANSWER_CACHE_VERSION_FILE = (os.environ.get('SEA_ANSWER_CACHE_VERSION_FILE')
+                                 or os.path.join(SEA_DATA_DIR, 'vector_index_version'))
+
+# Classifies first questions with a local model trained via manage.py trainclassifier instead of asking the chat
+# model; ignored until a trained classifier with an acceptable holdout accuracy exists.
+SEA_INTERACTION_CLASSIFIER = os.environ.get('SEA_INTERACTION_CLASSIFIER', 'false').lower() in ('1', 'true', 'yes')
+
+# Threads per server process that blocking model calls of async requests run on (see server/asgi.py). Vector searches
+# run on SEA_SEARCH_THREADS separate threads per inference client, which share as many pooled pgvector connections.
+SEA_INFERENCE_THREADS = int(os.environ.get('SEA_INFERENCE_THREADS', '64'))
+SEA_SEARCH_THREADS = int(os.environ.get('SEA_SEARCH_THREADS', '8'))
+
 ALLOWED_HOSTS = []
 
 INSTALLED_APPS = [
@@ -15,5 +15,6 @@ urlpatterns = [
     path('api/search_documents', views.search_documents),
     path('api/inference/search', views.inference_search),
     path('api/inference/query', views.inference_query),
+    path('api/inference/query/stream', views.inference_query_stream),
     path('', views.index),
 ]
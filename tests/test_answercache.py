@@ -0,0 +1,132 @@
+# #
+# # SEA / SMART ENGINEERING ASSISTANT
+# # Copyright (c) 2024 SilentByte <https://silentbyte.com/>
+# #
+
+import pytest
+
+from sea import utils
+from sea.answercache import SemanticAnswerCache, history_fingerprint, read_index_version, write_index_version
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(utils, 'epoch', clock)
+
+    return clock
+
+
+def test_exact_lookup_normalizes_question_and_respects_history(clock):
+    cache = SemanticAnswerCache()
+    fingerprint = history_fingerprint([])
+
+    cache.put('How do I replace the gasket?', fingerprint, None, 'answer', None)
+
+    assert cache.get_exact('  how do I REPLACE the gasket ', fingerprint) == 'answer'
+    assert cache.get_exact('How do I replace the gasket?', history_fingerprint([('user', 'Pump P-100')])) is None
+    assert cache.stats.hits == 1
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = SemanticAnswerCache(ttl=60)
+    cache.put('question', 'f', [1.0, 0.0], 'answer', None)
+
+    clock.now += 60
+    assert cache.get_exact('question', 'f') == 'answer'
+    assert cache.get_similar('f', [1.0, 0.0]) == 'answer'
+
+    clock.now += 1
+    assert cache.get_similar('f', [1.0, 0.0]) is None
+    assert cache.get_exact('question', 'f') is None
+    assert len(cache) == 0
+
+
+def test_least_recently_used_entries_are_evicted(clock):
+    cache = SemanticAnswerCache(max_entries=2)
+
+    cache.put('a', 'f', None, 'A', None)
+    cache.put('b', 'f', None, 'B', None)
+    assert cache.get_exact('a', 'f') == 'A'
+
+    cache.put('c', 'f', None, 'C', None)
+
+    assert cache.get_exact('b', 'f') is None
+    assert cache.get_exact('a', 'f') == 'A'
+    assert cache.get_exact('c', 'f') == 'C'
+    assert cache.stats.evictions == 1
+
+
+def test_similar_lookup_uses_threshold_and_fingerprint(clock):
+    cache = SemanticAnswerCache(similarity_threshold=0.95)
+
+    cache.put('torque of bolt m8', 'f', [1.0, 0.0, 0.0], 'close', None)
+    cache.put('casual question', 'f', None, 'casual', None)
+
+    assert cache.get_similar('f', [0.99, 0.05, 0.0]) == 'close'
+    assert cache.get_similar('f', [0.5, 0.5, 0.0]) is None
+    assert cache.get_similar('g', [1.0, 0.0, 0.0]) is None
+    assert cache.stats.semantic_hits == 1
+    assert cache.stats.misses == 2
+
+
+def test_cache_is_cleared_when_index_version_changes(clock):
+    index_version = '1'
+    cache = SemanticAnswerCache(index_version=lambda: index_version, version_check_interval=5.0)
+
+    version = cache.version()
+    assert version == '1'
+
+    cache.put('question', 'f', None, 'answer', version)
+    assert cache.get_exact('question', 'f') == 'answer'
+
+    # The version is only read again once the check interval has elapsed.
+    index_version = '2'
+    clock.now += 1
+    assert cache.get_exact('question', 'f') == 'answer'
+
+    clock.now += 5
+    assert cache.get_exact('question', 'f') is None
+    assert cache.version() == '2'
+    assert cache.stats.invalidations == 1
+
+
+def test_answers_generated_with_previous_version_are_not_cached(clock):
+    index_version = '1'
+    cache = SemanticAnswerCache(index_version=lambda: index_version, version_check_interval=0.0)
+
+    version = cache.version()
+
+    # The index changes while the answer is being generated.
+    index_version = '2'
+    clock.now += 1
+    cache.put('question', 'f', None, 'stale answer', version)
+
+    assert cache.get_exact('question', 'f') is None
+    assert len(cache) == 0
+
+    cache.put('question', 'f', None, 'answer', cache.version())
+    assert cache.get_exact('question', 'f') == 'answer'
+
+
+def test_index_version_file(tmp_path):
+    file_name = str(tmp_path / 'cache' / 'index_version')
+    assert read_index_version(file_name) is None
+
+    version = write_index_version(file_name)
+    assert read_index_version(file_name) == version
+
+    cache = SemanticAnswerCache(
+        index_version=lambda: read_index_version(file_name),
+        version_check_interval=0.0,
+    )
+
+    assert cache.version() == version
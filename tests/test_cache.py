@@ -0,0 +1,61 @@
+# #
+# # SEA / SMART ENGINEERING ASSISTANT
+# # Copyright (c) 2024 SilentByte <https://silentbyte.com/>
+# #
+
+import shutil
+
+import pytest
+
+from sea.cache import chunk_cache_key, chunk_id
+from sea.config import SeaConfig
+from sea.dataprocessing import DEFAULT_TEXT_NORMALIZER, TextNormalizer
+
+
+@pytest.fixture(scope='module')
+def spark():
+    if shutil.which('java') is None:
+        pytest.skip('Spark requires a Java runtime')
+
+    from pyspark.sql import SparkSession
+
+    spark = SparkSession.builder.master('local[1]').appName('sea-tests').getOrCreate()
+    yield spark
+    spark.stop()
+
+
+def test_chunk_ids_depend_on_chunking_parameters():
+    key = chunk_cache_key('abc', 640, 60, DEFAULT_TEXT_NORMALIZER.version)
+
+    assert key == chunk_cache_key('abc', 640, 60, DEFAULT_TEXT_NORMALIZER.version)
+    assert key != chunk_cache_key('abd', 640, 60, DEFAULT_TEXT_NORMALIZER.version)
+    assert key != chunk_cache_key('abc', 512, 60, DEFAULT_TEXT_NORMALIZER.version)
+    assert key != chunk_cache_key('abc', 640, 60, TextNormalizer([r'^Draft$'], []).version)
+
+    assert len({chunk_id(key, chunk_no) for chunk_no in range(100)}) == 100
+
+
+def test_spark_chunk_ids_match_local_chunk_ids(spark):
+    # Imported late because the Spark UDFs can only be defined once a session exists.
+    from sea.sea import SeaRuntime
+
+    config = SeaConfig(chunk_size=512, chunk_overlap=48)
+    runtime = SeaRuntime(config, spark, dbutils=None)
+    normalizer = TextNormalizer([r'^Draft$'], [r'ACME\s*'])
+
+    rows = [(file_hash, chunk_no) for file_hash in ('0' * 64, 'f' * 64, 'abc') for chunk_no in (0, 1, 17)]
+
+    spark_rows = (
+        spark.createDataFrame(rows, 'file_hash STRING, chunk_no INT')
+        .withColumn('chunk_key', runtime.chunk_cache_key_column(normalizer))
+        .withColumn('id', runtime.chunk_id_column())
+        .collect()
+    )
+
+    assert len(spark_rows) == len(rows)
+
+    for row in spark_rows:
+        key = chunk_cache_key(row['file_hash'], config.chunk_size, config.chunk_overlap, normalizer.version)
+
+        assert row['chunk_key'] == key
+        assert row['id'] == chunk_id(key, row['chunk_no'])
@@ -0,0 +1,183 @@
+# #
+# # SEA / SMART ENGINEERING ASSISTANT
+# # Copyright (c) 2024 SilentByte <https://silentbyte.com/>
+# #
+
+import json
+import random
+
+import pytest
+
+import fitz as pymupdf
+import llama_index.core
+
+from llama_index.core.schema import Document
+from llama_index.core.node_parser import SentenceSplitter
+
+from sea import dataprocessing
+from sea.dataprocessing import (
+    LocalizedText,
+    PageOffsetMap,
+    TextNormalizer,
+    extract_document_pages,
+    extract_document_pages_parallel,
+    split_page_sentence_chunks,
+)
+
+
+def write_rule_pack(tmp_path, rule_pack: dict) -> str:
+    file_name = tmp_path / 'rule_pack.json'
+    file_name.write_text(json.dumps(rule_pack), encoding='utf-8')
+
+    return str(file_name)
+
+
+def test_rule_pack_pattern_with_group(tmp_path):
+    normalizer = TextNormalizer.from_rule_packs([write_rule_pack(tmp_path, {
+        'drop': [r'^(Rev|Revision)\s+\d+$'],
+        'strip': [r'(Copyright|\(c\))\s+ACME\s*'],
+    })])
+
+    assert normalizer.normalize('Revision 12') is None
+    assert normalizer.normalize('rev 3') is None
+    assert normalizer.normalize('Revision 12 replaces the gasket') == 'Revision 12 replaces the gasket'
+    assert normalizer.normalize('Copyright ACME Replace the gasket.') == 'Replace the gasket.'
+    assert normalizer.normalize('42') is None
+
+
+@pytest.mark.parametrize('pattern', [
+    r'^(\w+) \1$',
+    r'^(?P<word>\w+) (?P=word)$',
+    r'(?i)^draft$',
+])
+def test_rule_pack_rejects_uncombinable_patterns(tmp_path, pattern):
+    with pytest.raises(ValueError):
+        TextNormalizer.from_rule_packs([write_rule_pack(tmp_path, {'drop': [pattern]})])
+
+
+def test_rule_pack_rejects_invalid_patterns(tmp_path):
+    with pytest.raises(ValueError):
+        TextNormalizer.from_rule_packs([write_rule_pack(tmp_path, {'strip': [r'(unbalanced']})])
+
+
+def test_strip_patterns_apply_in_order():
+    normalizer = TextNormalizer([], [r'B', r'AC'])
+
+    assert normalizer.normalize('xABCx') == 'xx'
+
+
+def write_document(tmp_path, page_texts: list[str]) -> str:
+    file_name = str(tmp_path / 'document.pdf')
+
+    with pymupdf.open() as document:
+        for text in page_texts:
+            page = document.new_page()
+            if text:
+                page.insert_text((72, 72), text)
+
+        document.save(file_name)
+
+    return file_name
+
+
+def test_parallel_page_extraction_matches_sequential(tmp_path):
+    page_texts = [f'Step {i}: tighten bolt {i} to {i * 5} Nm.' if i % 7 else '' for i in range(50)]
+    file_name = write_document(tmp_path, page_texts)
+
+    pages = list(extract_document_pages(file_name))
+    parallel_pages = list(extract_document_pages_parallel(file_name, max_workers=3, pages_per_task=4))
+
+    assert len(pages) == len([t for t in page_texts if t])
+    assert parallel_pages == pages
+
+
+@pytest.fixture
+def word_tokenizer(monkeypatch):
+    # The chunking tokenizer is not available offline; splitting on whitespace is enough to compare chunk boundaries.
+    monkeypatch.setattr(llama_index.core, 'global_tokenizer', str.split)
+    monkeypatch.setattr(dataprocessing, 'initialize_tokenizer', lambda *args, **kwargs: None)
+
+
+def generate_pages(page_count: int, skip_every: int = 0) -> list[LocalizedText]:
+    rng = random.Random(page_count)
+    words = ['torque', 'bolt', 'gasket', 'valve', 'pump', 'seal', 'flange', 'shaft', 'bearing', 'housing']
+
+    pages = []
+    for page_no in range(page_count):
+        # Empty pages are never yielded by the page extraction, so page numbers may have gaps.
+        if skip_every and page_no % skip_every == 0:
+            continue
+
+        sentences = [
+            ' '.join(rng.choice(words) for _ in range(rng.randint(4, 20))).capitalize() + '.'
+            for _ in range(rng.randint(1, 12))
+        ]
+
+        pages.append(LocalizedText(' '.join(sentences), page_no, page_no))
+
+    return pages
+
+
+def split_whole_document(pages: list[LocalizedText], chunk_size: int, chunk_overlap: int) -> list[LocalizedText]:
+    # Splits the entire document at once like the chunker did before it was streamed.
+    document_text = ''
+    page_ends = []
+
+    for page in pages:
+        document_text += page.text + '\n'
+        page_ends.append((len(document_text), page.start_page_no))
+
+    def find_page_no(char_idx: int) -> int:
+        return next((page_no for end, page_no in page_ends if end > char_idx), page_ends[-1][1])
+
+    sentence_splitter = SentenceSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+
+    return [
+        LocalizedText(node.text, find_page_no(node.start_char_idx), find_page_no(node.end_char_idx - 1))
+        for node in sentence_splitter.get_nodes_from_documents([Document(text=document_text)])
+    ]
+
+
+@pytest.mark.parametrize('chunk_size, chunk_overlap, window_page_count', [
+    (64, 8, 1),
+    (64, 8, 4),
+    (128, 16, 16),
+    (256, 32, 3),
+])
+def test_streamed_chunks_match_whole_document_chunks(word_tokenizer, chunk_size, chunk_overlap, window_page_count):
+    pages = generate_pages(60, skip_every=7)
+
+    chunks = list(split_page_sentence_chunks(
+        pages=iter(pages),
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        window_page_count=window_page_count,
+    ))
+
+    expected_chunks = split_whole_document(pages, chunk_size, chunk_overlap)
+
+    assert [c.text for c in chunks] == [c.text for c in expected_chunks]
+    assert chunks == expected_chunks
+    assert any(c.start_page_no != c.end_page_no for c in chunks)
+
+
+def test_page_offset_map_page_ranges():
+    page_offset_map = PageOffsetMap()
+    assert page_offset_map.find_page_no(10) == 0
+
+    # Pages 0, 2, and 5 are 10, 5, and 20 characters long.
+    page_offset_map.append(0, 10)
+    page_offset_map.append(2, 5)
+    page_offset_map.append(5, 20)
+
+    assert len(page_offset_map) == 3
+    assert page_offset_map.end_offset == 35
+
+    assert [page_offset_map.find_page_no(i) for i in (0, 9, 10, 14, 15, 34)] == [0, 0, 2, 2, 5, 5]
+    assert page_offset_map.find_page_no(100) == 5
+
+    assert page_offset_map.find_page_range(0, 10) == (0, 0)
+    assert page_offset_map.find_page_range(5, 11) == (0, 2)
+    assert page_offset_map.find_page_range(10, 15) == (2, 2)
+    assert page_offset_map.find_page_range(8, 30) == (0, 5)
+    assert page_offset_map.find_page_range(12, 12) == (2, 2)
@@ -0,0 +1,66 @@
+# #
+# # SEA / SMART ENGINEERING ASSISTANT
+# # Copyright (c) 2024 SilentByte <https://silentbyte.com/>
+# #
+
+import threading
+import time
+
+from sea.embedding import (
+    AdaptiveBatchSizer,
+    EmbeddingBackend,
+    EmbeddingRequestStats,
+    compute_buffered_embeddings,
+)
+
+
+class ConcurrencyTrackingBackend(EmbeddingBackend):
+    model_name = 'test'
+
+    def __init__(self):
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.batch_sizes = []
+        self._lock = threading.Lock()
+
+    def embed(self, texts: list[str]) -> list[list[float]]:
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            self.batch_sizes.append(len(texts))
+
+        time.sleep(0.02)
+
+        with self._lock:
+            self.in_flight -= 1
+
+        return [[float(text)] for text in texts]
+
+
+def test_buffered_embeddings_run_requests_concurrently():
+    # 40 Arrow batches of 16 texts, the default maxRecordsPerBatch of the Spark runtime.
+    text_batches = [[str(b * 16 + i) for i in range(16)] for b in range(40)]
+    backend = ConcurrencyTrackingBackend()
+    request_stats = EmbeddingRequestStats()
+
+    results = list(compute_buffered_embeddings(
+        backend=backend,
+        text_batches=iter(text_batches),
+        batch_sizer=AdaptiveBatchSizer(),
+        request_stats=request_stats,
+    ))
+
+    assert [len(r) for r in results] == [16] * 40
+    assert [float(v) for r in results for v in r[:, 0]] == [float(t) for b in text_batches for t in b]
+
+    assert backend.max_in_flight > 1
+    assert max(backend.batch_sizes) > 16
+    assert request_stats.requests < len(text_batches)
+
+
+def test_buffered_embeddings_flush_remaining_and_empty_batches():
+    backend = ConcurrencyTrackingBackend()
+    results = list(compute_buffered_embeddings(backend, iter([['1', '2'], [], ['3']])))
+
+    assert [len(r) for r in results] == [2, 0, 1]
+    assert [float(v) for r in results for v in r[:, 0]] == [1.0, 2.0, 3.0]
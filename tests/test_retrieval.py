@@ -0,0 +1,106 @@
+# #
+# # SEA / SMART ENGINEERING ASSISTANT
+# # Copyright (c) 2024 SilentByte <https://silentbyte.com/>
+# #
+
+import time
+import asyncio
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from langchain.schema.embeddings import Embeddings
+
+from sea.retrieval import MemoizedQueryEmbeddings
+
+
+class CountingEmbeddings(Embeddings):
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def _embed(self, text: str) -> list[float]:
+        with self._lock:
+            self.requests += 1
+
+        if self.fail:
+            raise ValueError('Embedding endpoint unavailable')
+
+        return [float(len(text)), 1.0]
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return [self._embed(t) for t in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        time.sleep(0.05)
+        return self._embed(text)
+
+    async def aembed_query(self, text: str) -> list[float]:
+        await asyncio.sleep(0.05)
+        return self._embed(text)
+
+
+def test_concurrent_queries_share_one_request():
+    embeddings = CountingEmbeddings()
+    memoized_embeddings = MemoizedQueryEmbeddings(embeddings)
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(memoized_embeddings.embed_query, ['torque'] * 4))
+
+    assert results == [[6.0, 1.0]] * 4
+    assert embeddings.requests == 1
+
+    assert memoized_embeddings.embed_query('torque') == [6.0, 1.0]
+    assert embeddings.requests == 1
+
+
+def test_concurrent_async_queries_share_one_request():
+    embeddings = CountingEmbeddings()
+    memoized_embeddings = MemoizedQueryEmbeddings(embeddings)
+
+    async def embed_concurrently():
+        # The speculative search may run the synchronous retriever on a thread while the answer cache is looked up.
+        search = asyncio.get_running_loop().run_in_executor(None, memoized_embeddings.embed_query, 'torque')
+        return await asyncio.gather(
+            memoized_embeddings.aembed_query('torque'),
+            memoized_embeddings.aembed_query('torque'),
+            search,
+        )
+
+    assert asyncio.run(embed_concurrently()) == [[6.0, 1.0]] * 3
+    assert embeddings.requests == 1
+
+
+def test_cancelled_query_does_not_cancel_waiting_queries():
+    embeddings = CountingEmbeddings()
+    memoized_embeddings = MemoizedQueryEmbeddings(embeddings)
+
+    async def embed_after_cancellation():
+        search = asyncio.create_task(memoized_embeddings.aembed_query('torque'))
+        await asyncio.sleep(0)
+
+        lookup = asyncio.create_task(memoized_embeddings.aembed_query('torque'))
+        await asyncio.sleep(0)
+
+        search.cancel()
+        return await lookup
+
+    assert asyncio.run(embed_after_cancellation()) == [6.0, 1.0]
+
+
+def test_failed_query_is_not_memoized():
+    embeddings = CountingEmbeddings(fail=True)
+    memoized_embeddings = MemoizedQueryEmbeddings(embeddings)
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futures = [executor.submit(memoized_embeddings.embed_query, 'torque') for _ in range(2)]
+
+        for future in futures:
+            with pytest.raises(ValueError):
+                future.result()
+
+    embeddings.fail = False
+    assert memoized_embeddings.embed_query('torque') == [6.0, 1.0]